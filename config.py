@@ -3,6 +3,11 @@
 TARGET_WIDTH = 1240
 TARGET_HEIGHT = 1754
 
+# Busca do contorno da folha em resolucao reduzida (lado maior, px) e
+# refinamento subpixel dos cantos na resolucao original.
+CONTOUR_MAX_SIDE = 1024
+CONTOUR_REFINE_SUBPIX = True
+
 # ROI (fracoes relativas apos homografia): x1, y1, x2, y2
 # Ajustar para cobrir apenas a area dos palos.
 ROI_X1 = 0.03
@@ -15,6 +20,10 @@ ADAPTIVE_BLOCK_SIZE = 31
 ADAPTIVE_C = 12
 CLAHE_CLIP_LIMIT = 2.0
 CLAHE_GRID_SIZE = (8, 8)
+# Backend de binarizacao: bilateral (padrao, mais lento), median, box, sauvola
+BINARIZE_METHOD = "bilateral"
+SAUVOLA_K = 0.2
+SAUVOLA_R = 128.0
 
 # Deteccao de palo
 MIN_AREA = 18
@@ -34,3 +43,13 @@ DEFAULT_TIME_PER_BLOCK_SECONDS = 60
 DEFAULT_BLOCK_SIZE_LINES = 5
 DEFAULT_ERROR_PENALTY = 1.0
 DEFAULT_VARIABILITY_PENALTY_FACTOR = 0.05
+
+# Cache de resultados da visao computacional (src/cache.py)
+RESULT_CACHE_MAX_MB = 512
+# Cache dos estagios intermediarios (imagem alinhada, binaria da ROI)
+STAGE_CACHE_MAX_MB = 2048
+
+# Instrumentacao por estagio (process_image(trace=True), src/tracing.py).
+# Medir o pico de alocacao liga o tracemalloc no processo inteiro, que custa
+# bem mais que os relogios (~20% por folha); fica desligado por padrao.
+TRACE_MEMORY = False
@@ -6,7 +6,7 @@ from tkinter import filedialog, messagebox, ttk
 
 from src.pipeline import parse_roi_frac, process_image
 from src.scorer import evaluate_manual_assessment, parse_block_totals_text, parse_irregularities_text
-from src.ml_models import fuse_ml_with_rules, load_ml_model, predict_ml_classes
+from src.ml_models import fuse_ml_with_rules, get_ml_model, predict_ml_classes
 
 
 def _is_blank(value: str) -> bool:
@@ -436,6 +436,7 @@ class App(tk.Tk):
                     output_dir=out,
                     save_artifacts=True,
                     swap_lr_margins=self.swap_lr_margins_var.get(),
+                    metrics_only=True,
                 )
                 auto_metrics = auto.metrics
                 output_files["overlay"] = str(Path(out) / "overlay.jpg")
@@ -558,7 +559,7 @@ class App(tk.Tk):
                 return
             try:
                 ml_threshold = float(self.ml_threshold_var.get().strip() or "0.75")
-                ml_payload = load_ml_model(ml_path)
+                ml_payload = get_ml_model(ml_path)
                 ml_preds = predict_ml_classes(payload["metrics"], ml_payload)
                 payload["metrics"] = fuse_ml_with_rules(
                     payload["metrics"],
@@ -1,9 +1,14 @@
 ﻿import argparse
 import json
+import sys
 from pathlib import Path
 
+from src.artifacts import ARTIFACTS, ArtifactWriter, resolve_artifacts
+from src.batch import collect_batch_inputs, run_batch
 from src.ml_models import fuse_ml_with_rules, load_ml_model, predict_ml_classes
-from src.pipeline import parse_roi_frac, process_image
+from src.pipeline import ALIGN_MODES, parse_roi_frac, process_image
+from src.preprocessor import BINARIZE_METHODS
+from src.tracing import append_trace_jsonl, write_chrome_trace
 
 
 def parse_args():
@@ -29,23 +34,113 @@ def parse_args():
         help="assist=nao altera classes; hybrid=aplica por confianca; override=sempre aplica ML",
     )
     parser.add_argument("--ml-threshold", type=float, default=0.75, help="Limiar de confianca para modo hybrid")
+    parser.add_argument(
+        "--binarize",
+        default="",
+        choices=["", *BINARIZE_METHODS],
+        help="Backend de binarizacao (padrao: BINARIZE_METHOD do config)",
+    )
+    parser.add_argument(
+        "--artifacts",
+        default="",
+        help=f"Artefatos a salvar, separados por virgula (padrao: todos: {','.join(ARTIFACTS)})",
+    )
+    parser.add_argument(
+        "--trace-out",
+        default="",
+        help="Mede tempo/CPU/memoria por estagio e grava em .jsonl (append) ou .json (formato Chrome trace)",
+    )
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-    roi_frac = parse_roi_frac(args.roi_frac)
+def parse_batch_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="main.py batch",
+        description="Processa um lote de folhas em paralelo (process pool).",
+    )
+    parser.add_argument("source", help="Diretorio, padrao glob ou CSV manifesto com coluna image_path")
+    parser.add_argument("--output-dir", default="output/lote", help="Diretorio de saida (um subdiretorio por folha)")
+    parser.add_argument("--workers", type=int, default=0, help="Processos paralelos (0 = numero de CPUs)")
+    parser.add_argument("--cv-threads", type=int, default=1, help="Threads do OpenCV por worker")
+    parser.add_argument("--roi-frac", default="", help="ROI em fracoes x1,y1,x2,y2")
+    parser.add_argument("--no-artifacts", action="store_true", help="Nao salva imagens/CSV por folha, so resultado.json")
+    parser.add_argument("--swap-lr-margins", action="store_true", help="Troca margem esquerda/direita.")
+    parser.add_argument("--ml-model", default="", help="Arquivo .pkl de modelo ML treinado")
+    parser.add_argument("--ml-mode", default="assist", choices=["assist", "hybrid", "override"])
+    parser.add_argument("--ml-threshold", type=float, default=0.75, help="Limiar de confianca para modo hybrid")
+    parser.add_argument("--binarize", default="", choices=["", *BINARIZE_METHODS], help="Backend de binarizacao")
+    parser.add_argument("--trace", action="store_true", help="Inclui tempos por estagio em metrics['trace'] de cada folha")
+    parser.add_argument(
+        "--align-mode",
+        default="page",
+        choices=ALIGN_MODES,
+        help="roi: warp direto para a ROI (mais rapido, so sem artefatos de imagem; medidas levemente diferentes)",
+    )
+    parser.add_argument(
+        "--artifacts",
+        default="",
+        help=f"Artefatos a salvar, separados por virgula (padrao: todos: {','.join(ARTIFACTS)})",
+    )
+    return parser.parse_args(argv)
 
-    result = process_image(
-        image_path=args.image,
-        errors=args.errors,
-        roi_frac=roi_frac,
+
+def main_batch(argv):
+    args = parse_batch_args(argv)
+    items = collect_batch_inputs(args.source)
+    if not items:
+        raise SystemExit(f"Nenhuma imagem encontrada em: {args.source}")
+
+    out = run_batch(
+        items,
         output_dir=args.output_dir,
-        save_artifacts=True,
+        workers=args.workers or None,
+        cv_threads=args.cv_threads,
+        roi_frac=parse_roi_frac(args.roi_frac),
+        save_artifacts=not args.no_artifacts,
         swap_lr_margins=args.swap_lr_margins,
+        ml_model_path=args.ml_model,
+        ml_mode=args.ml_mode,
+        ml_threshold=args.ml_threshold,
+        binarize_method=args.binarize or None,
+        trace=args.trace,
+        artifacts=resolve_artifacts(args.artifacts or None),
+        align_mode=args.align_mode,
     )
+    summary = out["summary"]
+    print("Lote concluido")
+    print(f"Imagens: {summary['num_images']} (ok: {summary['ok']}, erros: {summary['erros']})")
+    print(f"Resumo: {Path(args.output_dir) / 'resumo_lote.csv'}")
+
+
+def main():
+    if sys.argv[1:2] == ["batch"]:
+        main_batch(sys.argv[2:])
+        return
+
+    args = parse_args()
+    roi_frac = parse_roi_frac(args.roi_frac)
+
+    with ArtifactWriter() as writer:
+        result = process_image(
+            image_path=args.image,
+            errors=args.errors,
+            roi_frac=roi_frac,
+            output_dir=args.output_dir,
+            save_artifacts=True,
+            swap_lr_margins=args.swap_lr_margins,
+            binarize_method=args.binarize or None,
+            trace=bool(args.trace_out),
+            artifacts=resolve_artifacts(args.artifacts or None),
+            artifact_writer=writer,
+        )
     metrics = result.metrics
 
+    if args.trace_out:
+        if args.trace_out.endswith(".jsonl"):
+            append_trace_jsonl(args.trace_out, result.trace, image_path=args.image)
+        else:
+            write_chrome_trace(args.trace_out, [result.trace], names=[args.image])
+
     if args.ml_model:
         ml_payload = load_ml_model(args.ml_model)
         ml_preds = predict_ml_classes(metrics, ml_payload)
@@ -76,6 +171,8 @@ def main():
         print("ML ativo: predicoes em metrics['ml_predictions']")
         print(f"ML fusion mode: {metrics.get('ml_fusion', {}).get('mode')}")
     print(f"Score final: {metrics['score_final']}")
+    if args.trace_out:
+        print(f"Trace por estagio: {args.trace_out}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+﻿import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+
+# Artefatos de save_outputs. As imagens exigem a pagina alinhada (e o overlay
+# desenhado sobre ela); os demais saem so das medidas.
+IMAGE_ARTIFACTS = ("aligned", "roi", "binary", "overlay")
+DATA_ARTIFACTS = ("line_counts", "resultado")
+ARTIFACTS = IMAGE_ARTIFACTS + DATA_ARTIFACTS
+
+
+def resolve_artifacts(artifacts: Optional[Sequence[str]]) -> Tuple[str, ...]:
+    """None = todos. Aceita lista ou texto separado por virgula."""
+    if artifacts is None:
+        return ARTIFACTS
+    if isinstance(artifacts, str):
+        artifacts = [a for a in artifacts.split(",")]
+    names = tuple(a.strip().lower() for a in artifacts if a and a.strip())
+    unknown = [a for a in names if a not in ARTIFACTS]
+    if unknown:
+        raise ValueError(f"Artefato invalido: {', '.join(unknown)} (opcoes: {', '.join(ARTIFACTS)})")
+    return names
+
+
+class ArtifactWriter:
+    """
+    Grava artefatos em threads de fundo (cv2.imwrite libera o GIL).
+
+    A fila e limitada a max_pending gravacoes: submit bloqueia quando ela
+    enche, entao as imagens pendentes nao acumulam sem limite. flush() e a
+    barreira: espera tudo que foi submetido e relanca o primeiro erro.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 8):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="artefatos")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._pending: List[Future] = []
+
+    def submit(self, fn: Callable, *args) -> Future:
+        self._slots.acquire()
+        try:
+            fut = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._pending.append(fut)
+        return fut
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        error = None
+        for fut in pending:
+            exc = fut.exception()
+            if exc is not None and error is None:
+                error = exc
+        if error is not None:
+            raise error
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "ArtifactWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # Ja ha uma excecao subindo: espera as gravacoes sem relancar a falha
+        # delas, que esconderia o erro original.
+        try:
+            self.flush()
+        except Exception:
+            pass
+        finally:
+            self._pool.shutdown(wait=True)
@@ -0,0 +1,221 @@
+﻿import csv
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+
+from src.artifacts import IMAGE_ARTIFACTS, ArtifactWriter, resolve_artifacts
+from src.ml_models import fuse_ml_with_rules, get_ml_model, predict_ml_classes
+from src.pipeline import process_image
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+SUMMARY_FIELDS = [
+    "image_path",
+    "status",
+    "output_dir",
+    "total",
+    "linhas",
+    "media_por_linha",
+    "nor",
+    "score_final",
+    "auto_quality",
+    "requires_manual_review",
+    "erro",
+]
+
+# Estado por processo worker (preenchido em _init_worker).
+_WORKER_STATE: Dict = {}
+
+
+def collect_batch_inputs(source: str) -> List[Dict]:
+    """
+    Resolve a entrada do lote em uma lista de {"image_path", "errors"}.
+    Aceita diretorio, padrao glob ou CSV manifesto com coluna image_path.
+    """
+    path = Path(source)
+    if path.is_dir():
+        images = sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        return [{"image_path": str(p), "errors": 0} for p in images]
+
+    if path.is_file() and path.suffix.lower() == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        items = []
+        for row in rows:
+            image_path = (row.get("image_path") or "").strip()
+            if not image_path:
+                continue
+            items.append({"image_path": image_path, "errors": int(row.get("errors", 0) or 0)})
+        return items
+
+    if path.is_file():
+        return [{"image_path": str(path), "errors": 0}]
+
+    matches = sorted(glob.glob(source, recursive=True))
+    return [{"image_path": p, "errors": 0} for p in matches if Path(p).suffix.lower() in IMAGE_EXTENSIONS]
+
+
+def _sheet_output_dirs(items: List[Dict], output_dir: str) -> List[str]:
+    # Um subdiretorio por folha; nomes repetidos ganham sufixo numerico. O
+    # sufixo avanca ate um nome livre: "folha_2" pode ser o nome de outra foto.
+    taken = set()
+    next_suffix: Dict[str, int] = {}
+    dirs = []
+    for item in items:
+        stem = Path(item["image_path"]).stem or "folha"
+        name = stem
+        n = next_suffix.get(stem, 1)
+        while name in taken:
+            n += 1
+            name = f"{stem}_{n}"
+        next_suffix[stem] = n
+        taken.add(name)
+        dirs.append(str(Path(output_dir) / name))
+    return dirs
+
+
+def _init_worker(cv_threads: int, ml_model_path: str) -> None:
+    # Evita oversubscription: cada worker usa poucas threads do OpenCV.
+    cv2.setNumThreads(max(0, int(cv_threads)))
+    # Arrays do modelo mapeados do arquivo (mmap) em vez de copiados por worker.
+    _WORKER_STATE["ml_payload"] = get_ml_model(ml_model_path) if ml_model_path else None
+    # JPEGs codificados em threads de fundo enquanto o worker segue com a folha.
+    _WORKER_STATE["writer"] = ArtifactWriter()
+
+
+def _process_sheet(item: Dict, sheet_dir: str, options: Dict) -> Dict:
+    image_path = item["image_path"]
+    summary = {"image_path": image_path, "status": "ok", "output_dir": sheet_dir}
+    writer = _WORKER_STATE.get("writer")
+    error = None
+    try:
+        selected = resolve_artifacts(options.get("artifacts"))
+        # resultado.json e gravado aqui, depois da fusao com o ML.
+        artifacts = [a for a in selected if a != "resultado"]
+        result = process_image(
+            image_path=image_path,
+            errors=int(item.get("errors", 0) or 0),
+            roi_frac=options.get("roi_frac"),
+            output_dir=sheet_dir,
+            save_artifacts=options.get("save_artifacts", True),
+            swap_lr_margins=options.get("swap_lr_margins", False),
+            binarize_method=options.get("binarize_method"),
+            align_mode=options.get("align_mode", "page"),
+            trace=options.get("trace", False),
+            artifacts=artifacts,
+            artifact_writer=writer,
+            metrics_only=True,
+        )
+        metrics = result.metrics
+
+        ml_payload = _WORKER_STATE.get("ml_payload")
+        if ml_payload:
+            ml_preds = predict_ml_classes(metrics, ml_payload)
+            metrics = fuse_ml_with_rules(
+                metrics,
+                ml_preds,
+                mode=options.get("ml_mode", "assist"),
+                confidence_threshold=options.get("ml_threshold", 0.75),
+            )
+
+        if "resultado" in selected:
+            os.makedirs(sheet_dir, exist_ok=True)
+            with open(Path(sheet_dir) / "resultado.json", "w", encoding="utf-8") as f:
+                json.dump({"line_counts": result.line_counts, "metrics": metrics}, f, ensure_ascii=False, indent=2)
+    except Exception as exc:
+        error = exc
+
+    # Barreira: a folha so conta como ok com os artefatos no disco. Roda
+    # tambem quando a folha falhou, para que gravacoes pendentes dela nao
+    # sejam cobradas da proxima folha do worker.
+    if writer is not None:
+        try:
+            writer.flush()
+        except Exception as exc:
+            error = error or exc
+
+    if error is not None:
+        summary.update({"status": "erro", "erro": f"{type(error).__name__}: {error}"})
+        return summary
+
+    auto_quality = metrics.get("auto_quality", {})
+    summary.update(
+        {
+            "total": metrics.get("total"),
+            "linhas": metrics.get("linhas"),
+            "media_por_linha": metrics.get("media_por_linha"),
+            "nor": metrics.get("nor"),
+            "score_final": metrics.get("score_final"),
+            "auto_quality": auto_quality.get("score"),
+            "requires_manual_review": auto_quality.get("requires_manual_review"),
+        }
+    )
+    return summary
+
+
+def run_batch(
+    items: List[Dict],
+    output_dir: str,
+    workers: Optional[int] = None,
+    cv_threads: int = 1,
+    roi_frac: Optional[Tuple[float, float, float, float]] = None,
+    save_artifacts: bool = True,
+    swap_lr_margins: bool = False,
+    ml_model_path: str = "",
+    ml_mode: str = "assist",
+    ml_threshold: float = 0.75,
+    binarize_method: Optional[str] = None,
+    trace: bool = False,
+    artifacts: Optional[Sequence[str]] = None,
+    align_mode: str = "page",
+) -> Dict:
+    if align_mode == "roi" and save_artifacts and any(a in IMAGE_ARTIFACTS for a in resolve_artifacts(artifacts)):
+        raise ValueError("align_mode='roi' nao gera a pagina alinhada; use --artifacts sem imagens ou --no-artifacts")
+    os.makedirs(output_dir, exist_ok=True)
+    options = {
+        "roi_frac": roi_frac,
+        "save_artifacts": save_artifacts,
+        "swap_lr_margins": swap_lr_margins,
+        "ml_mode": ml_mode,
+        "ml_threshold": ml_threshold,
+        "binarize_method": binarize_method,
+        "trace": trace,
+        "artifacts": artifacts,
+        "align_mode": align_mode,
+    }
+    sheet_dirs = _sheet_output_dirs(items, output_dir)
+    workers = max(1, int(workers or os.cpu_count() or 1))
+
+    rows: List[Optional[Dict]] = [None] * len(items)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(cv_threads, ml_model_path),
+    ) as pool:
+        futures = {pool.submit(_process_sheet, item, d, options): i for i, (item, d) in enumerate(zip(items, sheet_dirs))}
+        for fut in as_completed(futures):
+            rows[futures[fut]] = fut.result()
+
+    summary = {
+        "num_images": len(rows),
+        "ok": sum(1 for r in rows if r["status"] == "ok"),
+        "erros": sum(1 for r in rows if r["status"] != "ok"),
+        "workers": workers,
+        "cv_threads": cv_threads,
+    }
+
+    with open(Path(output_dir) / "resumo_lote.csv", "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    with open(Path(output_dir) / "resumo_lote.json", "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "per_image": rows}, f, ensure_ascii=False, indent=2)
+
+    return {"summary": summary, "per_image": rows}
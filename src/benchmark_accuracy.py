@@ -4,12 +4,15 @@ import json
 import sys
 from pathlib import Path
 from statistics import mean
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from src.ml_models import TARGET_MAP, fuse_ml_with_rules, load_ml_model, predict_ml_classes
+from src.ml_models import fused_labels, load_ml_model, predict_ml_classes_batch, rule_label
 from src.pipeline import parse_roi_frac, process_image
 
 
@@ -18,22 +21,33 @@ def parse_args():
     p.add_argument("--labels", required=True, help="CSV com image_path e colunas target_*")
     p.add_argument("--ml-model", default="", help="Modelo ML .pkl (opcional)")
     p.add_argument("--roi-frac", default="", help="ROI em fracoes")
+    p.add_argument("--cache-dir", default="", help="Diretorio de cache das medidas de visao computacional (opcional)")
+    p.add_argument(
+        "--stage-cache-dir",
+        default="",
+        help="Cache de estagios intermediarios (alinhada/binaria) para varreduras de parametros",
+    )
     p.add_argument("--output", default="output/benchmark_report.json", help="JSON de saida")
     p.add_argument("--ml-threshold", type=float, default=0.75, help="Threshold para modo hybrid")
+    p.add_argument(
+        "--sweep-thresholds",
+        default="",
+        help="Varre thresholds do modo hybrid sem reprocessar imagens: 'ini:fim:passo' ou lista '0.6,0.7,0.8'",
+    )
     return p.parse_args()
 
 
-def _extract_pred(metrics, target_col):
-    target_info = TARGET_MAP.get(target_col)
-    if not target_info:
-        return None
-    class_key, is_dict = target_info
-    c = metrics.get("classificacoes", {}).get(class_key)
-    if is_dict:
-        if isinstance(c, dict):
-            return c.get("nivel")
-        return None
-    return c
+def parse_thresholds(spec: str) -> List[float]:
+    spec = (spec or "").strip()
+    if not spec:
+        return []
+    if ":" in spec:
+        start, stop, step = (float(v) for v in spec.split(":"))
+        if step <= 0:
+            raise ValueError("Passo da varredura deve ser positivo")
+        n = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 6) for i in range(max(0, n))]
+    return [float(v) for v in spec.split(",") if v.strip()]
 
 
 def _acc(trues, preds):
@@ -44,9 +58,69 @@ def _acc(trues, preds):
     return ok / len(valid)
 
 
+def hybrid_threshold_sweep(
+    truths: Sequence[str],
+    rule_preds: Sequence[Optional[str]],
+    ml_preds: Sequence[Optional[str]],
+    ml_confs: Sequence[Optional[float]],
+    thresholds: Sequence[float],
+) -> List[Optional[float]]:
+    """
+    Acuracia do modo hybrid para cada threshold, de uma vez: matriz
+    (thresholds x folhas) com a classe ML onde confidence >= threshold e a
+    das regras no resto. Mesma regra de _acc (ignora vazios).
+    """
+    truth = np.array([t or "" for t in truths], dtype=object)
+    rules = np.array([p or "" for p in rule_preds], dtype=object)
+    ml = np.array([p or "" for p in ml_preds], dtype=object)
+    conf = np.array([np.nan if c is None else float(c) for c in ml_confs], dtype=np.float64)
+    thr = np.asarray(thresholds, dtype=np.float64)
+
+    with np.errstate(invalid="ignore"):
+        use_ml = conf[np.newaxis, :] >= thr[:, np.newaxis]
+    preds = np.where(use_ml, ml[np.newaxis, :], rules[np.newaxis, :])
+    valid = (truth != "")[np.newaxis, :] & (preds != "")
+    ok = (valid & (preds == truth[np.newaxis, :])).sum(axis=1)
+    n_valid = valid.sum(axis=1)
+    return [float(k) / n if n else None for k, n in zip(ok, n_valid)]
+
+
+def _sweep_report(thresholds: List[float], curves: Dict[str, List[Optional[float]]]) -> Dict:
+    def _best(curve):
+        scored = [(a, t) for a, t in zip(curve, thresholds) if a is not None]
+        if not scored:
+            return None, None
+        # Empate: fica o menor threshold (o primeiro da varredura).
+        acc, thr = max(scored, key=lambda at: at[0])
+        return thr, round(acc, 4)
+
+    per_target = {}
+    for t, curve in curves.items():
+        best_thr, best_acc = _best(curve)
+        per_target[t] = {
+            "accuracy": [round(a, 4) if a is not None else None for a in curve],
+            "best_threshold": best_thr,
+            "best_accuracy": best_acc,
+        }
+
+    overall = []
+    for i in range(len(thresholds)):
+        vals = [c[i] for c in curves.values() if c[i] is not None]
+        overall.append(mean(vals) if vals else None)
+    best_thr, best_acc = _best(overall)
+    return {
+        "thresholds": thresholds,
+        "per_target": per_target,
+        "overall_accuracy_mean": [round(a, 4) if a is not None else None for a in overall],
+        "best_threshold": best_thr,
+        "best_overall_accuracy": best_acc,
+    }
+
+
 def main():
     args = parse_args()
     roi_frac = parse_roi_frac(args.roi_frac) if args.roi_frac else None
+    thresholds = parse_thresholds(args.sweep_thresholds)
 
     with open(args.labels, "r", encoding="utf-8-sig", newline="") as f:
         rows = list(csv.DictReader(f))
@@ -62,6 +136,9 @@ def main():
 
     mode_preds = {m: {t: [] for t in target_cols} for m in modes}
     truths = {t: [] for t in target_cols}
+    ml_labels = {t: [] for t in target_cols}
+    ml_confs = {t: [] for t in target_cols}
+    bases = []
 
     for row in rows:
         image_path = row.get("image_path", "").strip()
@@ -74,27 +151,29 @@ def main():
             roi_frac=roi_frac,
             output_dir=None,
             save_artifacts=False,
+            metrics_only=True,
+            cache_dir=args.cache_dir or None,
+            stage_cache_dir=args.stage_cache_dir or None,
         )
         base = result.metrics
+        bases.append(base)
 
         for t in target_cols:
             truths[t].append(row.get(t, "").strip())
-            mode_preds["rules"][t].append(_extract_pred(base, t))
-
-        if ml_payload:
-            preds = predict_ml_classes(base, ml_payload)
-
-            assist = json.loads(json.dumps(base))
-            assist = fuse_ml_with_rules(assist, preds, mode="assist", confidence_threshold=args.ml_threshold)
-            hybrid = json.loads(json.dumps(base))
-            hybrid = fuse_ml_with_rules(hybrid, preds, mode="hybrid", confidence_threshold=args.ml_threshold)
-            override = json.loads(json.dumps(base))
-            override = fuse_ml_with_rules(override, preds, mode="override", confidence_threshold=args.ml_threshold)
+            mode_preds["rules"][t].append(rule_label(base, t))
 
+    if ml_payload:
+        # Uma chamada vetorizada por alvo para todas as folhas; os modos de
+        # fusao sao avaliados sem copiar as metricas.
+        for base, preds in zip(bases, predict_ml_classes_batch(bases, ml_payload)):
+            fused = fused_labels(base, preds, thresholds=[args.ml_threshold])
             for t in target_cols:
-                mode_preds["ml_assist"][t].append(_extract_pred(assist, t))
-                mode_preds["ml_hybrid"][t].append(_extract_pred(hybrid, t))
-                mode_preds["ml_override"][t].append(_extract_pred(override, t))
+                mode_preds["ml_assist"][t].append(fused["assist"].get(t))
+                mode_preds["ml_hybrid"][t].append(fused["hybrid"][0].get(t))
+                mode_preds["ml_override"][t].append(fused["override"].get(t))
+                pred_data = preds.get(t) or {}
+                ml_labels[t].append(pred_data.get("pred"))
+                ml_confs[t].append(pred_data.get("confidence"))
 
     report = {"summary": {}, "per_target": {}}
 
@@ -122,6 +201,15 @@ def main():
         "ml_threshold": args.ml_threshold,
     }
 
+    if ml_payload and thresholds:
+        # Predicoes e regras ja calculadas: so a comparacao com o threshold muda.
+        curves = {
+            t: hybrid_threshold_sweep(truths[t], mode_preds["rules"][t], ml_labels[t], ml_confs[t], thresholds)
+            for t in target_cols
+        }
+        report["threshold_sweep"] = _sweep_report(thresholds, curves)
+        report["summary"]["best_hybrid_threshold"] = report["threshold_sweep"]["best_threshold"]
+
     out = Path(args.output)
     out.parent.mkdir(parents=True, exist_ok=True)
     out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
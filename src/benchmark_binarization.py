@@ -0,0 +1,121 @@
+﻿import argparse
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+from statistics import mean
+
+import cv2
+
+# Permite executar via "python src/benchmark_binarization.py".
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.detector import PaloDetector
+from src.pipeline import parse_roi_frac
+from src.preprocessor import BINARIZE_METHODS, DocumentAligner
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Compara backends de binarizacao: tempo e acerto de contagem")
+    p.add_argument("--labels", required=True, help="CSV com image_path,total_gt (line_counts_gt opcional)")
+    p.add_argument("--methods", default=",".join(BINARIZE_METHODS), help="Metodos separados por virgula")
+    p.add_argument("--reference", default="bilateral", help="Metodo de referencia para a diferenca de contagem")
+    p.add_argument("--repeat", type=int, default=3, help="Repeticoes da binarizacao por imagem (melhor tempo)")
+    p.add_argument("--roi-frac", default="", help="Override de ROI em fracoes: x1,y1,x2,y2")
+    p.add_argument("--output", default="output/benchmark_binarization.json", help="JSON de saida")
+    return p.parse_args()
+
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def load_rois(rows, roi_frac):
+    # Alinhamento e recorte nao dependem da binarizacao: feitos uma vez, pelo
+    # mesmo caminho do process_image padrao (pagina inteira + recorte da ROI).
+    aligner = DocumentAligner()
+    rois = []
+    for row in rows:
+        image = cv2.imread(row["image_path"])
+        if image is None:
+            raise FileNotFoundError(f"Nao foi possivel abrir a imagem: {row['image_path']}")
+        roi_img, _ = aligner.crop_roi(aligner.get_aligned_image(image), roi_frac=roi_frac)
+        rois.append(roi_img)
+    return rois
+
+
+def benchmark_method(method, rows, rois, repeat):
+    aligner = DocumentAligner(binarize_method=method)
+    detector = PaloDetector()
+    times = []
+    totals = []
+    for roi_img in rois:
+        dt, binary = _best_of(lambda: aligner.binarize(roi_img), repeat)
+        times.append(dt)
+        detector.find_palos(binary)
+        detector.group_lines()
+        totals.append(sum(detector.get_line_counts()))
+
+    abs_errors = [abs(pred - int(row["total_gt"])) for pred, row in zip(totals, rows)]
+    total_time = sum(times)
+    return {
+        "method": method,
+        "binarize_ms_mean": round(mean(times) * 1000.0, 3),
+        "sheets_per_s": round(len(times) / total_time, 2) if total_time > 0 else None,
+        "mae_total": round(float(mean(abs_errors)), 4),
+        "exact_match_total_percent": round(100.0 * sum(1 for e in abs_errors if e == 0) / len(rows), 4),
+        "totals": totals,
+    }
+
+
+def main():
+    args = parse_args()
+    methods = [m.strip().lower() for m in args.methods.split(",") if m.strip()]
+    invalid = [m for m in methods + [args.reference] if m not in BINARIZE_METHODS]
+    if invalid:
+        raise SystemExit(f"Metodo(s) invalido(s): {', '.join(invalid)} (opcoes: {', '.join(BINARIZE_METHODS)})")
+    if args.reference not in methods:
+        methods.insert(0, args.reference)
+
+    with open(args.labels, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [row for row in csv.DictReader(f) if (row.get("image_path") or "").strip()]
+    if not rows:
+        raise RuntimeError("CSV de gabarito vazio")
+
+    rois = load_rois(rows, parse_roi_frac(args.roi_frac))
+    results = {m: benchmark_method(m, rows, rois, args.repeat) for m in methods}
+
+    ref_totals = results[args.reference]["totals"]
+    for res in results.values():
+        diffs = [abs(a - b) for a, b in zip(res["totals"], ref_totals)]
+        res["mean_abs_diff_vs_reference"] = round(float(mean(diffs)), 4)
+        ref_ms = results[args.reference]["binarize_ms_mean"]
+        res["speedup_vs_reference"] = round(ref_ms / res["binarize_ms_mean"], 2) if res["binarize_ms_mean"] else None
+
+    report = {
+        "num_images": len(rows),
+        "reference": args.reference,
+        "repeat": args.repeat,
+        "methods": list(results.values()),
+    }
+
+    out_path = Path(args.output)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    summary = [{k: v for k, v in r.items() if k != "totals"} for r in report["methods"]]
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
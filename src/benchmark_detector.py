@@ -0,0 +1,84 @@
+﻿import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Permite executar via "python src/benchmark_detector.py".
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.detector import PaloDetector, component_central_moments
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Micro-benchmark dos momentos de orientacao do detector")
+    p.add_argument("--lines", type=int, default=12, help="Linhas de palos na folha sintetica")
+    p.add_argument("--palos-per-line", type=int, default=90, help="Palos por linha")
+    p.add_argument("--repeat", type=int, default=5, help="Repeticoes por metodo")
+    p.add_argument("--seed", type=int, default=0, help="Semente da folha sintetica")
+    return p.parse_args()
+
+
+def make_binary_sheet(lines=12, palos_per_line=90, width=1180, height=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.zeros((height, width), dtype=np.uint8)
+    step_y = max(1, (height - 60) // max(1, lines))
+    step_x = max(1, (width - 40) // max(1, palos_per_line))
+    for r in range(lines):
+        y = 30 + r * step_y
+        for k in range(palos_per_line):
+            x = 20 + k * step_x + int(rng.integers(-2, 3))
+            dx = int(rng.integers(-4, 5))
+            h = int(rng.integers(28, 45))
+            cv2.line(img, (x, y), (x + dx, y + h), 255, int(rng.integers(2, 4)))
+    return img
+
+
+def legacy_central_moments(labels, num_labels):
+    mu20 = np.zeros(num_labels, dtype=np.float64)
+    mu02 = np.zeros(num_labels, dtype=np.float64)
+    mu11 = np.zeros(num_labels, dtype=np.float64)
+    for i in range(1, num_labels):
+        m = cv2.moments((labels == i).astype(np.uint8), binaryImage=True)
+        mu20[i], mu02[i], mu11[i] = m["mu20"], m["mu02"], m["mu11"]
+    return mu20, mu02, mu11
+
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def main():
+    args = parse_args()
+    binary = make_binary_sheet(lines=args.lines, palos_per_line=args.palos_per_line, seed=args.seed)
+    processed = PaloDetector()._filter_vertical_strokes(binary)
+    num_labels, labels, _, _ = cv2.connectedComponentsWithStats(processed, connectivity=8)
+
+    legacy_s, legacy = _best_of(lambda: legacy_central_moments(labels, num_labels), args.repeat)
+    fast_s, fast = _best_of(lambda: component_central_moments(labels, num_labels), args.repeat)
+
+    identical = all(np.array_equal(a, b) for a, b in zip(legacy, fast))
+    report = {
+        "componentes": int(num_labels - 1),
+        "roi_shape": list(binary.shape),
+        "legacy_ms": round(legacy_s * 1000.0, 3),
+        "vetorizado_ms": round(fast_s * 1000.0, 3),
+        "speedup": round(legacy_s / fast_s, 2) if fast_s > 0 else None,
+        "identico_bit_a_bit": bool(identical),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+﻿import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+# Permite executar via "python src/benchmark_performance.py".
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.pipeline import ALIGN_MODES, PIPELINE_VERSION, process_image
+from src.preprocessor import BINARIZE_METHODS
+from src.synthetic import SheetSpec, render_sheet
+from src.tracing import StageTracer
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark de desempenho por estagio em folhas sinteticas")
+    p.add_argument("--scales", default="0.6,1.0,2.0", help="Tamanhos da pagina na foto (x TARGET_WIDTH/HEIGHT)")
+    p.add_argument("--densities", default="30,60,100", help="Palos por linha")
+    p.add_argument("--lines", type=int, default=10, help="Linhas de palos por folha")
+    p.add_argument("--repeat", type=int, default=5, help="Execucoes medidas por configuracao")
+    p.add_argument("--warmup", type=int, default=1, help="Execucoes descartadas por configuracao")
+    p.add_argument("--seed", type=int, default=0, help="Semente das folhas sinteticas")
+    p.add_argument("--binarize", default="", choices=["", *BINARIZE_METHODS], help="Backend de binarizacao")
+    p.add_argument("--align-mode", default="page", choices=ALIGN_MODES, help="Caminho de alinhamento medido")
+    p.add_argument("--cv-threads", type=int, default=1, help="Threads do OpenCV (1 = medidas mais estaveis)")
+    p.add_argument("--output", default="output/benchmark_performance.json", help="JSON de saida")
+    p.add_argument(
+        "--baseline",
+        default="",
+        help="Baseline JSON: roda a mesma grade do baseline e falha se algum estagio ficou mais lento",
+    )
+    p.add_argument("--update-baseline", action="store_true", help="Grava o resultado desta execucao em --baseline")
+    p.add_argument("--max-slowdown", type=float, default=20.0, help="Piora maxima da mediana por estagio (%%)")
+    p.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=2.0,
+        help="Diferencas abaixo disso (ms) nao reprovam; evita ruido em estagios muito curtos",
+    )
+    return p.parse_args()
+
+
+def _floats(text: str) -> List[float]:
+    return [float(v) for v in text.split(",") if v.strip()]
+
+
+def _stats(values: Sequence[float]) -> Dict:
+    arr = np.asarray(values, dtype=np.float64)
+    return {
+        "median_ms": round(float(np.median(arr)), 3),
+        "p90_ms": round(float(np.percentile(arr, 90)), 3),
+        "min_ms": round(float(arr.min()), 3),
+    }
+
+
+def _class_levels(metrics: Dict) -> Dict:
+    return {
+        k: (v.get("nivel") if isinstance(v, dict) else v) for k, v in sorted(metrics.get("classificacoes", {}).items())
+    }
+
+
+def benchmark_sheet(
+    spec: SheetSpec,
+    repeat: int = 5,
+    warmup: int = 1,
+    binarize_method: Optional[str] = None,
+    align_mode: str = "page",
+    metrics_only: bool = True,
+) -> Dict:
+    """
+    Mede uma folha sintetica: latencia por estagio (mediana, p90, minimo),
+    latencia total, vazao e o erro de contagem contra o gabarito.
+    A foto vai como JPEG em memoria, entao o estagio decode entra na conta.
+    align_mode e metrics_only vao explicitos ao process_image: mudar os
+    padroes do pipeline nao muda o que o gate mede.
+    """
+    image, truth = render_sheet(spec)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise RuntimeError("Falha ao codificar a folha sintetica")
+    data = encoded.tobytes()
+
+    stage_ms: Dict[str, List[float]] = {}
+    totals: List[float] = []
+    result = None
+    for i in range(max(0, warmup) + max(1, repeat)):
+        tracer = StageTracer(memory=False)
+        t0 = time.perf_counter()
+        result = process_image(
+            data,
+            output_dir=None,
+            save_artifacts=False,
+            binarize_method=binarize_method,
+            align_mode=align_mode,
+            metrics_only=metrics_only,
+            trace=tracer,
+        )
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        if i < warmup:
+            continue
+        totals.append(elapsed)
+        for s in result.trace["stages"]:
+            stage_ms.setdefault(s["stage"], []).append(s["wall_ms"])
+
+    total = _stats(totals)
+    return {
+        "spec": truth["spec"],
+        "photo_shape": list(image.shape[:2]),
+        "megapixels": round(image.shape[0] * image.shape[1] / 1e6, 3),
+        "total_gt": truth["total"],
+        "total_pred": int(result.metrics["total"]),
+        "line_counts_gt": truth["line_counts"],
+        "line_counts_pred": result.line_counts,
+        "abs_error_total": abs(int(result.metrics["total"]) - truth["total"]),
+        "classificacoes": _class_levels(result.metrics),
+        "total": total,
+        "sheets_per_second": round(1000.0 / total["median_ms"], 3) if total["median_ms"] > 0 else None,
+        "stages": {name: _stats(vals) for name, vals in stage_ms.items()},
+    }
+
+
+def run_suite(
+    scales: Sequence[float],
+    densities: Sequence[int],
+    lines: int = 10,
+    repeat: int = 5,
+    warmup: int = 1,
+    seed: int = 0,
+    binarize_method: Optional[str] = None,
+    align_mode: str = "page",
+    metrics_only: bool = True,
+) -> Dict:
+    """Grade tamanho da folha x densidade de palos, com sementes fixas (reprodutivel)."""
+    cases = []
+    for scale in scales:
+        for density in densities:
+            spec = SheetSpec(lines=lines, palos_per_line=int(density), scale=float(scale), seed=seed)
+            case = benchmark_sheet(
+                spec,
+                repeat=repeat,
+                warmup=warmup,
+                binarize_method=binarize_method,
+                align_mode=align_mode,
+                metrics_only=metrics_only,
+            )
+            case["name"] = f"scale{scale:g}_palos{int(density)}"
+            cases.append(case)
+
+    return {
+        "pipeline_version": PIPELINE_VERSION,
+        "suite": {
+            "scales": [float(v) for v in scales],
+            "densities": [int(v) for v in densities],
+            "lines": lines,
+            "repeat": repeat,
+            "warmup": warmup,
+            "seed": seed,
+            "binarize_method": binarize_method,
+            "align_mode": align_mode,
+            "metrics_only": metrics_only,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cv_threads": cv2.getNumThreads(),
+        },
+        "cases": cases,
+    }
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, max_slowdown: float = 20.0, min_delta_ms: float = 2.0) -> Dict:
+    """
+    Compara medianas (total e por estagio) e resultados com o baseline.
+
+    Um estagio reprova quando a mediana piora mais de max_slowdown % e mais
+    de min_delta_ms. Contagem, contagem por linha e classificacoes precisam
+    ser identicas. Retorna {"ok", "failures", "rows"}; rows e a tabela de
+    comparacao completa.
+    """
+    base_cases = {c["name"]: c for c in baseline.get("cases", [])}
+    failures: List[str] = []
+    rows: List[Dict] = []
+
+    for case in report.get("cases", []):
+        name = case["name"]
+        base = base_cases.get(name)
+        if base is None:
+            failures.append(f"{name}: caso ausente no baseline")
+            continue
+
+        for field in ("total_pred", "line_counts_pred", "classificacoes"):
+            if case.get(field) != base.get(field):
+                failures.append(f"{name}: {field} mudou: {base.get(field)} -> {case.get(field)}")
+
+        timings = [("total", base["total"], case["total"])]
+        timings += [(stage, base["stages"][stage], stats) for stage, stats in case["stages"].items() if stage in base["stages"]]
+        for stage, old, new in timings:
+            before, after = old["median_ms"], new["median_ms"]
+            delta = after - before
+            pct = (delta / before * 100.0) if before > 0 else 0.0
+            slower = pct > max_slowdown and delta > min_delta_ms
+            rows.append(
+                {
+                    "case": name,
+                    "stage": stage,
+                    "baseline_ms": before,
+                    "current_ms": after,
+                    "delta_pct": round(pct, 1),
+                    "regression": slower,
+                }
+            )
+            if slower:
+                failures.append(f"{name}/{stage}: {before} ms -> {after} ms (+{pct:.1f}%, limite {max_slowdown:g}%)")
+
+    for name in base_cases:
+        if name not in {c["name"] for c in report.get("cases", [])}:
+            failures.append(f"{name}: caso do baseline nao executado")
+
+    return {"ok": not failures, "failures": failures, "rows": rows}
+
+
+def format_comparison(comparison: Dict) -> str:
+    lines = [f"{'caso':<22} {'estagio':<24} {'baseline':>9} {'atual':>9} {'delta':>8}"]
+    for r in comparison["rows"]:
+        flag = "  <-- REGRESSAO" if r["regression"] else ""
+        lines.append(
+            f"{r['case']:<22} {r['stage']:<24} {r['baseline_ms']:>9} {r['current_ms']:>9} {r['delta_pct']:>+7}%{flag}"
+        )
+    if comparison["failures"]:
+        lines.append("")
+        lines.append("Falhas:")
+        lines.extend(f"  - {f}" for f in comparison["failures"])
+    return "\n".join(lines)
+
+
+def main():
+    args = parse_args()
+    cv2.setNumThreads(max(0, args.cv_threads))
+
+    baseline = None
+    if args.baseline and not args.update_baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        # O corpus do gate e o do baseline, nao o dos argumentos.
+        suite = baseline["suite"]
+        report = run_suite(
+            suite["scales"],
+            suite["densities"],
+            lines=suite["lines"],
+            repeat=suite["repeat"],
+            warmup=suite["warmup"],
+            seed=suite["seed"],
+            binarize_method=suite["binarize_method"],
+            align_mode=suite.get("align_mode", "page"),
+            metrics_only=suite.get("metrics_only", True),
+        )
+    else:
+        report = run_suite(
+            _floats(args.scales),
+            [int(v) for v in _floats(args.densities)],
+            lines=args.lines,
+            repeat=args.repeat,
+            warmup=args.warmup,
+            seed=args.seed,
+            binarize_method=args.binarize or None,
+            align_mode=args.align_mode,
+        )
+
+    out = Path(args.output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print(f"{'caso':<22} {'MP':>6} {'total ms':>9} {'folhas/s':>9} {'erro':>5}  estagio mais lento")
+    for case in report["cases"]:
+        slowest = max(case["stages"].items(), key=lambda kv: kv[1]["median_ms"])
+        print(
+            f"{case['name']:<22} {case['megapixels']:>6} {case['total']['median_ms']:>9} "
+            f"{case['sheets_per_second']:>9} {case['abs_error_total']:>5}  {slowest[0]} ({slowest[1]['median_ms']} ms)"
+        )
+    print(f"Relatorio: {out}")
+
+    if args.update_baseline:
+        if not args.baseline:
+            raise SystemExit("--update-baseline exige --baseline")
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.baseline).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Baseline atualizado: {args.baseline}")
+    elif baseline is not None:
+        comparison = compare_to_baseline(report, baseline, args.max_slowdown, args.min_delta_ms)
+        print()
+        print(format_comparison(comparison))
+        if not comparison["ok"]:
+            raise SystemExit(1)
+        print("Sem regressao em relacao ao baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,20 @@
 ﻿import argparse
 import csv
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Set
 
 # Permite executar via "python src/build_ml_dataset.py".
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+import cv2
+
 from src.ml_models import FEATURE_NAMES
-from src.pipeline import parse_roi_frac, process_image
+from src.pipeline import ALIGN_MODES, parse_roi_frac, process_image
 
 
 def parse_args():
@@ -17,9 +22,148 @@ def parse_args():
     p.add_argument("--input", required=True, help="CSV de entrada com image_path e targets")
     p.add_argument("--output", default="output/ml_dataset.csv", help="CSV de saida com features + targets")
     p.add_argument("--roi-frac", default="", help="ROI em fracoes x1,y1,x2,y2")
+    p.add_argument("--cache-dir", default="", help="Diretorio de cache das medidas de visao computacional (opcional)")
+    p.add_argument(
+        "--stage-cache-dir",
+        default="",
+        help="Cache de estagios intermediarios (alinhada/binaria) para varreduras de parametros",
+    )
+    p.add_argument(
+        "--align-mode",
+        default="page",
+        choices=ALIGN_MODES,
+        help="roi: warp direto para a ROI (mais rapido; medidas levemente diferentes de page)",
+    )
+    p.add_argument("--workers", type=int, default=0, help="Processos paralelos (0 = numero de CPUs)")
+    p.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Mantem o CSV de saida e so processa image_path que ainda nao estao nele",
+    )
     return p.parse_args()
 
 
+def _init_worker() -> None:
+    # Paralelismo entre imagens; cada worker usa uma thread do OpenCV.
+    cv2.setNumThreads(1)
+
+
+def _feature_row(row: Dict, target_cols: List[str], options: Dict) -> Dict:
+    image_path = row["image_path"].strip()
+    result = process_image(
+        image_path=image_path,
+        errors=int(row.get("errors", 0) or 0),
+        roi_frac=options["roi_frac"],
+        output_dir=None,
+        save_artifacts=False,
+        metrics_only=True,
+        cache_dir=options["cache_dir"],
+        stage_cache_dir=options["stage_cache_dir"],
+        align_mode=options["align_mode"],
+    )
+    m = result.metrics
+    rec = {k: m.get(k) for k in FEATURE_NAMES}
+    rec["image_path"] = image_path
+    for tc in target_cols:
+        rec[tc] = row.get(tc, "")
+    return rec
+
+
+def _existing_image_paths(out_path: Path, fieldnames: List[str]) -> Set[str]:
+    with open(out_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != fieldnames:
+            raise RuntimeError(
+                f"Colunas de {out_path} diferem das esperadas; gere o dataset completo sem --incremental"
+            )
+        return {r["image_path"] for r in reader}
+
+
+def build_dataset(
+    rows: List[Dict],
+    output: str,
+    roi_frac=None,
+    cache_dir: Optional[str] = None,
+    stage_cache_dir: Optional[str] = None,
+    workers: Optional[int] = None,
+    incremental: bool = False,
+    align_mode: str = "page",
+) -> Dict:
+    """
+    Extrai as features de cada imagem num pool de processos e grava as
+    linhas no CSV na ordem da entrada, cada uma assim que ela e as anteriores
+    terminam (CSV e divisao treino/teste reprodutiveis).
+
+    incremental: acrescenta ao CSV existente so as linhas cuja image_path
+    ainda nao esta nele. Imagens com erro ficam de fora e sao tentadas de
+    novo na proxima execucao incremental.
+    """
+    target_cols = [c for c in rows[0].keys() if c.startswith("target_")] if rows else []
+    fieldnames = ["image_path", *FEATURE_NAMES, *target_cols]
+    out_path = Path(output)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    existing: Set[str] = set()
+    append = incremental and out_path.exists() and out_path.stat().st_size > 0
+    if append:
+        existing = _existing_image_paths(out_path, fieldnames)
+
+    pending = []
+    skipped = 0
+    for row in rows:
+        image_path = row.get("image_path", "").strip()
+        if not image_path:
+            continue
+        if image_path in existing:
+            skipped += 1
+            continue
+        pending.append(row)
+
+    options = {
+        "roi_frac": roi_frac,
+        "cache_dir": cache_dir,
+        "stage_cache_dir": stage_cache_dir,
+        "align_mode": align_mode,
+    }
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    written = 0
+    failures = []
+
+    with open(out_path, "a" if append else "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        if not append:
+            writer.writeheader()
+
+        def _emit(row: Dict, compute) -> None:
+            nonlocal written
+            try:
+                rec = compute()
+            except Exception as exc:
+                failures.append({"image_path": row["image_path"].strip(), "erro": f"{type(exc).__name__}: {exc}"})
+                return
+            writer.writerow(rec)
+            f.flush()
+            written += 1
+
+        if workers == 1:
+            for row in pending:
+                _emit(row, lambda row=row: _feature_row(row, target_cols, options))
+        elif pending:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = [pool.submit(_feature_row, row, target_cols, options) for row in pending]
+                # Ordem da entrada: resultados que chegam antes ficam no future.
+                for row, fut in zip(pending, futures):
+                    _emit(row, fut.result)
+
+    return {
+        "output": str(out_path),
+        "written": written,
+        "skipped_existing": skipped,
+        "failures": failures,
+        "workers": workers,
+    }
+
+
 def main():
     args = parse_args()
     roi_frac = parse_roi_frac(args.roi_frac) if args.roi_frac else None
@@ -30,37 +174,23 @@ def main():
     if not rows:
         raise RuntimeError("CSV de entrada vazio")
 
-    target_cols = [c for c in rows[0].keys() if c.startswith("target_")]
-    out_rows = []
-
-    for row in rows:
-        image_path = row.get("image_path", "").strip()
-        if not image_path:
-            continue
-
-        result = process_image(
-            image_path=image_path,
-            errors=int(row.get("errors", 0) or 0),
-            roi_frac=roi_frac,
-            output_dir=None,
-            save_artifacts=False,
-        )
-        m = result.metrics
-        rec = {k: m.get(k) for k in FEATURE_NAMES}
-        rec["image_path"] = image_path
-        for tc in target_cols:
-            rec[tc] = row.get(tc, "")
-        out_rows.append(rec)
-
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=["image_path", *FEATURE_NAMES, *target_cols])
-        writer.writeheader()
-        writer.writerows(out_rows)
+    out = build_dataset(
+        rows,
+        args.output,
+        roi_frac=roi_frac,
+        cache_dir=args.cache_dir or None,
+        stage_cache_dir=args.stage_cache_dir or None,
+        workers=args.workers or None,
+        incremental=args.incremental,
+        align_mode=args.align_mode,
+    )
 
-    print(f"Dataset ML gerado: {out_path}")
-    print(f"Amostras: {len(out_rows)}")
+    print(f"Dataset ML gerado: {out['output']}")
+    print(f"Amostras novas: {out['written']}")
+    if args.incremental:
+        print(f"Ja existentes: {out['skipped_existing']}")
+    for fail in out["failures"]:
+        print(f"Erro em {fail['image_path']}: {fail['erro']}")
 
 
 if __name__ == "__main__":
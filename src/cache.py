@@ -0,0 +1,231 @@
+﻿import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import config
+from src.strokes import STROKE_DTYPE, StrokeTable
+
+
+# Parametros de config.py que alteram o resultado da visao computacional.
+# Parametros de score (DEFAULT_*) ficam de fora: mudar regra nao invalida cache.
+CV_CONFIG_KEYS = (
+    "TARGET_WIDTH",
+    "TARGET_HEIGHT",
+    "ROI_X1",
+    "ROI_Y1",
+    "ROI_X2",
+    "ROI_Y2",
+    "ADAPTIVE_BLOCK_SIZE",
+    "ADAPTIVE_C",
+    "CLAHE_CLIP_LIMIT",
+    "CLAHE_GRID_SIZE",
+    "SAUVOLA_K",
+    "SAUVOLA_R",
+    "CONTOUR_MAX_SIDE",
+    "CONTOUR_REFINE_SUBPIX",
+    "MIN_AREA",
+    "MAX_AREA",
+    "MIN_HEIGHT",
+    "MAX_WIDTH",
+    "MIN_ASPECT_RATIO",
+    "VERTICAL_KERNEL_HEIGHT",
+    "HORIZONTAL_LINE_KERNEL_WIDTH",
+    "LINE_TOLERANCE_Y",
+    "MIN_PALOS_PER_LINE",
+)
+
+
+# Parametros de cada estagio intermediario. A chave de um estagio inclui a
+# chave do estagio anterior, entao mudar a ROI reaproveita a imagem alinhada e
+# mudar limiares do detector reaproveita a binaria.
+STAGE_CONFIG_KEYS = {
+    "aligned": ("TARGET_WIDTH", "TARGET_HEIGHT", "CONTOUR_MAX_SIDE", "CONTOUR_REFINE_SUBPIX"),
+    "binary": ("ADAPTIVE_BLOCK_SIZE", "ADAPTIVE_C", "CLAHE_CLIP_LIMIT", "CLAHE_GRID_SIZE", "SAUVOLA_K", "SAUVOLA_R"),
+}
+
+
+def cv_config_snapshot(keys=CV_CONFIG_KEYS) -> Dict:
+    return {k: getattr(config, k) for k in keys}
+
+
+def hash_params(parts) -> str:
+    """sha256 hex de uma sequencia de bytes e/ou valores JSON (ordem das chaves irrelevante)."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=list).encode("utf-8"))
+    return h.hexdigest()
+
+
+def image_digest(image) -> bytes:
+    """sha256 dos bytes codificados ou dos pixels de um ndarray (com shape/dtype)."""
+    if isinstance(image, np.ndarray):
+        h = hashlib.sha256(f"ndarray:{image.shape}:{image.dtype.str}".encode("utf-8"))
+        h.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+        return h.digest()
+    return hashlib.sha256(image).digest()
+
+
+def make_cache_key(image_bytes, roi_frac, pipeline_version: str, extra: Optional[Dict] = None) -> str:
+    params = {
+        "roi_frac": [float(v) for v in roi_frac] if roi_frac is not None else None,
+        "config": cv_config_snapshot(),
+        "pipeline_version": pipeline_version,
+        "extra": extra or {},
+    }
+    return hash_params([image_digest(image_bytes), params])
+
+
+def make_stage_key(stage: str, parent_key, pipeline_version: str, extra: Optional[Dict] = None) -> str:
+    params = {
+        "stage": stage,
+        "config": cv_config_snapshot(STAGE_CONFIG_KEYS[stage]),
+        "pipeline_version": pipeline_version,
+        "extra": extra or {},
+    }
+    return hash_params([parent_key if isinstance(parent_key, bytes) else str(parent_key).encode("utf-8"), params])
+
+
+# Tamanho estimado de cada diretorio de cache neste processo. Cada escrita
+# soma o que gravou; o diretorio so e varrido quando a estimativa passa do
+# limite ou a cada EVICT_SCAN_EVERY escritas (outros processos tambem gravam).
+EVICT_SCAN_EVERY = 256
+_SIZE_LOCK = threading.Lock()
+_DIR_SIZES: Dict[str, Dict[str, int]] = {}
+
+
+class _DiskLru:
+    suffix = ".npz"
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}{self.suffix}"
+
+    def _touch(self, path: Path) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write_atomic(self, key: str, data: bytes) -> None:
+        # Escrita atomica: varios processos podem gravar o mesmo cache.
+        path = self._path(key)
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        tmp = self.root / f".{key}.{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+        with _SIZE_LOCK:
+            state = _DIR_SIZES.get(self._size_key())
+            scan = state is None
+            if state is not None:
+                state["bytes"] += len(data) - replaced
+                state["writes"] += 1
+                scan = state["bytes"] > self.max_bytes or state["writes"] >= EVICT_SCAN_EVERY
+        if scan:
+            self.evict()
+
+    def _size_key(self) -> str:
+        return f"{os.path.abspath(self.root)}|{self.suffix}"
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for p in self.root.glob(f"*{self.suffix}"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+
+        with _SIZE_LOCK:
+            _DIR_SIZES[self._size_key()] = {"bytes": total, "writes": 0}
+
+    def clear(self) -> None:
+        for p in self.root.glob(f"*{self.suffix}"):
+            p.unlink(missing_ok=True)
+        with _SIZE_LOCK:
+            _DIR_SIZES.pop(self._size_key(), None)
+
+
+class ResultCache(_DiskLru):
+    """
+    Cache em disco das medidas de visao computacional de uma folha
+    (tabela de palos + medidas brutas), enderecado por conteudo.
+
+    Cada entrada e um .npz; o mtime marca o ultimo uso e a poda remove as
+    entradas menos recentes ate caber em `max_bytes` (LRU).
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        super().__init__(root, max_bytes if max_bytes is not None else config.RESULT_CACHE_MAX_MB * 1024 * 1024)
+
+    def get(self, key: str) -> Optional[Tuple[Dict, StrokeTable]]:
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(bytes(data["meta"]).decode("utf-8"))
+                strokes = np.asarray(data["strokes"], dtype=STROKE_DTYPE)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        self._touch(path)
+        return meta, StrokeTable(strokes)
+
+    def put(self, key: str, meta: Dict, strokes: StrokeTable) -> None:
+        buf = io.BytesIO()
+        payload = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        np.savez(buf, meta=np.frombuffer(payload, dtype=np.uint8), strokes=strokes.data)
+        self._write_atomic(key, buf.getvalue())
+
+
+class StageCache(_DiskLru):
+    """
+    Cache em disco dos artefatos intermediarios do pipeline (imagem alinhada,
+    binaria da ROI), um .npy por estagio/chave, com a mesma poda LRU.
+    """
+
+    suffix = ".npy"
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        super().__init__(root, max_bytes if max_bytes is not None else config.STAGE_CACHE_MAX_MB * 1024 * 1024)
+
+    def get_array(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            arr = np.load(path, allow_pickle=False)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        self._touch(path)
+        return arr
+
+    def put_array(self, key: str, arr: np.ndarray) -> None:
+        buf = io.BytesIO()
+        np.save(buf, np.ascontiguousarray(arr), allow_pickle=False)
+        self._write_atomic(key, buf.getvalue())
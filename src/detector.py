@@ -13,12 +13,45 @@ from config import (
     MIN_PALOS_PER_LINE,
     VERTICAL_KERNEL_HEIGHT,
 )
+from src.strokes import StrokeTable
+
+
+def component_central_moments(labels, num_labels):
+    """
+    Momentos centrais de segunda ordem (mu20, mu02, mu11) de todos os
+    componentes em uma unica passada sobre os pixels rotulados.
+
+    Os momentos brutos sao somas inteiras (exatas em float64) e os centrais
+    seguem a mesma formula de cv2.moments, entao o resultado e identico
+    bit a bit ao de cv2.moments((labels == i), binaryImage=True).
+    """
+    ys, xs = np.nonzero(labels)
+    lbl = labels[ys, xs]
+    xs = xs.astype(np.float64)
+    ys = ys.astype(np.float64)
+
+    m00 = np.bincount(lbl, minlength=num_labels).astype(np.float64)
+    m10 = np.bincount(lbl, weights=xs, minlength=num_labels)
+    m01 = np.bincount(lbl, weights=ys, minlength=num_labels)
+    m20 = np.bincount(lbl, weights=xs * xs, minlength=num_labels)
+    m11 = np.bincount(lbl, weights=xs * ys, minlength=num_labels)
+    m02 = np.bincount(lbl, weights=ys * ys, minlength=num_labels)
+
+    inv_m00 = np.zeros(num_labels, dtype=np.float64)
+    np.divide(1.0, m00, out=inv_m00, where=np.abs(m00) > np.finfo(np.float64).eps)
+    cx = m10 * inv_m00
+    cy = m01 * inv_m00
+
+    mu20 = m20 - m10 * cx
+    mu11 = m11 - m10 * cy
+    mu02 = m02 - m01 * cy
+    return mu20, mu02, mu11
 
 
 class PaloDetector:
     def __init__(self):
-        self.palos = []
-        self.lines = []
+        self.palos = StrokeTable.empty()
+        self.lines = StrokeTable.empty()
 
     def _filter_vertical_strokes(self, binary_img):
         vert_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, VERTICAL_KERNEL_HEIGHT))
@@ -32,101 +65,102 @@ class PaloDetector:
         cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 3)))
         return cleaned
 
+    @staticmethod
+    def _orientation_deg(mu20, mu02, mu11):
+        # Orientacao em graus no eixo X (0..180), util para inclinacao dos palos.
+        angle_deg = 90.0
+        den = float(mu20 - mu02)
+        num = float(2.0 * mu11)
+        if abs(den) > 1e-9 or abs(num) > 1e-9:
+            theta = 0.5 * math.atan2(num, den)
+            angle_deg = math.degrees(theta)
+            if angle_deg < 0:
+                angle_deg += 180.0
+        return float(angle_deg)
+
     def find_palos(self, binary_img):
+        """
+        Palos da imagem binaria como StrokeTable (ordenados por cy, cx).
+        len() conta palos; to_records() da a lista de dicts antiga.
+        """
         processed = self._filter_vertical_strokes(binary_img)
 
         num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(processed, connectivity=8)
-        detected = []
-
-        for i in range(1, num_labels):
-            x = int(stats[i, cv2.CC_STAT_LEFT])
-            y = int(stats[i, cv2.CC_STAT_TOP])
-            w = int(stats[i, cv2.CC_STAT_WIDTH])
-            h = int(stats[i, cv2.CC_STAT_HEIGHT])
-            area = int(stats[i, cv2.CC_STAT_AREA])
-
-            ratio = (h / float(w)) if w > 0 else 0.0
-
-            if area < MIN_AREA or area > MAX_AREA:
-                continue
-            if h < MIN_HEIGHT:
-                continue
-            if w > MAX_WIDTH:
-                continue
-            if ratio < MIN_ASPECT_RATIO:
-                continue
-
-            # Orientacao em graus no eixo X (0..180), util para inclinacao dos palos.
-            comp_mask = (labels == i).astype(np.uint8)
-            m = cv2.moments(comp_mask, binaryImage=True)
-            angle_deg = 90.0
-            den = (m["mu20"] - m["mu02"])
-            num = (2.0 * m["mu11"])
-            if abs(den) > 1e-9 or abs(num) > 1e-9:
-                theta = 0.5 * math.atan2(num, den)
-                angle_deg = math.degrees(theta)
-                if angle_deg < 0:
-                    angle_deg += 180.0
-
-            detected.append(
-                {
-                    "x": x,
-                    "y": y,
-                    "w": w,
-                    "h": h,
-                    "area": area,
-                    "cx": x + (w / 2.0),
-                    "cy": y + (h / 2.0),
-                    "angle_deg": float(angle_deg),
-                }
-            )
-
-        detected.sort(key=lambda p: (p["cy"], p["cx"]))
-        self.palos = detected
-        return detected
+        mu20, mu02, mu11 = component_central_moments(labels, num_labels)
+
+        stats = stats[1:]
+        x = stats[:, cv2.CC_STAT_LEFT]
+        y = stats[:, cv2.CC_STAT_TOP]
+        w = stats[:, cv2.CC_STAT_WIDTH]
+        h = stats[:, cv2.CC_STAT_HEIGHT]
+        area = stats[:, cv2.CC_STAT_AREA]
+        ratio = np.divide(h, w, out=np.zeros(len(w), dtype=np.float64), where=w > 0)
+
+        keep = (
+            (area >= MIN_AREA)
+            & (area <= MAX_AREA)
+            & (h >= MIN_HEIGHT)
+            & (w <= MAX_WIDTH)
+            & (ratio >= MIN_ASPECT_RATIO)
+        )
+        idx = np.flatnonzero(keep) + 1
+        angles = [self._orientation_deg(mu20[i], mu02[i], mu11[i]) for i in idx]
+
+        table = StrokeTable.from_columns(x[keep], y[keep], w[keep], h[keep], area[keep], angles)
+        order = np.lexsort((table["cx"], table["cy"]))
+        self.palos = StrokeTable(table.data[order])
+        return self.palos
 
     def group_lines(self):
-        if not self.palos:
-            self.lines = []
-            return []
-
-        sorted_palos = sorted(self.palos, key=lambda p: p["cy"])
-        median_h = float(np.median([p["h"] for p in sorted_palos])) if sorted_palos else 0.0
+        """
+        Palos agrupados em linhas, como StrokeTable (nao mais lista de linhas):
+        len() conta palos, num_lines conta linhas e to_lines() da o formato
+        antigo (lista de linhas com dicts).
+        """
+        palos = self.palos
+        if len(palos) == 0:
+            self.lines = StrokeTable.empty()
+            return self.lines
+
+        cy = palos["cy"]
+        order = np.argsort(cy, kind="stable")
+        median_h = float(np.median(palos["h"]))
         threshold = max(float(LINE_TOLERANCE_Y), median_h * 0.75)
 
-        bands = []
-        for palo in sorted_palos:
-            placed = False
-            for band in bands:
-                if abs(palo["cy"] - band["center_y"]) <= threshold:
-                    band["items"].append(palo)
-                    band["center_y"] = float(np.mean([p["cy"] for p in band["items"]]))
-                    placed = True
-                    break
-
-            if not placed:
-                bands.append({"center_y": palo["cy"], "items": [palo]})
-
-        # Ordena bandas por posicao vertical e filtra ruido.
-        bands.sort(key=lambda b: b["center_y"])
-
-        filtered_lines = []
-        for band in bands:
-            line = sorted(band["items"], key=lambda p: p["x"])
-            if len(line) >= MIN_PALOS_PER_LINE:
-                filtered_lines.append(line)
-
-        self.lines = filtered_lines
-        return filtered_lines
+        # Varredura em cy crescente. O centro de uma banda e a media de cy ja
+        # vistos, logo nunca passa do cy atual: so a banda mais recente pode
+        # receber o palo, e quando cy - centro > threshold ela fecha de vez.
+        # cy e multiplo de 0.5, entao soma/contagem reproduz np.mean exatamente.
+        band_of = np.empty(len(palos), dtype=np.int64)
+        band_sum = []
+        band_count = []
+        for i in order.tolist():
+            c = float(cy[i])
+            if not band_sum or c - band_sum[-1] / band_count[-1] > threshold:
+                band_sum.append(0.0)
+                band_count.append(0)
+            band_sum[-1] += c
+            band_count[-1] += 1
+            band_of[i] = len(band_sum) - 1
+
+        # Bandas ja nascem em ordem vertical; filtra ruido.
+        band_count = np.asarray(band_count)
+        keep = band_count >= MIN_PALOS_PER_LINE
+        line_of_band = np.where(keep, np.cumsum(keep) - 1, -1).astype(np.int32)
+
+        self.lines = palos.grouped(line_of_band[band_of])
+        return self.lines
 
     def get_line_counts(self):
-        return [len(line) for line in self.lines]
+        return self.lines.line_counts()
 
     def get_detection_stats(self):
+        palos = self.palos
+        has_palos = len(palos) > 0
         return {
-            "palos_detectados": len(self.palos),
-            "linhas_detectadas": len(self.lines),
-            "media_altura": round(float(np.mean([p["h"] for p in self.palos])), 4) if self.palos else 0.0,
-            "media_largura": round(float(np.mean([p["w"] for p in self.palos])), 4) if self.palos else 0.0,
-            "media_angulo_palos": round(float(np.mean([p["angle_deg"] for p in self.palos])), 4) if self.palos else None,
+            "palos_detectados": len(palos),
+            "linhas_detectadas": self.lines.num_lines,
+            "media_altura": round(float(np.mean(palos["h"])), 4) if has_palos else 0.0,
+            "media_largura": round(float(np.mean(palos["w"])), 4) if has_palos else 0.0,
+            "media_angulo_palos": round(float(np.mean(palos["angle_deg"])), 4) if has_palos else None,
         }
@@ -0,0 +1,141 @@
+from typing import Dict, List, Mapping
+
+import numpy as np
+
+
+# Versao do formato exportado por CompiledForests.to_dict.
+COMPILED_FORMAT_VERSION = 1
+
+_LEAF = -1
+
+
+class CompiledForests:
+    """
+    Florestas (RandomForestClassifier) de todos os alvos exportadas para
+    arrays NumPy contiguos: os nos de todas as arvores ficam concatenados e
+    uma unica varredura vetorizada percorre todas as arvores de todos os alvos.
+
+    Reproduz o predict_proba do sklearn bit a bit: features convertidas para
+    float32 (como o sklearn faz), folhas normalizadas como no
+    DecisionTreeClassifier e soma das arvores na mesma ordem sequencial.
+    Nao depende do sklearn para inferencia.
+    """
+
+    def __init__(self, arrays: Mapping):
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.roots = arrays["roots"]
+        self.n_features = int(arrays["n_features"])
+        self.targets: Dict[str, Dict] = dict(arrays["targets"])
+
+    @classmethod
+    def from_models(cls, models: Mapping) -> "CompiledForests":
+        left: List[np.ndarray] = []
+        right: List[np.ndarray] = []
+        feature: List[np.ndarray] = []
+        threshold: List[np.ndarray] = []
+        roots: List[int] = []
+        targets: Dict[str, Dict] = {}
+        n_features = None
+        offset = 0
+
+        for target_col, clf in models.items():
+            if getattr(clf, "n_outputs_", 1) != 1:
+                raise ValueError(f"Modelo de {target_col}: apenas uma saida e suportada")
+            n_features = int(clf.n_features_in_) if n_features is None else n_features
+            if int(clf.n_features_in_) != n_features:
+                raise ValueError("Todos os modelos devem usar o mesmo vetor de features")
+
+            node_offset = offset
+            tree_start = len(roots)
+            values = []
+            for est in clf.estimators_:
+                tree = est.tree_
+                is_leaf = tree.children_left == _LEAF
+                left.append(np.where(is_leaf, _LEAF, tree.children_left + offset).astype(np.int32))
+                right.append(np.where(is_leaf, _LEAF, tree.children_right + offset).astype(np.int32))
+                feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+                threshold.append(np.asarray(tree.threshold, dtype=np.float64))
+
+                # Mesma normalizacao do DecisionTreeClassifier.predict_proba.
+                proba = np.array(tree.value[:, 0, : int(est.n_classes_)], dtype=np.float64)
+                normalizer = proba.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                proba /= normalizer
+                values.append(proba)
+
+                roots.append(offset)
+                offset += tree.node_count
+
+            targets[target_col] = {
+                "tree_start": tree_start,
+                "tree_end": len(roots),
+                "node_offset": node_offset,
+                "classes": [str(c) for c in clf.classes_],
+                "values": np.ascontiguousarray(np.concatenate(values)),
+            }
+
+        def _cat(parts, dtype):
+            return np.ascontiguousarray(np.concatenate(parts)) if parts else np.zeros(0, dtype=dtype)
+
+        return cls(
+            {
+                "left": _cat(left, np.int32),
+                "right": _cat(right, np.int32),
+                "feature": _cat(feature, np.int32),
+                "threshold": _cat(threshold, np.float64),
+                "roots": np.asarray(roots, dtype=np.int32),
+                "n_features": n_features or 0,
+                "targets": targets,
+            }
+        )
+
+    def to_dict(self) -> Dict:
+        """Formato serializavel (so arrays e tipos basicos, mapeavel via joblib)."""
+        return {
+            "format_version": COMPILED_FORMAT_VERSION,
+            "left": self.left,
+            "right": self.right,
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "roots": self.roots,
+            "n_features": self.n_features,
+            "targets": self.targets,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "CompiledForests":
+        version = data.get("format_version")
+        if version != COMPILED_FORMAT_VERSION:
+            raise ValueError(f"Formato de floresta compilada nao suportado: {version}")
+        return cls(data)
+
+    def apply(self, x: np.ndarray) -> np.ndarray:
+        """Indice global da folha de cada linha em cada arvore: (n_linhas, n_arvores)."""
+        # O sklearn compara features float32 com limiares float64.
+        x = np.asarray(x, dtype=np.float32).astype(np.float64)
+        if x.ndim != 2 or x.shape[1] != self.n_features:
+            raise ValueError(f"Esperado array (n, {self.n_features}); recebido {x.shape}")
+
+        node = np.broadcast_to(self.roots, (x.shape[0], self.roots.shape[0])).copy()
+        rows = np.arange(x.shape[0])[:, np.newaxis]
+        while True:
+            left = self.left[node]
+            active = left != _LEAF
+            if not active.any():
+                return node
+            go_left = x[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(active, np.where(go_left, left, self.right[node]), node)
+
+    def predict_proba(self, x: np.ndarray) -> Dict[str, np.ndarray]:
+        leaves = self.apply(x)
+        out = {}
+        for target_col, t in self.targets.items():
+            idx = leaves[:, t["tree_start"] : t["tree_end"]] - t["node_offset"]
+            per_tree = t["values"][idx]
+            # Soma sequencial arvore a arvore (a ordem do sklearn com n_jobs=1).
+            total = np.add.accumulate(per_tree, axis=1)[:, -1] if per_tree.shape[1] else per_tree.sum(axis=1)
+            out[target_col] = total / max(1, t["tree_end"] - t["tree_start"])
+        return out
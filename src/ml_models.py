@@ -1,14 +1,20 @@
 ﻿import csv
+import hashlib
+import itertools
 import os
-import pickle
+import threading
+import time
+import uuid
 from collections import Counter
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from statistics import mean
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score, f1_score
-from sklearn.model_selection import train_test_split
+import joblib
+import numpy as np
+
+from src.forest import CompiledForests
 
 
 FEATURE_NAMES = [
@@ -42,11 +48,22 @@ TARGET_MAP = {
     "target_qualidade_tracado": ("qualidade_tracado", True),
 }
 
+# Parametros da floresta de cada alvo (sobrescritos por alvo via forest_params).
+DEFAULT_FOREST_PARAMS = {"n_estimators": 300, "max_depth": None, "min_samples_leaf": 2}
+
+# Grade padrao de search_forest_params.
+DEFAULT_SEARCH_GRID = {
+    "n_estimators": [50, 100, 300],
+    "max_depth": [None, 8, 16],
+    "min_samples_leaf": [1, 2, 4],
+}
+
 
 @dataclass
 class TrainOutput:
     model_path: str
     report: Dict
+    timing: Dict = field(default_factory=dict)
 
 
 def _to_float(value) -> float:
@@ -72,17 +89,14 @@ def _load_labeled_rows(dataset_csv: str) -> List[Dict]:
     return rows
 
 
-def train_ml_models(dataset_csv: str, model_path: str) -> TrainOutput:
-    rows = _load_labeled_rows(dataset_csv)
-    if not rows:
-        raise RuntimeError("Dataset CSV vazio")
-
+def _prepare_targets(rows: List[Dict]) -> Tuple[Dict, List[Tuple]]:
+    """Amostras por alvo treinavel; alvos sem dados suficientes vao direto ao relatorio."""
     x_all = []
     for row in rows:
         x_all.append([_to_float(row.get(name)) for name in FEATURE_NAMES])
 
-    models = {}
     report = {}
+    tasks = []
 
     for target_col, (target_key, _) in TARGET_MAP.items():
         y = [row.get(target_col, "").strip() for row in rows]
@@ -107,78 +121,405 @@ def train_ml_models(dataset_csv: str, model_path: str) -> TrainOutput:
             }
             continue
 
-        use_stratify = all(c >= 2 for c in class_counts.values())
-
-        # split simples para score de referencia
-        x_tr, x_te, y_tr, y_te = train_test_split(
-            xs,
-            ys,
-            test_size=0.2,
-            random_state=42,
-            stratify=ys if use_stratify else None,
-        )
-
-        clf = RandomForestClassifier(
-            n_estimators=300,
-            random_state=42,
-            class_weight="balanced",
-            min_samples_leaf=2,
-            n_jobs=-1,
-        )
-        clf.fit(x_tr, y_tr)
-        y_pred = clf.predict(x_te)
-
-        acc = float(accuracy_score(y_te, y_pred))
-        f1m = float(f1_score(y_te, y_pred, average="macro"))
+        report[target_col] = None  # preserva a ordem do TARGET_MAP no relatorio
+        tasks.append((target_col, target_key, xs, ys))
+    return report, tasks
+
+
+def _new_forest(params: Optional[Dict], n_jobs: int):
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(
+        random_state=42,
+        class_weight="balanced",
+        n_jobs=n_jobs,
+        **{**DEFAULT_FOREST_PARAMS, **(params or {})},
+    )
+
+
+def _fit_target(
+    target_col: str, target_key: str, xs: List, ys: List[str], n_jobs: int, params: Optional[Dict] = None
+) -> Tuple:
+    """Treina um alvo; roda no processo pai ou num worker do pool de treino."""
+    from sklearn.metrics import accuracy_score, f1_score
+    from sklearn.model_selection import train_test_split
+
+    t0 = time.perf_counter()
+    class_counts = Counter(ys)
+    use_stratify = all(c >= 2 for c in class_counts.values())
+
+    # split simples para score de referencia
+    x_tr, x_te, y_tr, y_te = train_test_split(
+        xs,
+        ys,
+        test_size=0.2,
+        random_state=42,
+        stratify=ys if use_stratify else None,
+    )
+
+    clf = _new_forest(params, n_jobs)
+    clf.fit(x_tr, y_tr)
+    y_pred = clf.predict(x_te)
+
+    acc = float(accuracy_score(y_te, y_pred))
+    f1m = float(f1_score(y_te, y_pred, average="macro"))
+
+    entry = {
+        "trained": True,
+        "samples": len(ys),
+        "accuracy": round(acc, 4),
+        "f1_macro": round(f1m, 4),
+        "classes": sorted(set(ys)),
+        "target_key": target_key,
+        "stratified_split": use_stratify,
+        "forest_params": {**DEFAULT_FOREST_PARAMS, **(params or {})},
+        "fit_seconds": round(time.perf_counter() - t0, 3),
+    }
+    return target_col, clf, entry
+
+
+def train_ml_models(
+    dataset_csv: str,
+    model_path: str,
+    workers: Optional[int] = None,
+    jobs_per_target: Optional[int] = None,
+    forest_params: Optional[Dict[str, Dict]] = None,
+) -> TrainOutput:
+    """
+    Treina uma floresta por alvo do TARGET_MAP.
+
+    Os alvos sao treinados em paralelo num pool de `workers` processos
+    (padrao: um por alvo, limitado ao numero de CPUs), cada um com
+    `jobs_per_target` threads no fit (padrao: CPUs divididas entre os
+    workers). workers=1 treina em sequencia no proprio processo. Com
+    random_state fixo o resultado nao depende dessa divisao.
+
+    forest_params sobrescreve DEFAULT_FOREST_PARAMS por alvo (por exemplo
+    o "recommended" de search_forest_params).
+    """
+    t_start = time.perf_counter()
+    rows = _load_labeled_rows(dataset_csv)
+    if not rows:
+        raise RuntimeError("Dataset CSV vazio")
+
+    report, tasks = _prepare_targets(rows)
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(int(workers or cpus), len(tasks) or 1))
+    jobs_per_target = max(1, int(jobs_per_target or cpus // workers))
 
+    fitted = {}
+    if workers == 1:
+        for task in tasks:
+            target_col, clf, entry = _fit_target(*task, jobs_per_target, (forest_params or {}).get(task[0]))
+            fitted[target_col] = (clf, entry)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fit_target, *task, jobs_per_target, (forest_params or {}).get(task[0])) for task in tasks]
+            for fut in as_completed(futures):
+                target_col, clf, entry = fut.result()
+                fitted[target_col] = (clf, entry)
+
+    models = {}
+    for target_col, _, _, _ in tasks:
+        clf, entry = fitted[target_col]
         models[target_col] = clf
-        report[target_col] = {
-            "trained": True,
-            "samples": len(valid),
-            "accuracy": round(acc, 4),
-            "f1_macro": round(f1m, 4),
-            "classes": sorted(set(ys)),
-            "target_key": target_key,
-            "stratified_split": use_stratify,
-        }
+        report[target_col] = entry
 
     payload = {
         "feature_names": FEATURE_NAMES,
         "target_map": TARGET_MAP,
         "models": models,
         "report": report,
+        "compiled": CompiledForests.from_models(models).to_dict(),
     }
 
-    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
-    with open(model_path, "wb") as f:
-        pickle.dump(payload, f)
+    # joblib sem compressao: os arrays ficam no arquivo e podem ser mapeados.
+    _dump_atomic(payload, model_path)
 
-    return TrainOutput(model_path=model_path, report=report)
+    timing = {
+        "workers": workers,
+        "jobs_per_target": jobs_per_target,
+        "wall_seconds": round(time.perf_counter() - t_start, 3),
+        "fit_seconds": {target_col: entry["fit_seconds"] for target_col, (_, entry) in fitted.items()},
+    }
+    return TrainOutput(model_path=model_path, report=report, timing=timing)
+
+
+def _grid_configs(grid: Dict[str, Sequence]) -> List[Dict]:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def _cv_fold(xs: np.ndarray, ys: np.ndarray, train_idx: np.ndarray, test_idx: np.ndarray, params: Dict) -> Dict:
+    """Uma configuracao num fold: metricas, tamanho e latencia de uma linha."""
+    from sklearn.metrics import accuracy_score, f1_score
+
+    clf = _new_forest(params, n_jobs=1)
+    clf.fit(xs[train_idx], ys[train_idx])
+    y_pred = clf.predict(xs[test_idx])
+
+    forests = CompiledForests.from_models({"alvo": clf})
+    arrays = (forests.left, forests.right, forests.feature, forests.threshold, forests.targets["alvo"]["values"])
+    row = xs[test_idx[:1]]
+    forests.predict_proba(row)
+    samples = []
+    for _ in range(20):
+        t0 = time.perf_counter()
+        forests.predict_proba(row)
+        samples.append(time.perf_counter() - t0)
+
+    return {
+        "accuracy": float(accuracy_score(ys[test_idx], y_pred)),
+        "f1_macro": float(f1_score(ys[test_idx], y_pred, average="macro")),
+        "n_nodes": int(forests.left.shape[0]),
+        "size_kb": sum(a.nbytes for a in arrays) / 1024.0,
+        "latency_ms": float(np.median(samples)) * 1000.0,
+    }
 
 
-def load_ml_model(model_path: str) -> Dict:
-    with open(model_path, "rb") as f:
-        return pickle.load(f)
+def search_forest_params(
+    dataset_csv: str,
+    grid: Optional[Dict[str, Sequence]] = None,
+    folds: int = 5,
+    workers: Optional[int] = None,
+    accuracy_tolerance: float = 0.01,
+) -> Dict:
+    """
+    Busca em grade dos parametros da floresta com k-fold estratificado.
+
+    Cada (alvo, configuracao, fold) e um job no pool de processos. Para cada
+    alvo o relatorio traz acuracia/F1 medios ao lado do tamanho (nos, KB) e
+    da latencia de predicao de uma linha com a floresta compilada. O
+    "recommended" e a menor e mais rapida configuracao cuja acuracia fica a
+    ate accuracy_tolerance da melhor; passe-o em train_ml_models(forest_params=...).
+    A latencia e medida dentro dos workers e serve para comparar configuracoes.
+    """
+    from sklearn.model_selection import KFold, StratifiedKFold
 
+    rows = _load_labeled_rows(dataset_csv)
+    if not rows:
+        raise RuntimeError("Dataset CSV vazio")
 
-def predict_ml_classes(metrics: Dict, ml_payload: Dict) -> Dict:
-    feats = [_to_float(metrics.get(k)) for k in ml_payload["feature_names"]]
-    out = {}
-
-    for target_col, clf in ml_payload["models"].items():
-        pred = clf.predict([feats])[0]
-        conf = None
-        if hasattr(clf, "predict_proba"):
-            probs = clf.predict_proba([feats])[0]
-            conf = float(max(probs)) if len(probs) else None
-        out[target_col] = {
-            "pred": str(pred),
-            "confidence": round(conf, 4) if conf is not None else None,
+    configs = _grid_configs(grid or DEFAULT_SEARCH_GRID)
+    report, tasks = _prepare_targets(rows)
+
+    jobs = []
+    for target_col, _, xs, ys in tasks:
+        x_arr = np.asarray(xs, dtype=np.float64)
+        y_arr = np.asarray(ys)
+        min_class = min(Counter(ys).values())
+        if min_class >= 2:
+            splitter = StratifiedKFold(n_splits=min(folds, min_class), shuffle=True, random_state=42)
+        else:
+            splitter = KFold(n_splits=folds, shuffle=True, random_state=42)
+        splits = list(splitter.split(x_arr, y_arr))
+        report[target_col] = {
+            "samples": len(ys),
+            "folds": len(splits),
+            "stratified": min_class >= 2,
         }
+        for ci, params in enumerate(configs):
+            for train_idx, test_idx in splits:
+                jobs.append((target_col, ci, (x_arr, y_arr, train_idx, test_idx, params)))
+
+    results: Dict[Tuple[str, int], List[Dict]] = {}
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    t_start = time.perf_counter()
+    if workers == 1:
+        for target_col, ci, args in jobs:
+            results.setdefault((target_col, ci), []).append(_cv_fold(*args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_cv_fold, *args): (target_col, ci) for target_col, ci, args in jobs}
+            for fut in as_completed(futures):
+                results.setdefault(futures[fut], []).append(fut.result())
+
+    for target_col, _, _, _ in tasks:
+        table = []
+        for ci, params in enumerate(configs):
+            per_fold = results[(target_col, ci)]
+            accs = [r["accuracy"] for r in per_fold]
+            table.append(
+                {
+                    "params": params,
+                    "accuracy": round(mean(accs), 4),
+                    "accuracy_std": round(float(np.std(accs)), 4),
+                    "f1_macro": round(mean(r["f1_macro"] for r in per_fold), 4),
+                    "n_nodes": int(round(mean(r["n_nodes"] for r in per_fold))),
+                    "size_kb": round(mean(r["size_kb"] for r in per_fold), 1),
+                    "latency_ms": round(mean(r["latency_ms"] for r in per_fold), 4),
+                }
+            )
+        best_acc = max(c["accuracy"] for c in table)
+        eligible = [c for c in table if c["accuracy"] >= best_acc - accuracy_tolerance]
+        recommended = min(eligible, key=lambda c: (c["n_nodes"], c["latency_ms"]))
+        report[target_col].update({"configs": table, "best_accuracy": best_acc, "recommended": recommended})
+
+    return {
+        "grid": grid or DEFAULT_SEARCH_GRID,
+        "accuracy_tolerance": accuracy_tolerance,
+        "workers": workers,
+        "wall_seconds": round(time.perf_counter() - t_start, 3),
+        "targets": report,
+        "recommended_params": {
+            target_col: report[target_col]["recommended"]["params"] for target_col, _, _, _ in tasks
+        },
+    }
+
+
+def _dump_atomic(obj, path: str) -> None:
+    """
+    Grava num temporario da mesma pasta e troca com os.replace. Processos com
+    o modelo antigo mapeado (mmap) seguem lendo o inode antigo intacto;
+    reescrever o arquivo no lugar poderia derruba-los (SIGBUS).
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        joblib.dump(obj, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_ml_model(model_path: str, mmap_mode: Optional[str] = None) -> Dict:
+    """
+    Carrega o payload salvo por train_ml_models (joblib ou pickle antigo).
+    mmap_mode="r" mapeia os arrays numpy do arquivo em vez de copia-los.
+    """
+    payload = joblib.load(model_path, mmap_mode=mmap_mode)
+    if "compiled" not in payload and payload.get("models"):
+        payload["compiled"] = CompiledForests.from_models(payload["models"]).to_dict()
+
+    # Os modelos sao treinados com n_jobs=-1; na inferencia (poucas linhas por
+    # chamada) o despacho de threads custa mais que percorrer as arvores.
+    for clf in payload.get("models", {}).values():
+        if hasattr(clf, "n_jobs"):
+            clf.n_jobs = 1
+    return payload
+
+
+def export_inference_model(ml_payload: Dict, out_path: str) -> str:
+    """
+    Grava so o necessario para inferencia (florestas compiladas, sem objetos
+    do sklearn): o arquivo carrega e prediz sem o sklearn instalado.
+    """
+    if "compiled" not in ml_payload:
+        raise ValueError("Payload sem florestas compiladas")
+    data = {k: v for k, v in ml_payload.items() if k != "models"}
+    data["models"] = {}
+    _dump_atomic(data, out_path)
+    return out_path
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Cache por processo dos modelos ML: cada arquivo e carregado uma vez.
+
+    Um acesso compara mtime/tamanho do arquivo; se mudaram, o sha256 decide
+    se o conteudo mudou de fato (um "touch" nao recarrega o modelo).
+    """
+
+    def __init__(self, mmap_mode: Optional[str] = "r"):
+        self.mmap_mode = mmap_mode
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_path: str) -> Dict:
+        path = os.path.abspath(model_path)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["stamp"] == stamp:
+                return entry["payload"]
+
+            digest = _file_digest(path)
+            if entry is not None and entry["digest"] == digest:
+                entry["stamp"] = stamp
+                return entry["payload"]
+
+            payload = load_ml_model(path, mmap_mode=self.mmap_mode)
+            self._entries[path] = {"stamp": stamp, "digest": digest, "payload": payload}
+            return payload
+
+    def invalidate(self, model_path: Optional[str] = None) -> None:
+        with self._lock:
+            if model_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(model_path), None)
+
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+def get_ml_model(model_path: str) -> Dict:
+    """Modelo ML memoizado no processo (ver ModelRegistry)."""
+    return MODEL_REGISTRY.get(model_path)
+
+
+def feature_matrix(metrics_list: Sequence[Dict], feature_names: Sequence[str]) -> np.ndarray:
+    return np.array([[_to_float(m.get(k)) for k in feature_names] for m in metrics_list], dtype=np.float64).reshape(
+        len(metrics_list), len(feature_names)
+    )
+
+
+def predict_ml_classes_batch(metrics_list: Sequence[Dict], ml_payload: Dict) -> List[Dict]:
+    """
+    Predicoes ML de varias folhas: uma chamada vetorizada por alvo.
+    O rotulo sai do argmax de predict_proba (mesma regra do predict do
+    sklearn), entao cada floresta e percorrida uma unica vez. Com florestas
+    compiladas no payload, todas as arvores de todos os alvos sao avaliadas
+    numa unica varredura, sem o sklearn.
+    """
+    x = feature_matrix(metrics_list, ml_payload["feature_names"])
+    out: List[Dict] = [{} for _ in range(len(metrics_list))]
+    if x.shape[0] == 0:
+        return out
+
+    if ml_payload.get("compiled"):
+        forests = CompiledForests.from_dict(ml_payload["compiled"])
+        per_target = [
+            (target_col, forests.targets[target_col]["classes"], probs)
+            for target_col, probs in forests.predict_proba(x).items()
+        ]
+    else:
+        per_target = [
+            (target_col, clf.classes_, clf.predict_proba(x)) for target_col, clf in ml_payload["models"].items()
+        ]
+
+    for target_col, classes, probs in per_target:
+        best = np.argmax(probs, axis=1)
+        preds = np.asarray(classes).take(best)
+        confs = probs[np.arange(len(best)), best] if probs.shape[1] else [None] * len(best)
+
+        for row, pred, conf in zip(out, preds, confs):
+            row[target_col] = {
+                "pred": str(pred),
+                "confidence": round(float(conf), 4) if conf is not None else None,
+            }
 
     return out
 
 
+def predict_ml_classes(metrics: Dict, ml_payload: Dict) -> Dict:
+    return predict_ml_classes_batch([metrics], ml_payload)[0]
+
+
 def apply_ml_predictions(metrics: Dict, ml_preds: Dict, prefer_ml: bool = False) -> Dict:
     cls = metrics.get("classificacoes", {})
     ml_block = {}
@@ -265,3 +606,44 @@ def fuse_ml_with_rules(
         "confidence_threshold": confidence_threshold,
     }
     return metrics
+
+
+def rule_label(metrics: Dict, target_col: str) -> Optional[str]:
+    """Classe que as regras deram ao alvo (campo "nivel" nas classes em dict)."""
+    target_info = TARGET_MAP.get(target_col)
+    if not target_info:
+        return None
+    class_key, is_dict = target_info
+    c = metrics.get("classificacoes", {}).get(class_key)
+    if is_dict:
+        return c.get("nivel") if isinstance(c, dict) else None
+    return c
+
+
+def fused_labels(metrics: Dict, ml_preds: Dict, thresholds: Sequence[float] = (0.75,)) -> Dict:
+    """
+    Classe final de cada alvo em todos os modos de fuse_ml_with_rules, sem
+    copiar nem alterar metrics. Retorna {"rules", "assist", "override":
+    {alvo: classe}, "hybrid": [{alvo: classe} para cada threshold]}.
+    """
+    rules: Dict[str, Optional[str]] = {}
+    override: Dict[str, Optional[str]] = {}
+    hybrid: List[Dict[str, Optional[str]]] = [{} for _ in thresholds]
+
+    for target_col in TARGET_MAP:
+        rule = rule_label(metrics, target_col)
+        rules[target_col] = rule
+        pred_data = ml_preds.get(target_col)
+        if pred_data is None:
+            override[target_col] = rule
+            for out in hybrid:
+                out[target_col] = rule
+            continue
+
+        pred_label = pred_data.get("pred")
+        conf = pred_data.get("confidence")
+        override[target_col] = pred_label
+        for out, thr in zip(hybrid, thresholds):
+            out[target_col] = pred_label if conf is not None and float(conf) >= float(thr) else rule
+
+    return {"rules": rules, "assist": dict(rules), "override": override, "hybrid": hybrid}
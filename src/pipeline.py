@@ -5,27 +5,50 @@ import os
 from dataclasses import dataclass
 from pathlib import Path
 from statistics import mean
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import cv2
 import numpy as np
 
+from config import TARGET_HEIGHT, TARGET_WIDTH
+from src.artifacts import IMAGE_ARTIFACTS, resolve_artifacts
+from src.cache import ResultCache, StageCache, image_digest, make_cache_key, make_stage_key
 from src.detector import PaloDetector
 from src.preprocessor import DocumentAligner
 from src.scorer import compute_metrics
+from src.strokes import StrokeTable, as_stroke_table
+from src.tracing import make_tracer
+
+
+# Incrementar quando a extracao de visao computacional mudar (invalida caches).
+PIPELINE_VERSION = "2"
+
+# "page": alinha a pagina inteira e recorta a ROI (padrao); "roi": warp direto
+# para a ROI, mais barato mas com medidas levemente diferentes.
+ALIGN_MODES = ("page", "roi")
 
 
 @dataclass
 class PipelineResult:
     metrics: Dict
     line_counts: List[int]
-    local_lines: List[List[Dict]]
-    global_lines: List[List[Dict]]
+    strokes: StrokeTable
     roi_rect: Tuple[int, int, int, int]
-    aligned: np.ndarray
-    roi_img: np.ndarray
-    binary: np.ndarray
-    overlay: np.ndarray
+    aligned: Optional[np.ndarray]
+    roi_img: Optional[np.ndarray]
+    binary: Optional[np.ndarray]
+    overlay: Optional[np.ndarray]
+    cache_hit: bool = False
+    trace: Optional[Dict] = None
+
+    @property
+    def local_lines(self) -> List[List[Dict]]:
+        return self.strokes.to_lines()
+
+    @property
+    def global_lines(self) -> List[List[Dict]]:
+        x1, y1, _, _ = self.roi_rect
+        return self.strokes.shifted(x1, y1).to_lines()
 
 
 def parse_roi_frac(roi_text: str) -> Optional[Tuple[float, float, float, float]]:
@@ -38,70 +61,55 @@ def parse_roi_frac(roi_text: str) -> Optional[Tuple[float, float, float, float]]
 
 
 def to_global_lines(lines, offset_x, offset_y):
-    global_lines = []
-    for line in lines:
-        g_line = []
-        for p in line:
-            g = dict(p)
-            g["x"] = int(g["x"] + offset_x)
-            g["y"] = int(g["y"] + offset_y)
-            g["cx"] = float(g["cx"] + offset_x)
-            g["cy"] = float(g["cy"] + offset_y)
-            g_line.append(g)
-        global_lines.append(g_line)
-    return global_lines
+    return as_stroke_table(lines).shifted(offset_x, offset_y)
+
+
+def _line_means(strokes, values):
+    lines = strokes["line"]
+    counts = np.bincount(lines, minlength=strokes.num_lines)
+    return np.bincount(lines, weights=values, minlength=strokes.num_lines) / np.maximum(counts, 1)
 
 
 def estimate_spacing_mm(lines, mm_per_px):
-    gaps_mm = []
-    for line in lines:
-        if len(line) < 2:
-            continue
-        sorted_line = sorted(line, key=lambda p: p["x"])
-        for i in range(1, len(sorted_line)):
-            prev = sorted_line[i - 1]
-            curr = sorted_line[i]
-            gap_px = curr["x"] - (prev["x"] + prev["w"])
-            if 0 < gap_px < 200:
-                gaps_mm.append(gap_px * mm_per_px)
-    return float(mean(gaps_mm)) if gaps_mm else None
+    strokes = as_stroke_table(lines)
+    if len(strokes) < 2:
+        return None
+    # Gaps entre vizinhos em x dentro da mesma linha.
+    data = strokes.data[np.lexsort((strokes["x"], strokes["line"]))]
+    same_line = data["line"][1:] == data["line"][:-1]
+    gap_px = data["x"][1:] - (data["x"][:-1] + data["w"][:-1])
+    gaps_px = gap_px[same_line & (gap_px > 0) & (gap_px < 200)]
+    return float(np.mean(gaps_px * mm_per_px)) if gaps_px.size else None
 
 
 def estimate_height_mm(lines, mm_per_px):
-    heights = [p["h"] * mm_per_px for line in lines for p in line]
-    return float(mean(heights)) if heights else None
+    strokes = as_stroke_table(lines)
+    return float(np.mean(strokes["h"] * mm_per_px)) if len(strokes) else None
 
 
 def estimate_line_spacing_mm(lines, mm_per_px):
-    if len(lines) < 2:
+    strokes = as_stroke_table(lines)
+    if strokes.num_lines < 2:
         return None
 
-    line_baselines = []
-    line_heights = []
-    for line in lines:
-        base_y = mean([p["y"] + p["h"] for p in line])
-        h = mean([p["h"] for p in line])
-        line_baselines.append(base_y)
-        line_heights.append(h)
-
-    gaps_mm = []
-    for i in range(1, len(line_baselines)):
-        raw_gap_px = line_baselines[i] - line_baselines[i - 1]
-        ref_h_px = (line_heights[i] + line_heights[i - 1]) / 2.0
-        clear_gap_px = raw_gap_px - ref_h_px
-        if -50 < clear_gap_px < 300:
-            gaps_mm.append(clear_gap_px * mm_per_px)
+    line_baselines = _line_means(strokes, (strokes["y"] + strokes["h"]).astype(np.float64))
+    line_heights = _line_means(strokes, strokes["h"].astype(np.float64))
 
-    return float(mean(gaps_mm)) if gaps_mm else None
+    raw_gap_px = np.diff(line_baselines)
+    ref_h_px = (line_heights[1:] + line_heights[:-1]) / 2.0
+    clear_gap_px = raw_gap_px - ref_h_px
+    gaps_px = clear_gap_px[(clear_gap_px > -50) & (clear_gap_px < 300)]
+    return float(np.mean(gaps_px * mm_per_px)) if gaps_px.size else None
 
 
 def estimate_line_direction_angle_deg(lines):
+    strokes = as_stroke_table(lines)
     angles = []
-    for line in lines:
+    for line in strokes.iter_lines():
         if len(line) < 8:
             continue
-        xs = np.array([p["cx"] for p in line], dtype=np.float32)
-        ys = np.array([p["y"] + p["h"] for p in line], dtype=np.float32)
+        xs = line["cx"].astype(np.float32)
+        ys = (line["y"] + line["h"]).astype(np.float32)
         if np.std(xs) < 1e-3:
             continue
         slope = np.polyfit(xs, ys, 1)[0]
@@ -112,27 +120,21 @@ def estimate_line_direction_angle_deg(lines):
 
 
 def estimate_stroke_inclination_angle_deg(lines):
-    angles = [p.get("angle_deg") for line in lines for p in line if p.get("angle_deg") is not None]
-    if not angles:
+    strokes = as_stroke_table(lines)
+    if len(strokes) == 0:
         return None
-    return float(mean(angles))
+    return float(np.mean(strokes["angle_deg"]))
 
 
 def estimate_margins_mm(global_lines, aligned_shape, mm_per_px):
-    if not global_lines:
+    strokes = as_stroke_table(global_lines)
+    if len(strokes) == 0:
         return None, None, None
 
     h, w = aligned_shape[:2]
-    xs_left = [p["x"] for line in global_lines for p in line]
-    xs_right = [p["x"] + p["w"] for line in global_lines for p in line]
-    ys_top = [p["y"] for line in global_lines for p in line]
-
-    if not xs_left or not xs_right or not ys_top:
-        return None, None, None
-
-    margin_left_px = max(0.0, float(min(xs_left)))
-    margin_right_px = max(0.0, float(w - max(xs_right)))
-    margin_top_px = max(0.0, float(min(ys_top)))
+    margin_left_px = max(0.0, float(strokes["x"].min()))
+    margin_right_px = max(0.0, float(w - (strokes["x"] + strokes["w"]).max()))
+    margin_top_px = max(0.0, float(strokes["y"].min()))
     return margin_left_px * mm_per_px, margin_right_px * mm_per_px, margin_top_px * mm_per_px
 
 
@@ -145,8 +147,8 @@ def estimate_pressure_level(roi_img, binary, local_lines):
         return ""
 
     darkness = float(255.0 - np.mean(gray[mask]))
-    widths = [p["w"] for line in local_lines for p in line]
-    mean_w = float(mean(widths)) if widths else 0.0
+    strokes = as_stroke_table(local_lines)
+    mean_w = float(np.mean(strokes["w"])) if len(strokes) else 0.0
     if darkness > 150 or mean_w >= 3.2:
         return "forte"
     if darkness < 85 and mean_w <= 2.0:
@@ -155,18 +157,12 @@ def estimate_pressure_level(roi_img, binary, local_lines):
 
 
 def estimate_stroke_quality_level(local_lines):
-    palos = [p for line in local_lines for p in line]
-    if not palos:
+    strokes = as_stroke_table(local_lines)
+    if len(strokes) == 0:
         return ""
-    fill_ratios = []
-    deviations = []
-    for p in palos:
-        wh = max(1.0, float(p["w"] * p["h"]))
-        fill_ratios.append(float(p["area"]) / wh)
-        if p.get("angle_deg") is not None:
-            deviations.append(abs(float(p["angle_deg"]) - 90.0))
-    mean_fill = float(mean(fill_ratios)) if fill_ratios else 0.0
-    mean_dev = float(mean(deviations)) if deviations else 0.0
+    wh = np.maximum(1.0, (strokes["w"] * strokes["h"]).astype(np.float64))
+    mean_fill = float(np.mean(strokes["area"] / wh))
+    mean_dev = float(np.mean(np.abs(strokes["angle_deg"] - 90.0)))
 
     if mean_fill < 0.33:
         return "descontinua"
@@ -176,7 +172,8 @@ def estimate_stroke_quality_level(local_lines):
 
 
 def estimate_organization_level(local_lines, line_counts):
-    if not local_lines:
+    strokes = as_stroke_table(local_lines)
+    if strokes.num_lines == 0:
         return ""
     counts_cv = 0.0
     if line_counts:
@@ -184,11 +181,11 @@ def estimate_organization_level(local_lines, line_counts):
         if avg > 0:
             counts_cv = float(np.std(line_counts) / avg)
 
-    y_centers = [float(mean([p["cy"] for p in line])) for line in local_lines if line]
-    y_gaps = [abs(y_centers[i] - y_centers[i - 1]) for i in range(1, len(y_centers))]
+    y_centers = _line_means(strokes, strokes["cy"])
+    y_gaps = np.abs(np.diff(y_centers))
     gaps_cv = 0.0
-    if y_gaps:
-        gavg = float(mean(y_gaps))
+    if y_gaps.size:
+        gavg = float(np.mean(y_gaps))
         if gavg > 0:
             gaps_cv = float(np.std(y_gaps) / gavg)
 
@@ -205,17 +202,15 @@ def estimate_organization_level(local_lines, line_counts):
 
 
 def estimate_order_pattern(local_lines):
-    if not local_lines:
+    strokes = as_stroke_table(local_lines)
+    if strokes.num_lines == 0:
         return "nao_informado"
     dispersions = []
-    for line in local_lines:
+    for line in strokes.iter_lines():
         if len(line) < 3:
             continue
-        xs = [p["x"] for p in line]
-        gaps = [xs[i] - xs[i - 1] for i in range(1, len(xs))]
-        if not gaps:
-            continue
-        gavg = float(mean(gaps))
+        gaps = np.diff(line["x"])
+        gavg = float(np.mean(gaps))
         if gavg <= 0:
             continue
         dispersions.append(float(np.std(gaps) / gavg))
@@ -229,7 +224,7 @@ def estimate_auto_quality(aligned, roi_img, binary, local_lines, line_counts):
     flags = []
     score = 1.0
 
-    if aligned is None or roi_img is None or binary is None:
+    if roi_img is None or binary is None:
         return {"score": 0.0, "requires_manual_review": True, "flags": ["imagem_invalida"]}
 
     roi_h, roi_w = roi_img.shape[:2]
@@ -243,7 +238,8 @@ def estimate_auto_quality(aligned, roi_img, binary, local_lines, line_counts):
         score -= 0.25
         flags.append("ruido_ou_sombra_alta")
 
-    if len(local_lines) < 3:
+    strokes = as_stroke_table(local_lines)
+    if strokes.num_lines < 3:
         score -= 0.25
         flags.append("poucas_linhas_detectadas")
 
@@ -255,7 +251,7 @@ def estimate_auto_quality(aligned, roi_img, binary, local_lines, line_counts):
                 score -= 0.15
                 flags.append("alta_variacao_contagem_linhas")
 
-    if any(len(line) < 8 for line in local_lines):
+    if any(c < 8 for c in strokes.line_counts()):
         score -= 0.1
         flags.append("linhas_curtas_detectadas")
 
@@ -277,12 +273,12 @@ def draw_detection_overlay(base_img, lines, roi_rect=None):
         x1, y1, x2, y2 = roi_rect
         cv2.rectangle(out, (x1, y1), (x2, y2), (255, 255, 0), 2)
 
-    for i, line in enumerate(lines):
+    for i, line in enumerate(as_stroke_table(lines).iter_lines()):
         color = palette[i % len(palette)]
-        for p in line:
-            cv2.rectangle(out, (p["x"], p["y"]), (p["x"] + p["w"], p["y"] + p["h"]), color, 1)
+        for x, y, w, h in zip(line["x"].tolist(), line["y"].tolist(), line["w"].tolist(), line["h"].tolist()):
+            cv2.rectangle(out, (x, y), (x + w, y + h), color, 1)
 
-        y_label = int(line[0]["y"] - 5) if line else 10
+        y_label = int(line["y"][0] - 5) if len(line) else 10
         cv2.putText(
             out,
             f"L{i + 1}: {len(line)}",
@@ -304,95 +300,373 @@ def save_line_counts_csv(csv_path, line_counts):
             writer.writerow([i, count])
 
 
-def save_outputs(output_dir, aligned, roi_img, binary, overlay, line_counts, metrics):
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _write_image(path, image):
+    # cv2.imwrite devolve False em vez de lancar; sem isso o flush() do
+    # ArtifactWriter nunca veria a falha.
+    if not cv2.imwrite(path, image):
+        raise OSError(f"Falha ao gravar imagem: {path}")
+
+
+def save_outputs(output_dir, aligned, roi_img, binary, overlay, line_counts, metrics, artifacts=None, writer=None):
+    """
+    Grava os artefatos selecionados (ver src.artifacts.ARTIFACTS; None = todos).
+    Com um ArtifactWriter a codificacao e a escrita saem do caminho critico;
+    o JSON e serializado antes, entao alterar metrics depois nao o afeta.
+    """
     os.makedirs(output_dir, exist_ok=True)
+    selected = resolve_artifacts(artifacts)
+    out = Path(output_dir)
+    jobs = []
+
+    images = {"aligned": aligned, "roi": roi_img, "binary": binary, "overlay": overlay}
+    for name in IMAGE_ARTIFACTS:
+        if name in selected and images[name] is not None:
+            jobs.append((_write_image, str(out / f"{name}.jpg"), images[name]))
+    if "line_counts" in selected:
+        jobs.append((save_line_counts_csv, out / "contagem_por_linha.csv", list(line_counts)))
+    if "resultado" in selected:
+        text = json.dumps({"line_counts": line_counts, "metrics": metrics}, ensure_ascii=False, indent=2)
+        jobs.append((_write_text, out / "resultado.json", text))
+
+    for fn, *args in jobs:
+        if writer is not None:
+            writer.submit(fn, *args)
+        else:
+            fn(*args)
+
+
+def extract_measurements(strokes, line_counts, roi_rect, aligned_shape, roi_img, binary, detection_stats) -> Dict:
+    """Medidas brutas da visao computacional (tudo que o score consome)."""
+    x1, y1, _, _ = roi_rect
+    global_strokes = to_global_lines(strokes, x1, y1)
+    mm_per_px = 210.0 / float(aligned_shape[1])
+    margin_left_mm, margin_right_mm, margin_top_mm = estimate_margins_mm(global_strokes, aligned_shape, mm_per_px)
+    return {
+        "line_counts": list(line_counts),
+        "roi_rect": [int(v) for v in roi_rect],
+        "aligned_shape": [int(v) for v in aligned_shape[:2]],
+        "spacing_mm": estimate_spacing_mm(strokes, mm_per_px=mm_per_px),
+        "height_mm": estimate_height_mm(strokes, mm_per_px=mm_per_px),
+        "line_spacing_mm": estimate_line_spacing_mm(strokes, mm_per_px=mm_per_px),
+        "line_direction_angle_deg": estimate_line_direction_angle_deg(strokes),
+        "stroke_inclination_angle_deg": estimate_stroke_inclination_angle_deg(strokes),
+        "margin_left_mm": margin_left_mm,
+        "margin_right_mm": margin_right_mm,
+        "margin_top_mm": margin_top_mm,
+        "pressure_level": estimate_pressure_level(roi_img, binary, strokes),
+        "stroke_quality_level": estimate_stroke_quality_level(strokes),
+        "organization_level": estimate_organization_level(strokes, line_counts),
+        "order_pattern": estimate_order_pattern(strokes),
+        "auto_quality": estimate_auto_quality(None, roi_img, binary, strokes, line_counts),
+        "detection_stats": detection_stats,
+    }
+
+
+def score_measurements(measurements: Dict, errors: int = 0, swap_lr_margins: bool = False) -> Dict:
+    margin_left_mm = measurements["margin_left_mm"]
+    margin_right_mm = measurements["margin_right_mm"]
+    if swap_lr_margins:
+        margin_left_mm, margin_right_mm = margin_right_mm, margin_left_mm
+
+    metrics = compute_metrics(
+        line_counts=measurements["line_counts"],
+        error_count=errors,
+        avg_spacing_mm=measurements["spacing_mm"],
+        avg_height_mm=measurements["height_mm"],
+        line_spacing_mm=measurements["line_spacing_mm"],
+        line_direction_angle_deg=measurements["line_direction_angle_deg"],
+        stroke_inclination_angle_deg=measurements["stroke_inclination_angle_deg"],
+        margin_left_mm=margin_left_mm,
+        margin_right_mm=margin_right_mm,
+        margin_top_mm=measurements["margin_top_mm"],
+        pressure_level=measurements["pressure_level"],
+        stroke_quality_level=measurements["stroke_quality_level"],
+        organization_level=measurements["organization_level"],
+        order_pattern=measurements["order_pattern"],
+        reasoning_level="nao_informado",
+    )
+    x1, y1, x2, y2 = measurements["roi_rect"]
+    metrics["roi_rect"] = {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+    metrics["swap_lr_margins"] = bool(swap_lr_margins)
+    metrics["detection_stats"] = dict(measurements["detection_stats"])
+    metrics["auto_quality"] = dict(measurements["auto_quality"])
+    return metrics
+
+
+ImageSource = Union[str, os.PathLike, bytes, bytearray, memoryview, np.ndarray]
+
+
+def _as_bgr(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    if image.ndim == 3 and image.shape[2] == 3:
+        return image
+    raise ValueError(f"Imagem em memoria com shape invalido: {image.shape}")
 
-    cv2.imwrite(str(Path(output_dir) / "aligned.jpg"), aligned)
-    cv2.imwrite(str(Path(output_dir) / "roi.jpg"), roi_img)
-    cv2.imwrite(str(Path(output_dir) / "binary.jpg"), binary)
-    cv2.imwrite(str(Path(output_dir) / "overlay.jpg"), overlay)
 
-    save_line_counts_csv(Path(output_dir) / "contagem_por_linha.csv", line_counts)
+def _resolve_image_source(image: ImageSource, need_bytes: bool = False):
+    """
+    Normaliza a entrada de process_image: caminho (str), bytes codificados ou
+    ndarray BGR. Caminhos viram bytes quando um cache precisa do conteudo.
+    """
+    if isinstance(image, np.ndarray):
+        if image.dtype != np.uint8:
+            raise ValueError(f"Imagem em memoria deve ser uint8 (recebido {image.dtype})")
+        return _as_bgr(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
 
-    with open(Path(output_dir) / "resultado.json", "w", encoding="utf-8") as f:
-        json.dump({"line_counts": line_counts, "metrics": metrics}, f, ensure_ascii=False, indent=2)
+    image_path = os.fspath(image)
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Imagem nao encontrada: {image_path}")
+    return Path(image_path).read_bytes() if need_bytes else image_path
+
+
+def _decode_image(image):
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, bytes):
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imread(image)
+    if img is None:
+        raise RuntimeError("Nao foi possivel abrir a imagem com OpenCV")
+    return img
+
+
+def _run_image_stages(aligner, image, roi_frac, stage_cache=None, align_mode="page"):
+    """
+    Alinhamento -> ROI -> binarizacao, reaproveitando estagios em cache.
+    align_mode="roi" faz o warp direto para a ROI e devolve aligned=None.
+    """
+    tracer = aligner.tracer
+
+    def _decode():
+        with tracer.span("decode"):
+            return _decode_image(image)
+
+    def _binarize(roi_img):
+        with tracer.span("binarize"):
+            return aligner.binarize(roi_img)
+
+    if align_mode == "roi":
+        roi_img, roi_rect = aligner.get_aligned_roi(_decode(), roi_frac=roi_frac)
+        return None, roi_img, roi_rect, _binarize(roi_img)
+
+    if stage_cache is None:
+        aligned = aligner.get_aligned_image(_decode())
+        roi_img, roi_rect = aligner.crop_roi(aligned, roi_frac=roi_frac)
+        return aligned, roi_img, roi_rect, _binarize(roi_img)
+
+    aligned_key = make_stage_key("aligned", image_digest(image), PIPELINE_VERSION)
+    with tracer.span("stage_cache_get"):
+        aligned = stage_cache.get_array(aligned_key)
+    if aligned is None:
+        aligned = aligner.get_aligned_image(_decode())
+        stage_cache.put_array(aligned_key, aligned)
+
+    roi_img, roi_rect = aligner.crop_roi(aligned, roi_frac=roi_frac)
+
+    binary_key = make_stage_key(
+        "binary",
+        aligned_key,
+        PIPELINE_VERSION,
+        extra={"roi_rect": list(roi_rect), "binarize_method": aligner.binarize_method},
+    )
+    with tracer.span("stage_cache_get"):
+        binary = stage_cache.get_array(binary_key)
+    if binary is None:
+        binary = _binarize(roi_img)
+        stage_cache.put_array(binary_key, binary)
+    return aligned, roi_img, roi_rect, binary
 
 
 def process_image(
-    image_path: str,
+    image_path: ImageSource,
     errors: int = 0,
     roi_frac: Optional[Tuple[float, float, float, float]] = None,
     output_dir: Optional[str] = None,
     save_artifacts: bool = True,
     swap_lr_margins: bool = False,
+    cache_dir: Optional[str] = None,
+    stage_cache_dir: Optional[str] = None,
+    align_mode: str = "page",
+    binarize_method: Optional[str] = None,
+    trace=False,
+    artifacts: Optional[Sequence[str]] = None,
+    artifact_writer=None,
+    metrics_only: bool = False,
 ) -> PipelineResult:
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Imagem nao encontrada: {image_path}")
-
-    original_img = cv2.imread(image_path)
-    if original_img is None:
-        raise RuntimeError("Nao foi possivel abrir a imagem com OpenCV")
+    """
+    image_path: caminho da imagem, bytes codificados (jpg/png, via imdecode)
+    ou ndarray uint8 (BGR, cinza ou BGRA). Bytes e ndarray nao tocam o disco.
+
+    cache_dir: se informado, as medidas de visao computacional ficam em cache
+    (chave = bytes da imagem + ROI + parametros de config + PIPELINE_VERSION).
+    Num acerto so o score e recalculado; as imagens do resultado ficam None.
+    Com imagens a salvar o cache so e gravado, nunca lido.
+
+    stage_cache_dir: cache dos estagios intermediarios (alinhada, binaria).
+    Cada estagio so e recalculado quando seus proprios parametros mudam.
+
+    align_mode: "page" (padrao) alinha a pagina inteira; "roi" faz o warp
+    direto para a ROI (aligned e overlay ficam None, sem cache de estagios).
+    As medidas dos dois caminhos diferem levemente, entao "roi" so e usado
+    quando pedido e entra na chave do cache.
+
+    binarize_method: backend de binarizacao (padrao: BINARIZE_METHOD do config).
+
+    artifacts: artefatos a salvar (src.artifacts.ARTIFACTS; padrao: todos).
+    Sem imagens na selecao a pagina alinhada e o overlay nao sao gerados.
+    artifact_writer: ArtifactWriter para gravar em segundo plano; quem chama
+    faz o flush() antes de depender dos arquivos.
+
+    metrics_only: o resultado nao guarda imagens (aligned, roi_img, binary e
+    overlay ficam None) e o overlay so e desenhado se for um artefato a
+    salvar. Para quem so usa metrics/line_counts em lotes grandes.
+
+    trace: True (ou um StageTracer) mede tempo de parede, CPU e pico de
+    alocacao por estagio; o resultado vai em result.trace e metrics["trace"].
+    Desligado (padrao) o custo e um contexto vazio por estagio.
+    """
+    if align_mode not in ALIGN_MODES:
+        raise ValueError(f"align_mode invalido: {align_mode}")
+    tracer = make_tracer(trace)
+    tracer.start()
+    try:
+        result = _process_image(
+            image_path,
+            errors,
+            roi_frac,
+            output_dir,
+            save_artifacts,
+            swap_lr_margins,
+            cache_dir,
+            stage_cache_dir,
+            align_mode,
+            binarize_method,
+            resolve_artifacts(artifacts),
+            artifact_writer,
+            metrics_only,
+            tracer,
+        )
+    finally:
+        tracer.stop()
+    if tracer.enabled:
+        result.trace = tracer.to_dict()
+        result.metrics["trace"] = result.trace
+    return result
+
+
+def _process_image(
+    image_path,
+    errors,
+    roi_frac,
+    output_dir,
+    save_artifacts,
+    swap_lr_margins,
+    cache_dir,
+    stage_cache_dir,
+    align_mode,
+    binarize_method,
+    artifacts,
+    artifact_writer,
+    metrics_only,
+    tracer,
+) -> PipelineResult:
+    image = _resolve_image_source(image_path, need_bytes=bool(cache_dir or stage_cache_dir))
 
-    aligner = DocumentAligner()
+    aligner = DocumentAligner(binarize_method=binarize_method, tracer=tracer)
     detector = PaloDetector()
 
-    aligned = aligner.get_aligned_image(original_img)
-    roi_img, roi_rect = aligner.crop_roi(aligned, roi_frac=roi_frac)
-    binary = aligner.binarize(roi_img)
+    cache = None
+    cache_key = None
+    saving = bool(save_artifacts and output_dir)
+    needs_images = saving and any(a in IMAGE_ARTIFACTS for a in artifacts)
+    if align_mode == "roi" and needs_images:
+        raise ValueError("align_mode='roi' nao gera aligned/overlay; use 'page' para salvar imagens")
+    if cache_dir:
+        cache = ResultCache(cache_dir)
+        cache_key = make_cache_key(
+            image,
+            roi_frac,
+            PIPELINE_VERSION,
+            extra={"binarize_method": aligner.binarize_method, "align_mode": align_mode},
+        )
+        with tracer.span("cache_get"):
+            hit = None if needs_images else cache.get(cache_key)
+        if hit is not None:
+            measurements, strokes = hit
+            with tracer.span("score"):
+                metrics = score_measurements(measurements, errors=errors, swap_lr_margins=swap_lr_margins)
+            line_counts = list(measurements["line_counts"])
+            if saving:
+                with tracer.span("save_outputs"):
+                    save_outputs(
+                        output_dir, None, None, None, None, line_counts, metrics, artifacts, writer=artifact_writer
+                    )
+            return PipelineResult(
+                metrics=metrics,
+                line_counts=line_counts,
+                strokes=strokes,
+                roi_rect=tuple(measurements["roi_rect"]),
+                aligned=None,
+                roi_img=None,
+                binary=None,
+                overlay=None,
+                cache_hit=True,
+            )
+
+    stage_cache = StageCache(stage_cache_dir) if stage_cache_dir else None
+    aligned, roi_img, roi_rect, binary = _run_image_stages(
+        aligner, image, roi_frac, stage_cache=stage_cache, align_mode=align_mode
+    )
 
-    detector.find_palos(binary)
-    local_lines = detector.group_lines()
+    with tracer.span("find_palos"):
+        detector.find_palos(binary)
+    with tracer.span("group_lines"):
+        strokes = detector.group_lines()
     line_counts = detector.get_line_counts()
 
-    x1, y1, x2, y2 = roi_rect
-    global_lines = to_global_lines(local_lines, x1, y1)
-    overlay = draw_detection_overlay(aligned, global_lines, roi_rect=roi_rect)
-
-    mm_per_px = 210.0 / float(aligned.shape[1])
-    spacing_mm = estimate_spacing_mm(local_lines, mm_per_px=mm_per_px)
-    height_mm = estimate_height_mm(local_lines, mm_per_px=mm_per_px)
-    line_spacing_mm = estimate_line_spacing_mm(local_lines, mm_per_px=mm_per_px)
-    line_direction_angle_deg = estimate_line_direction_angle_deg(local_lines)
-    stroke_inclination_angle_deg = estimate_stroke_inclination_angle_deg(local_lines)
-    margin_left_mm, margin_right_mm, margin_top_mm = estimate_margins_mm(global_lines, aligned.shape, mm_per_px)
-    if swap_lr_margins:
-        margin_left_mm, margin_right_mm = margin_right_mm, margin_left_mm
-    pressure_level = estimate_pressure_level(roi_img, binary, local_lines)
-    stroke_quality_level = estimate_stroke_quality_level(local_lines)
-    organization_level = estimate_organization_level(local_lines, line_counts)
-    order_pattern = estimate_order_pattern(local_lines)
-    auto_quality = estimate_auto_quality(aligned, roi_img, binary, local_lines, line_counts)
+    # A pagina alinhada (e o overlay sobre ela) so existe quando foi pedida.
+    overlay = None
+    draw_overlay = ("overlay" in artifacts) if saving else not metrics_only
+    if aligned is not None and draw_overlay:
+        x1, y1, _, _ = roi_rect
+        with tracer.span("overlay"):
+            overlay = draw_detection_overlay(aligned, to_global_lines(strokes, x1, y1), roi_rect=roi_rect)
+
+    with tracer.span("measure"):
+        measurements = extract_measurements(
+            strokes, line_counts, roi_rect, (TARGET_HEIGHT, TARGET_WIDTH), roi_img, binary, detector.get_detection_stats()
+        )
+    if cache is not None:
+        with tracer.span("cache_put"):
+            cache.put(cache_key, measurements, strokes)
 
-    metrics = compute_metrics(
-        line_counts=line_counts,
-        error_count=errors,
-        avg_spacing_mm=spacing_mm,
-        avg_height_mm=height_mm,
-        line_spacing_mm=line_spacing_mm,
-        line_direction_angle_deg=line_direction_angle_deg,
-        stroke_inclination_angle_deg=stroke_inclination_angle_deg,
-        margin_left_mm=margin_left_mm,
-        margin_right_mm=margin_right_mm,
-        margin_top_mm=margin_top_mm,
-        pressure_level=pressure_level,
-        stroke_quality_level=stroke_quality_level,
-        organization_level=organization_level,
-        order_pattern=order_pattern,
-        reasoning_level="nao_informado",
-    )
-    metrics["roi_rect"] = {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
-    metrics["swap_lr_margins"] = bool(swap_lr_margins)
-    metrics["detection_stats"] = detector.get_detection_stats()
-    metrics["auto_quality"] = auto_quality
+    with tracer.span("score"):
+        metrics = score_measurements(measurements, errors=errors, swap_lr_margins=swap_lr_margins)
+
+    if saving:
+        with tracer.span("save_outputs"):
+            save_outputs(
+                output_dir, aligned, roi_img, binary, overlay, line_counts, metrics, artifacts, writer=artifact_writer
+            )
 
-    if save_artifacts and output_dir:
-        save_outputs(output_dir, aligned, roi_img, binary, overlay, line_counts, metrics)
+    if metrics_only:
+        aligned = roi_img = binary = overlay = None
 
     return PipelineResult(
         metrics=metrics,
         line_counts=line_counts,
-        local_lines=local_lines,
-        global_lines=global_lines,
+        strokes=strokes,
         roi_rect=roi_rect,
         aligned=aligned,
         roi_img=roi_img,
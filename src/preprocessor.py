@@ -4,20 +4,31 @@ import numpy as np
 from config import (
     ADAPTIVE_BLOCK_SIZE,
     ADAPTIVE_C,
+    BINARIZE_METHOD,
     CLAHE_CLIP_LIMIT,
     CLAHE_GRID_SIZE,
+    CONTOUR_MAX_SIDE,
+    CONTOUR_REFINE_SUBPIX,
     ROI_X1,
     ROI_X2,
     ROI_Y1,
     ROI_Y2,
+    SAUVOLA_K,
+    SAUVOLA_R,
     TARGET_HEIGHT,
     TARGET_WIDTH,
 )
+from src.tracing import NULL_TRACER
+
+
+BINARIZE_METHODS = ("bilateral", "median", "box", "sauvola")
 
 
 class DocumentAligner:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, binarize_method=None, tracer=NULL_TRACER):
         self.debug = debug
+        self.binarize_method = (binarize_method or BINARIZE_METHOD).strip().lower()
+        self.tracer = tracer
 
     @staticmethod
     def _order_points(pts):
@@ -35,7 +46,7 @@ class DocumentAligner:
     def _clamp_frac(v):
         return max(0.0, min(1.0, float(v)))
 
-    def _find_document_contour(self, image):
+    def _find_document_contour_at(self, image):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         blur = cv2.GaussianBlur(gray, (5, 5), 0)
         edges = cv2.Canny(blur, 50, 150)
@@ -61,20 +72,104 @@ class DocumentAligner:
 
         return None
 
-    def _warp_to_target(self, image, points):
+    @staticmethod
+    def _refine_corners(image, corners, window):
+        # cornerSubPix em recortes ao redor de cada canto (evita converter a
+        # foto inteira para cinza).
+        h, w = image.shape[:2]
+        win = int(max(2, window))
+        pad = 2 * win + 2
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.05)
+
+        out = corners.astype(np.float32).copy()
+        for k, (cx, cy) in enumerate(out):
+            x0 = int(max(0, min(w - 1, round(cx))) - pad)
+            y0 = int(max(0, min(h - 1, round(cy))) - pad)
+            x0, y0 = max(0, x0), max(0, y0)
+            x1, y1 = min(w, x0 + 2 * pad + 1), min(h, y0 + 2 * pad + 1)
+            if (x1 - x0) <= 2 * win + 5 or (y1 - y0) <= 2 * win + 5:
+                continue
+            patch = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            start = np.array([[[cx - x0, cy - y0]]], dtype=np.float32)
+            start[..., 0] = np.clip(start[..., 0], win, patch.shape[1] - win - 1)
+            start[..., 1] = np.clip(start[..., 1], win, patch.shape[0] - win - 1)
+            refined = cv2.cornerSubPix(patch, start.copy(), (win, win), (-1, -1), criteria)
+
+            # cornerSubPix pode divergir em cantos pouco contrastados: mantem o
+            # ponto reescalado quando o ajuste anda mais que a janela.
+            if float(np.linalg.norm(refined - start)) <= win:
+                out[k] = refined.reshape(2) + np.array([x0, y0], dtype=np.float32)
+        return out
+
+    def _find_document_contour(self, image):
+        # Busca do contorno em resolucao reduzida: so saem 4 cantos, entao
+        # nao vale rodar blur/Canny/morfologia na foto inteira (12-48 MP).
+        h, w = image.shape[:2]
+        scale = float(CONTOUR_MAX_SIDE) / float(max(h, w))
+        if scale >= 1.0:
+            return self._find_document_contour_at(image)
+
+        # Amostragem por vizinho mais proximo ate 2x o alvo e media 2x2
+        # (INTER_AREA): le so uma fracao da foto e ainda suaviza serrilhado.
+        sw, sh = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+        small = cv2.resize(image, (sw * 2, sh * 2), interpolation=cv2.INTER_NEAREST)
+        small = cv2.resize(small, (sw, sh), interpolation=cv2.INTER_AREA)
+        corners = self._find_document_contour_at(small)
+        if corners is None:
+            return None
+
+        sx, sy = w / float(sw), h / float(sh)
+        corners = (corners.astype(np.float32) + 0.5) * np.array([sx, sy], dtype=np.float32) - 0.5
+        if CONTOUR_REFINE_SUBPIX:
+            corners = self._refine_corners(image, corners, window=int(round(2 * max(sx, sy))))
+        return corners
+
+    def _page_matrix(self, points):
         rect = self._order_points(points)
         dst = np.array(
             [[0, 0], [TARGET_WIDTH - 1, 0], [TARGET_WIDTH - 1, TARGET_HEIGHT - 1], [0, TARGET_HEIGHT - 1]],
             dtype="float32",
         )
-        matrix = cv2.getPerspectiveTransform(rect, dst)
+        return cv2.getPerspectiveTransform(rect, dst)
+
+    @staticmethod
+    def _resize_matrix(image_shape):
+        # Mesmo mapeamento de centro de pixel que cv2.resize (fallback sem contorno).
+        h, w = image_shape[:2]
+        sx = TARGET_WIDTH / float(w)
+        sy = TARGET_HEIGHT / float(h)
+        return np.array(
+            [[sx, 0.0, 0.5 * sx - 0.5], [0.0, sy, 0.5 * sy - 0.5], [0.0, 0.0, 1.0]],
+            dtype=np.float64,
+        )
+
+    def _warp_to_target(self, image, points):
+        matrix = self._page_matrix(points)
         return cv2.warpPerspective(image, matrix, (TARGET_WIDTH, TARGET_HEIGHT))
 
     def get_aligned_image(self, image):
-        contour = self._find_document_contour(image)
-        if contour is None:
-            return cv2.resize(image, (TARGET_WIDTH, TARGET_HEIGHT))
-        return self._warp_to_target(image, contour)
+        with self.tracer.span("find_document_contour"):
+            contour = self._find_document_contour(image)
+        with self.tracer.span("warp"):
+            if contour is None:
+                return cv2.resize(image, (TARGET_WIDTH, TARGET_HEIGHT))
+            return self._warp_to_target(image, contour)
+
+    def get_aligned_roi(self, image, roi_frac=None):
+        """
+        Warp direto da foto para a ROI: compoe a homografia da pagina com o
+        deslocamento da ROI, sem materializar a pagina alinhada inteira.
+        """
+        roi_rect = self.get_roi_rect((TARGET_HEIGHT, TARGET_WIDTH), roi_frac=roi_frac)
+        with self.tracer.span("find_document_contour"):
+            contour = self._find_document_contour(image)
+        matrix = self._resize_matrix(image.shape) if contour is None else self._page_matrix(contour)
+
+        x1, y1, x2, y2 = roi_rect
+        shift = np.array([[1.0, 0.0, -x1], [0.0, 1.0, -y1], [0.0, 0.0, 1.0]], dtype=np.float64)
+        with self.tracer.span("warp"):
+            roi_img = cv2.warpPerspective(image, shift @ matrix, (x2 - x1, y2 - y1))
+        return roi_img, roi_rect
 
     def get_roi_rect(self, image_shape, roi_frac=None):
         h, w = image_shape[:2]
@@ -113,18 +208,45 @@ class DocumentAligner:
         clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_GRID_SIZE)
         return clahe.apply(gray)
 
-    def binarize(self, aligned_image):
-        gray = self.to_grayscale(aligned_image)
-
-        # Pequena remocao de ruido mantendo bordas.
-        denoised = cv2.bilateralFilter(gray, d=7, sigmaColor=35, sigmaSpace=35)
-
+    def _denoise_and_threshold(self, gray, prefilter, adaptive_method):
         binary = cv2.adaptiveThreshold(
-            denoised,
+            prefilter(gray),
             255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            adaptive_method,
             cv2.THRESH_BINARY_INV,
             ADAPTIVE_BLOCK_SIZE,
             ADAPTIVE_C,
         )
         return binary
+
+    @staticmethod
+    def _sauvola(gray):
+        # Limiar de Sauvola com media/desvio locais por filtro de caixa
+        # (custo O(1) por pixel, independente do tamanho do bloco).
+        block = (ADAPTIVE_BLOCK_SIZE, ADAPTIVE_BLOCK_SIZE)
+        mean = cv2.boxFilter(gray, cv2.CV_32F, block, borderType=cv2.BORDER_REPLICATE)
+        sq_mean = cv2.sqrBoxFilter(gray, cv2.CV_32F, block, borderType=cv2.BORDER_REPLICATE)
+        std = cv2.sqrt(cv2.max(cv2.subtract(sq_mean, cv2.multiply(mean, mean)), 0.0))
+        # T = m * (1 + k * (s / R - 1)) = m * (1 - k) + m * s * (k / R)
+        threshold = cv2.addWeighted(mean, 1.0 - SAUVOLA_K, cv2.multiply(mean, std), SAUVOLA_K / SAUVOLA_R, 0.0)
+        return cv2.compare(gray.astype(np.float32), threshold, cv2.CMP_LE)
+
+    def binarize(self, aligned_image):
+        gray = self.to_grayscale(aligned_image)
+        method = self.binarize_method
+
+        if method == "bilateral":
+            # Pequena remocao de ruido mantendo bordas.
+            return self._denoise_and_threshold(
+                gray,
+                lambda g: cv2.bilateralFilter(g, d=7, sigmaColor=35, sigmaSpace=35),
+                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            )
+        if method == "median":
+            return self._denoise_and_threshold(gray, lambda g: cv2.medianBlur(g, 3), cv2.ADAPTIVE_THRESH_GAUSSIAN_C)
+        if method == "box":
+            # Media local por imagem integral (ADAPTIVE_THRESH_MEAN_C): o caminho mais rapido.
+            return self._denoise_and_threshold(gray, lambda g: cv2.blur(g, (3, 3)), cv2.ADAPTIVE_THRESH_MEAN_C)
+        if method == "sauvola":
+            return self._sauvola(cv2.blur(gray, (3, 3)))
+        raise ValueError(f"Metodo de binarizacao invalido: {method} (opcoes: {', '.join(BINARIZE_METHODS)})")
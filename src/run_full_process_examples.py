@@ -1,9 +1,11 @@
 ﻿import csv
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -13,7 +15,7 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from src.benchmark_accuracy import _acc as benchmark_acc  # reaproveita regra de acuracia
-from src.ml_models import FEATURE_NAMES, TARGET_MAP, fuse_ml_with_rules, predict_ml_classes, train_ml_models
+from src.ml_models import FEATURE_NAMES, TARGET_MAP, fused_labels, predict_ml_classes_batch, train_ml_models
 from src.pipeline import process_image
 
 
@@ -90,43 +92,80 @@ def extract_target(metrics: Dict, target_col: str) -> str:
     return str(value).strip()
 
 
-def generate_examples(base_images: List[Path], out_root: Path) -> Tuple[List[Dict], List[ExampleResult]]:
+def _init_worker() -> None:
+    # Paralelismo entre imagens base; cada worker usa uma thread do OpenCV.
+    cv2.setNumThreads(1)
+
+
+def _extract_base(base_idx: int, base_path: str, aug_dir: str, cache_dir: Optional[str], save_images: bool) -> List[Dict]:
+    """Gera as 7 variantes de uma imagem base e extrai as metricas de cada uma."""
+    img = cv2.imread(base_path)
+    if img is None:
+        return []
+
+    samples = []
+    for variant in range(7):
+        out_img = Path(aug_dir) / f"real_{base_idx + 1:02d}_v{variant}.jpg"
+        aug = augment_image(img, variant)
+        if save_images:
+            cv2.imwrite(str(out_img), aug)
+
+        result = process_image(aug, output_dir=None, save_artifacts=False, cache_dir=cache_dir, metrics_only=True)
+        samples.append({"image_path": str(out_img), "errors": 0, "metrics": result.metrics})
+    return samples
+
+
+def extract_examples(
+    base_images: List[Path],
+    out_root: Path,
+    cache_dir: Optional[str] = None,
+    save_images: bool = True,
+    workers: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Unica extracao de features por imagem aumentada: as metricas alimentam
+    os pseudo-rotulos, o dataset e o benchmark. Cada imagem base (aumento +
+    processamento das variantes) e um job no pool de processos. save_images
+    grava os JPEGs so como artefato; nada e relido do disco.
+    """
     aug_dir = out_root / "augmented_images"
     aug_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(i, str(p), str(aug_dir), cache_dir, save_images) for i, p in enumerate(base_images)]
+    workers = max(1, min(int(workers or os.cpu_count() or 1), len(jobs) or 1))
 
-    label_rows: List[Dict] = []
-    summary_rows: List[ExampleResult] = []
+    if workers == 1:
+        per_base = [_extract_base(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            per_base = list(pool.map(_extract_base, *zip(*jobs)))
 
-    for base_idx, base_path in enumerate(base_images):
-        img = cv2.imread(str(base_path))
-        if img is None:
-            continue
+    return [sample for samples in per_base for sample in samples]
 
-        for variant in range(7):
-            aug = augment_image(img, variant)
-            out_img = aug_dir / f"real_{base_idx + 1:02d}_v{variant}.jpg"
-            cv2.imwrite(str(out_img), aug)
 
-            result = process_image(str(out_img), output_dir=None, save_artifacts=False)
-            m = result.metrics
-
-            row = {
-                "image_path": str(out_img),
-                "errors": 0,
-            }
-            for tc in TARGET_COLUMNS:
-                row[tc] = extract_target(m, tc)
-            label_rows.append(row)
-
-            summary_rows.append(
-                ExampleResult(
-                    image_path=str(out_img),
-                    total=int(m.get("total", 0) or 0),
-                    linhas=int(m.get("linhas", 0) or 0),
-                    score_final=float(m.get("score_final", 0.0) or 0.0),
-                    auto_quality=float(m.get("auto_quality", {}).get("score", 0.0) or 0.0),
-                )
+def label_examples(samples: List[Dict]) -> Tuple[List[Dict], List[ExampleResult]]:
+    """Pseudo-rotulos (classes das regras) e resumo de cada amostra."""
+    label_rows: List[Dict] = []
+    summary_rows: List[ExampleResult] = []
+
+    for sample in samples:
+        m = sample["metrics"]
+        row = {
+            "image_path": sample["image_path"],
+            "errors": sample["errors"],
+        }
+        for tc in TARGET_COLUMNS:
+            row[tc] = extract_target(m, tc)
+        label_rows.append(row)
+
+        summary_rows.append(
+            ExampleResult(
+                image_path=sample["image_path"],
+                total=int(m.get("total", 0) or 0),
+                linhas=int(m.get("linhas", 0) or 0),
+                score_final=float(m.get("score_final", 0.0) or 0.0),
+                auto_quality=float(m.get("auto_quality", {}).get("score", 0.0) or 0.0),
             )
+        )
 
     return label_rows, summary_rows
 
@@ -140,13 +179,11 @@ def write_labels_csv(path: Path, rows: List[Dict]) -> None:
         wr.writerows(rows)
 
 
-def build_dataset_from_labels(labels_rows: List[Dict], dataset_path: Path) -> None:
+def build_dataset_from_labels(labels_rows: List[Dict], dataset_path: Path, metrics_list: List[Dict]) -> None:
+    """Dataset de treino a partir das metricas ja extraidas (uma por linha de labels)."""
     out_rows = []
-    for row in labels_rows:
-        image_path = row["image_path"]
-        result = process_image(image_path, errors=int(row.get("errors", 0) or 0), output_dir=None, save_artifacts=False)
-        m = result.metrics
-        rec = {"image_path": image_path}
+    for row, m in zip(labels_rows, metrics_list):
+        rec = {"image_path": row["image_path"]}
         for k in FEATURE_NAMES:
             rec[k] = m.get(k)
         for tc in TARGET_COLUMNS:
@@ -160,7 +197,12 @@ def build_dataset_from_labels(labels_rows: List[Dict], dataset_path: Path) -> No
         wr.writerows(out_rows)
 
 
-def run_local_benchmark(labels_rows: List[Dict], model_path: str, threshold: float = 0.75) -> Dict:
+def run_local_benchmark(
+    labels_rows: List[Dict],
+    model_path: str,
+    metrics_list: List[Dict],
+    threshold: float = 0.75,
+) -> Dict:
     from src.ml_models import load_ml_model
 
     ml_payload = load_ml_model(model_path)
@@ -169,34 +211,17 @@ def run_local_benchmark(labels_rows: List[Dict], model_path: str, threshold: flo
     truths = {t: [] for t in TARGET_COLUMNS}
     preds = {m: {t: [] for t in TARGET_COLUMNS} for m in modes}
 
-    for row in labels_rows:
-        result = process_image(row["image_path"], errors=int(row.get("errors", 0) or 0), output_dir=None, save_artifacts=False)
-        base = result.metrics
-        ml = predict_ml_classes(base, ml_payload)
-
-        assist = json.loads(json.dumps(base))
-        assist = fuse_ml_with_rules(assist, ml, mode="assist", confidence_threshold=threshold)
-        hybrid = json.loads(json.dumps(base))
-        hybrid = fuse_ml_with_rules(hybrid, ml, mode="hybrid", confidence_threshold=threshold)
-        override = json.loads(json.dumps(base))
-        override = fuse_ml_with_rules(override, ml, mode="override", confidence_threshold=threshold)
+    # Inferencia ML em lote: uma chamada por alvo para todas as amostras.
+    ml_all = predict_ml_classes_batch(metrics_list, ml_payload)
 
+    for row, base, ml in zip(labels_rows, metrics_list, ml_all):
+        fused = fused_labels(base, ml, thresholds=[threshold])
         for tc in TARGET_COLUMNS:
             truths[tc].append(row.get(tc, ""))
-
-            ckey, is_dict = TARGET_MAP[tc]
-            raw = base.get("classificacoes", {}).get(ckey)
-            if is_dict and isinstance(raw, dict):
-                preds["rules"][tc].append(raw.get("nivel"))
-            else:
-                preds["rules"][tc].append(raw if not is_dict else "")
-
-            for name, metrics in [("ml_assist", assist), ("ml_hybrid", hybrid), ("ml_override", override)]:
-                curr = metrics.get("classificacoes", {}).get(ckey)
-                if is_dict and isinstance(curr, dict):
-                    preds[name][tc].append(curr.get("nivel"))
-                else:
-                    preds[name][tc].append(curr if not is_dict else "")
+            preds["rules"][tc].append(fused["rules"].get(tc))
+            preds["ml_assist"][tc].append(fused["assist"].get(tc))
+            preds["ml_hybrid"][tc].append(fused["hybrid"][0].get(tc))
+            preds["ml_override"][tc].append(fused["override"].get(tc))
 
     per_target = {}
     overall = {m: [] for m in modes}
@@ -279,7 +304,12 @@ def main() -> None:
     if len(base_images) < 2:
         raise RuntimeError("Nao encontrei imagens reais suficientes para montar exemplos.")
 
-    label_rows, summary_rows = generate_examples(base_images, out_root)
+    # Cache das medidas de visao: uma nova execucao nao reprocessa as variantes.
+    cache_dir = str(out_root / "cache")
+
+    samples = extract_examples(base_images, out_root, cache_dir=cache_dir)
+    metrics_list = [s["metrics"] for s in samples]
+    label_rows, summary_rows = label_examples(samples)
     if len(label_rows) < 20:
         raise RuntimeError("Poucas amostras geradas para treino ML (minimo recomendado: 20).")
 
@@ -292,11 +322,11 @@ def main() -> None:
     report_md = ROOT / "output" / "RELATORIO_PROCESSO_COMPLETO_REAIS.md"
 
     write_labels_csv(labels_csv, label_rows)
-    build_dataset_from_labels(label_rows, dataset_csv)
+    build_dataset_from_labels(label_rows, dataset_csv, metrics_list)
     train_out = train_ml_models(str(dataset_csv), str(model_path))
     train_report_json.write_text(json.dumps(train_out.report, ensure_ascii=False, indent=2), encoding="utf-8")
 
-    bench = run_local_benchmark(label_rows, str(model_path), threshold=0.75)
+    bench = run_local_benchmark(label_rows, str(model_path), metrics_list, threshold=0.75)
     benchmark_json.write_text(json.dumps(bench, ensure_ascii=False, indent=2), encoding="utf-8")
 
     write_example_summary(summary_csv, summary_rows)
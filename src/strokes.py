@@ -0,0 +1,147 @@
+﻿from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+STROKE_DTYPE = np.dtype(
+    [
+        ("x", np.int32),
+        ("y", np.int32),
+        ("w", np.int32),
+        ("h", np.int32),
+        ("area", np.int32),
+        ("cx", np.float64),
+        ("cy", np.float64),
+        ("angle_deg", np.float64),
+        ("line", np.int32),
+    ]
+)
+
+# Campos expostos na visao em dicionario (formato historico dos palos).
+RECORD_FIELDS = ("x", "y", "w", "h", "area", "cx", "cy", "angle_deg")
+_INT_FIELDS = ("x", "y", "w", "h", "area")
+
+
+class StrokeTable:
+    """
+    Tabela colunar de palos (ndarray estruturado, um registro por palo).
+
+    A coluna "line" guarda o indice da linha (-1 = sem linha). Tabelas
+    agrupadas ficam ordenadas por linha e, dentro da linha, por x; assim cada
+    linha e uma fatia contigua de `data`.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Optional[np.ndarray] = None):
+        if data is None:
+            data = np.zeros(0, dtype=STROKE_DTYPE)
+        self.data = data
+
+    @classmethod
+    def empty(cls) -> "StrokeTable":
+        return cls()
+
+    @classmethod
+    def from_columns(cls, x, y, w, h, area, angle_deg, line=None) -> "StrokeTable":
+        n = len(x)
+        data = np.zeros(n, dtype=STROKE_DTYPE)
+        data["x"] = x
+        data["y"] = y
+        data["w"] = w
+        data["h"] = h
+        data["area"] = area
+        data["cx"] = data["x"] + (data["w"] / 2.0)
+        data["cy"] = data["y"] + (data["h"] / 2.0)
+        data["angle_deg"] = angle_deg
+        data["line"] = -1 if line is None else line
+        return cls(data)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], line: int = -1) -> "StrokeTable":
+        records = list(records)
+        data = np.zeros(len(records), dtype=STROKE_DTYPE)
+        for name in RECORD_FIELDS:
+            default = 90.0 if name == "angle_deg" else 0
+            data[name] = [(default if p.get(name) is None else p[name]) for p in records]
+        data["line"] = line
+        return cls(data)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[Iterable[Dict]]) -> "StrokeTable":
+        parts = [cls.from_records(line, line=i).data for i, line in enumerate(lines)]
+        if not parts:
+            return cls.empty()
+        return cls(np.concatenate(parts))
+
+    def __len__(self) -> int:
+        """Numero de palos (nao de linhas; ver num_lines)."""
+        return int(self.data.shape[0])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.data[name]
+
+    def __iter__(self):
+        # Sem isso o Python itera via __getitem__ e devolve registros soltos,
+        # e codigo antigo que fazia "for line in lines" erraria em silencio.
+        raise TypeError("StrokeTable nao e iteravel: use iter_lines(), to_lines() ou to_records()")
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes)
+
+    @property
+    def num_lines(self) -> int:
+        if len(self) == 0:
+            return 0
+        return int(self.data["line"].max()) + 1
+
+    def line_counts(self) -> List[int]:
+        lines = self.data["line"]
+        lines = lines[lines >= 0]
+        if lines.size == 0:
+            return []
+        return [int(c) for c in np.bincount(lines)]
+
+    def line_bounds(self) -> np.ndarray:
+        """Indices [inicio, fim) de cada linha em `data` (requer tabela agrupada)."""
+        counts = np.asarray(self.line_counts(), dtype=np.int64)
+        ends = np.cumsum(counts)
+        return np.stack([ends - counts, ends], axis=1) if counts.size else np.zeros((0, 2), dtype=np.int64)
+
+    def iter_lines(self):
+        for start, end in self.line_bounds():
+            yield self.data[int(start) : int(end)]
+
+    def grouped(self, line_index: np.ndarray) -> "StrokeTable":
+        """
+        Nova tabela so com os palos de `line_index >= 0`, ordenada por
+        (linha, x). Empates em x preservam a ordem atual da tabela.
+        """
+        data = self.data.copy()
+        data["line"] = line_index
+        data = data[data["line"] >= 0]
+        order = np.lexsort((np.arange(data.shape[0]), data["x"], data["line"]))
+        return StrokeTable(data[order])
+
+    def shifted(self, offset_x, offset_y) -> "StrokeTable":
+        data = self.data.copy()
+        data["x"] += int(offset_x)
+        data["y"] += int(offset_y)
+        data["cx"] += float(offset_x)
+        data["cy"] += float(offset_y)
+        return StrokeTable(data)
+
+    def to_records(self) -> List[Dict]:
+        cols = {name: self.data[name].tolist() for name in RECORD_FIELDS}
+        return [dict(zip(RECORD_FIELDS, values)) for values in zip(*(cols[name] for name in RECORD_FIELDS))]
+
+    def to_lines(self) -> List[List[Dict]]:
+        return [StrokeTable(chunk).to_records() for chunk in self.iter_lines()]
+
+
+def as_stroke_table(lines) -> StrokeTable:
+    """Aceita StrokeTable ou a visao antiga (lista de linhas com dicts)."""
+    if isinstance(lines, StrokeTable):
+        return lines
+    return StrokeTable.from_lines(lines or [])
@@ -0,0 +1,117 @@
+﻿import math
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config import ROI_X1, ROI_X2, ROI_Y1, ROI_Y2, TARGET_HEIGHT, TARGET_WIDTH
+
+
+@dataclass
+class SheetSpec:
+    """
+    Parametros de uma folha palografica sintetica.
+
+    scale: tamanho da pagina na foto em relacao a TARGET_WIDTH x TARGET_HEIGHT.
+    slant_deg: inclinacao media dos palos; slant_jitter_deg: variacao por palo.
+    skew: deslocamento maximo de cada canto da pagina (fracao da largura),
+    simula a perspectiva da foto. lighting: amplitude do gradiente de luz
+    (0 = uniforme). noise_sigma: ruido gaussiano em niveis de cinza.
+    """
+
+    lines: int = 10
+    palos_per_line: int = 60
+    scale: float = 1.0
+    slant_deg: float = 0.0
+    slant_jitter_deg: float = 3.0
+    palo_height_px: int = 34
+    stroke_px: int = 3
+    skew: float = 0.03
+    lighting: float = 0.25
+    noise_sigma: float = 6.0
+    seed: int = 0
+
+
+def _draw_palos(page: np.ndarray, spec: SheetSpec, rng: np.random.Generator) -> Tuple[list, list]:
+    """Desenha os palos dentro da ROI padrao (coordenadas da pagina alinhada)."""
+    h, w = page.shape[:2]
+    sx, sy = w / TARGET_WIDTH, h / TARGET_HEIGHT
+    roi_x1, roi_x2 = ROI_X1 * TARGET_WIDTH, ROI_X2 * TARGET_WIDTH
+    roi_y1, roi_y2 = ROI_Y1 * TARGET_HEIGHT, ROI_Y2 * TARGET_HEIGHT
+
+    pad_x = 0.02 * (roi_x2 - roi_x1)
+    pad_y = 0.04 * (roi_y2 - roi_y1)
+    x_start, x_end = roi_x1 + pad_x, roi_x2 - pad_x - spec.palo_height_px
+    y_start, y_end = roi_y1 + pad_y, roi_y2 - pad_y - spec.palo_height_px
+    step_x = (x_end - x_start) / max(1, spec.palos_per_line)
+    step_y = (y_end - y_start) / max(1, spec.lines - 1) if spec.lines > 1 else 0.0
+    if step_y and step_y < 1.6 * spec.palo_height_px:
+        raise ValueError("Linhas demais para a altura da ROI: os palos se sobrepoem")
+    if step_x < 2 * spec.stroke_px + 2:
+        raise ValueError("Palos demais por linha: os tracos se tocam")
+
+    thickness = max(1, int(round(spec.stroke_px * (sx + sy) / 2)))
+    line_counts = []
+    slants = []
+    for r in range(spec.lines):
+        y_top = y_start + r * step_y
+        for k in range(spec.palos_per_line):
+            slant = spec.slant_deg + float(rng.uniform(-spec.slant_jitter_deg, spec.slant_jitter_deg))
+            height = spec.palo_height_px * float(rng.uniform(0.85, 1.15))
+            x_top = x_start + (k + 0.5) * step_x + float(rng.uniform(-0.1, 0.1)) * step_x
+            dx = height * math.tan(math.radians(slant))
+            p1 = (int(round(x_top * sx)), int(round(y_top * sy)))
+            p2 = (int(round((x_top - dx) * sx)), int(round((y_top + height) * sy)))
+            cv2.line(page, p1, p2, 30, thickness, lineType=cv2.LINE_AA)
+            slants.append(slant)
+        line_counts.append(spec.palos_per_line)
+    return line_counts, slants
+
+
+def render_sheet(spec: Optional[SheetSpec] = None, **overrides) -> Tuple[np.ndarray, Dict]:
+    """
+    Foto sintetica (BGR uint8) de uma folha preenchida e o gabarito conhecido:
+    total, line_counts, cantos da pagina na foto e os parametros usados.
+    """
+    spec = spec or SheetSpec()
+    if overrides:
+        spec = SheetSpec(**{**asdict(spec), **overrides})
+    rng = np.random.default_rng(spec.seed)
+
+    pw, ph = int(round(TARGET_WIDTH * spec.scale)), int(round(TARGET_HEIGHT * spec.scale))
+    page = np.full((ph, pw), 235, dtype=np.uint8)
+    line_counts, slants = _draw_palos(page, spec, rng)
+
+    # Pagina clara sobre fundo escuro, com a perspectiva de uma foto.
+    margin_x, margin_y = int(0.08 * pw), int(0.06 * ph)
+    cw, ch = pw + 2 * margin_x, ph + 2 * margin_y
+    jitter = rng.uniform(-spec.skew, spec.skew, size=(4, 2)) * pw
+    corners = np.array(
+        [[margin_x, margin_y], [margin_x + pw, margin_y], [margin_x + pw, margin_y + ph], [margin_x, margin_y + ph]],
+        dtype=np.float64,
+    )
+    corners = (corners + jitter).astype(np.float32)
+    src = np.array([[0, 0], [pw, 0], [pw, ph], [0, ph]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(src, corners)
+    photo = cv2.warpPerspective(page, matrix, (cw, ch), flags=cv2.INTER_LINEAR, borderValue=40)
+
+    if spec.lighting:
+        yy, xx = np.mgrid[0:ch, 0:cw].astype(np.float32)
+        angle = float(rng.uniform(0, 2 * math.pi))
+        ramp = (xx / cw) * math.cos(angle) + (yy / ch) * math.sin(angle)
+        ramp -= ramp.min()
+        ramp /= max(1e-6, float(ramp.max()))
+        photo = photo.astype(np.float32) * (1.0 - spec.lighting * ramp)
+    if spec.noise_sigma:
+        photo = photo.astype(np.float32) + rng.normal(0.0, spec.noise_sigma, size=photo.shape).astype(np.float32)
+    photo = np.clip(photo, 0, 255).astype(np.uint8)
+
+    truth = {
+        "total": int(sum(line_counts)),
+        "line_counts": line_counts,
+        "slant_mean_deg": float(np.mean(slants)) if slants else None,
+        "page_corners": corners.tolist(),
+        "spec": asdict(spec),
+    }
+    return cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR), truth
@@ -0,0 +1,177 @@
+﻿import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+_NULL_SPAN = nullcontext()
+
+
+class NullTracer:
+    """Tracer desligado: span() devolve sempre o mesmo contexto vazio."""
+
+    enabled = False
+
+    def span(self, name: str):
+        return _NULL_SPAN
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+# tracemalloc e global ao processo: o primeiro tracer com memoria liga, o
+# ultimo a terminar desliga (se nao estava ligado antes de todos).
+_TRACEMALLOC_LOCK = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _acquire_tracemalloc() -> None:
+    global _tracemalloc_users, _tracemalloc_started
+    with _TRACEMALLOC_LOCK:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc() -> None:
+    global _tracemalloc_users, _tracemalloc_started
+    with _TRACEMALLOC_LOCK:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+class StageTracer:
+    """
+    Tempo de parede, tempo de CPU e pico de alocacao de cada estagio.
+
+    memory=True mede o pico via tracemalloc (arrays NumPy/OpenCV entram na
+    conta); custa mais que os relogios, entao pode ser desligado. Os spans
+    nao se aninham: o pico de um estagio e relativo ao inicio dele. Com
+    tracers simultaneos em threads o pico e do processo, nao so do estagio.
+    """
+
+    enabled = True
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.spans: List[Dict] = []
+        self._origin = time.perf_counter()
+        self._wall_start: Optional[float] = None
+        self._cpu_start: Optional[float] = None
+        self._holds_tracemalloc = False
+        self.wall_ms: Optional[float] = None
+        self.cpu_ms: Optional[float] = None
+
+    def start(self) -> None:
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        if self.memory and not self._holds_tracemalloc:
+            _acquire_tracemalloc()
+            self._holds_tracemalloc = True
+
+    def stop(self) -> None:
+        if self._wall_start is not None:
+            self.wall_ms = (time.perf_counter() - self._wall_start) * 1000.0
+            self.cpu_ms = (time.process_time() - self._cpu_start) * 1000.0
+        if self._holds_tracemalloc:
+            _release_tracemalloc()
+            self._holds_tracemalloc = False
+
+    @contextmanager
+    def span(self, name: str):
+        track = self.memory and tracemalloc.is_tracing()
+        if track:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield
+        finally:
+            t1 = time.perf_counter()
+            entry = {
+                "stage": name,
+                "start_ms": (t0 - self._origin) * 1000.0,
+                "wall_ms": (t1 - t0) * 1000.0,
+                "cpu_ms": (time.process_time() - c0) * 1000.0,
+            }
+            if track:
+                entry["peak_alloc_kb"] = max(0, tracemalloc.get_traced_memory()[1] - base) / 1024.0
+            self.spans.append(entry)
+
+    def to_dict(self) -> Dict:
+        stages = [{k: (round(v, 3) if isinstance(v, float) else v) for k, v in s.items()} for s in self.spans]
+        out = {
+            "wall_ms": round(self.wall_ms, 3) if self.wall_ms is not None else None,
+            "cpu_ms": round(self.cpu_ms, 3) if self.cpu_ms is not None else None,
+            "stages": stages,
+        }
+        if self.memory and stages:
+            out["peak_alloc_kb"] = max(s.get("peak_alloc_kb", 0.0) for s in stages)
+        return out
+
+
+def make_tracer(trace) -> object:
+    """trace=False/None -> NULL_TRACER; True -> StageTracer(); um tracer e usado como veio."""
+    if not trace:
+        return NULL_TRACER
+    if trace is True:
+        from config import TRACE_MEMORY
+
+        return StageTracer(memory=TRACE_MEMORY)
+    return trace
+
+
+_WRITE_LOCK = threading.Lock()
+
+
+def append_trace_jsonl(path: str, trace: Dict, **fields) -> None:
+    """Acrescenta uma linha por estagio (mais os campos extra, ex. image_path)."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    lines = [json.dumps({**fields, **stage}, ensure_ascii=False) for stage in trace.get("stages", [])]
+    with _WRITE_LOCK, open(path, "a", encoding="utf-8") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+def write_chrome_trace(path: str, traces: Iterable[Dict], names: Optional[Iterable[str]] = None) -> None:
+    """
+    Formato de trace do Chrome (chrome://tracing, Perfetto): cada trace vira
+    uma "thread" e cada estagio um evento completo ("ph": "X").
+    """
+    names = list(names) if names is not None else None
+    events = []
+    for tid, trace in enumerate(traces):
+        if names is not None:
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": names[tid]}}
+            )
+        for stage in trace.get("stages", []):
+            args = {k: stage[k] for k in ("cpu_ms", "peak_alloc_kb") if k in stage}
+            events.append(
+                {
+                    "name": stage["stage"],
+                    "ph": "X",
+                    "ts": stage["start_ms"] * 1000.0,
+                    "dur": stage["wall_ms"] * 1000.0,
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
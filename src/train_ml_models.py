@@ -8,7 +8,7 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from src.ml_models import train_ml_models
+from src.ml_models import export_inference_model, load_ml_model, search_forest_params, train_ml_models
 
 
 def parse_args():
@@ -16,12 +16,47 @@ def parse_args():
     p.add_argument("--dataset", required=True, help="CSV com features + colunas target_*")
     p.add_argument("--model-out", default="output/ml_models.pkl", help="Arquivo de modelo de saida")
     p.add_argument("--report-out", default="output/ml_train_report.json", help="Arquivo JSON de relatorio")
+    p.add_argument("--workers", type=int, default=0, help="Alvos treinados em paralelo (0 = automatico)")
+    p.add_argument("--jobs-per-target", type=int, default=0, help="Threads por floresta no fit (0 = automatico)")
+    p.add_argument(
+        "--search",
+        action="store_true",
+        help="Busca parametros da floresta com k-fold antes de treinar e usa os recomendados",
+    )
+    p.add_argument("--folds", type=int, default=5, help="Folds da busca (--search)")
+    p.add_argument("--search-out", default="output/ml_search_report.json", help="Relatorio JSON da busca (--search)")
+    p.add_argument(
+        "--inference-out",
+        default=None,
+        help="Opcional: grava tambem um modelo so com as florestas compiladas (inferencia sem sklearn)",
+    )
     return p.parse_args()
 
 
 def main():
     args = parse_args()
-    out = train_ml_models(dataset_csv=args.dataset, model_path=args.model_out)
+    forest_params = None
+    if args.search:
+        search = search_forest_params(args.dataset, folds=args.folds, workers=args.workers or None)
+        with open(args.search_out, "w", encoding="utf-8") as f:
+            json.dump(search, f, ensure_ascii=False, indent=2)
+        print(f"Busca concluida em {search['wall_seconds']}s; relatorio em: {args.search_out}")
+        for target_col, info in search["targets"].items():
+            rec = info.get("recommended")
+            if rec:
+                print(
+                    f"  {target_col}: {rec['params']} acc={rec['accuracy']} "
+                    f"(melhor {info['best_accuracy']}) nos={rec['n_nodes']} {rec['latency_ms']}ms"
+                )
+        forest_params = search["recommended_params"]
+
+    out = train_ml_models(
+        dataset_csv=args.dataset,
+        model_path=args.model_out,
+        workers=args.workers or None,
+        jobs_per_target=args.jobs_per_target or None,
+        forest_params=forest_params,
+    )
 
     with open(args.report_out, "w", encoding="utf-8") as f:
         json.dump(out.report, f, ensure_ascii=False, indent=2)
@@ -29,6 +64,16 @@ def main():
     print("Treino concluido")
     print(f"Modelo salvo em: {out.model_path}")
     print(f"Relatorio salvo em: {args.report_out}")
+    print(
+        f"Tempo total: {out.timing['wall_seconds']}s "
+        f"({out.timing['workers']} workers x {out.timing['jobs_per_target']} threads)"
+    )
+    for target_col, secs in out.timing["fit_seconds"].items():
+        print(f"  {target_col}: {secs}s")
+
+    if args.inference_out:
+        export_inference_model(load_ml_model(out.model_path), args.inference_out)
+        print(f"Modelo de inferencia salvo em: {args.inference_out}")
 
 
 if __name__ == "__main__":
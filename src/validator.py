@@ -1,16 +1,25 @@
 ﻿import argparse
 import csv
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from statistics import mean
+from typing import Dict, Iterable, List, Optional, Set
 
 # Permite executar via "python src/validator.py".
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from src.pipeline import parse_roi_frac, process_image
+import cv2
+
+import config
+from config import BINARIZE_METHOD
+from src.cache import hash_params
+from src.pipeline import ALIGN_MODES, PIPELINE_VERSION, parse_roi_frac, process_image
+from src.preprocessor import BINARIZE_METHODS
 
 
 def parse_args():
@@ -18,6 +27,35 @@ def parse_args():
     parser.add_argument("--ground-truth", required=True, help="CSV com gabarito")
     parser.add_argument("--output", default="output/validation_report.json", help="JSON de saida")
     parser.add_argument("--roi-frac", default="", help="Override de ROI em fracoes: x1,y1,x2,y2")
+    parser.add_argument("--cache-dir", default="", help="Diretorio de cache das medidas de visao computacional (opcional)")
+    parser.add_argument(
+        "--stage-cache-dir",
+        default="",
+        help="Cache de estagios intermediarios (alinhada/binaria) para varreduras de parametros",
+    )
+    parser.add_argument(
+        "--binarize",
+        default="",
+        choices=["", *BINARIZE_METHODS],
+        help="Backend de binarizacao (padrao: BINARIZE_METHOD do config)",
+    )
+    parser.add_argument(
+        "--align-mode",
+        default="page",
+        choices=ALIGN_MODES,
+        help="roi: warp direto para a ROI (mais rapido; medidas levemente diferentes de page)",
+    )
+    parser.add_argument("--workers", type=int, default=0, help="Processos paralelos (0 = numero de CPUs)")
+    parser.add_argument(
+        "--records",
+        default="",
+        help="JSONL por imagem, so com append (padrao: --output com extensao .jsonl)",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Reprocessa tudo mesmo com imagens ja validadas no JSONL",
+    )
     return parser.parse_args()
 
 
@@ -36,84 +74,245 @@ def line_mae(gt, pred):
     return float(mean([abs(a - b) for a, b in zip(gt_pad, pred_pad)]))
 
 
-def main():
-    args = parse_args()
-    roi_frac = parse_roi_frac(args.roi_frac)
+def validation_config_hash(roi_frac, binarize_method: Optional[str], align_mode: str = "page") -> str:
+    """Hash de tudo que muda metrics_pred: config.py inteiro, ROI, backend, alinhamento e PIPELINE_VERSION."""
+    params = {
+        "config": {k: getattr(config, k) for k in dir(config) if k.isupper()},
+        "roi_frac": [float(v) for v in roi_frac] if roi_frac is not None else None,
+        "binarize_method": binarize_method or BINARIZE_METHOD,
+        "align_mode": align_mode,
+        "pipeline_version": PIPELINE_VERSION,
+    }
+    return hash_params([params])
 
-    rows = []
-    with open(args.ground_truth, "r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            rows.append(row)
 
-    if not rows:
-        raise RuntimeError("CSV de gabarito vazio")
+def _row_key(index: int, row: Dict) -> str:
+    # O indice da linha faz parte da chave: o gabarito pode repetir a mesma
+    # imagem (ex. dois avaliadores) e cada linha conta na avaliacao.
+    return f"{index}|{row['image_path']}|{int(row.get('errors', 0) or 0)}"
 
-    per_image = []
-    abs_errors = []
-    pct_errors = []
-    exact_total_matches = 0
-    line_maes = []
 
-    for row in rows:
-        image_path = row["image_path"]
-        total_gt = int(row["total_gt"])
-        errors = int(row.get("errors", 0) or 0)
-        gt_line_counts = parse_line_counts(row.get("line_counts_gt", ""))
+def iter_records(path: str) -> Iterable[Dict]:
+    """Registros do JSONL; uma linha truncada (queda no meio da escrita) e ignorada."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
 
+
+def _init_worker() -> None:
+    # Paralelismo entre imagens; cada worker usa uma thread do OpenCV.
+    cv2.setNumThreads(1)
+
+
+def _validate_image(key: str, row: Dict, options: Dict) -> Dict:
+    record = {
+        "key": key,
+        "config_hash": options["config_hash"],
+        "image_path": row["image_path"],
+    }
+    try:
         result = process_image(
-            image_path=image_path,
-            errors=errors,
-            roi_frac=roi_frac,
+            image_path=row["image_path"],
+            errors=int(row.get("errors", 0) or 0),
+            roi_frac=options["roi_frac"],
             output_dir=None,
             save_artifacts=False,
+            metrics_only=True,
+            cache_dir=options["cache_dir"],
+            stage_cache_dir=options["stage_cache_dir"],
+            binarize_method=options["binarize_method"],
+            align_mode=options["align_mode"],
         )
-        total_pred = int(result.metrics["total"])
-        pred_line_counts = result.line_counts
+        record.update(
+            {
+                "status": "ok",
+                "total_pred": int(result.metrics["total"]),
+                "line_counts_pred": result.line_counts,
+                "metrics_pred": result.metrics,
+            }
+        )
+    except Exception as exc:
+        record.update({"status": "erro", "erro": f"{type(exc).__name__}: {exc}"})
+    return record
+
+
+class ValidationSummary:
+    """Agrega os erros imagem a imagem; so as linhas leves ficam em memoria."""
+
+    def __init__(self):
+        self.abs_errors: List[int] = []
+        self.pct_errors: List[float] = []
+        self.line_maes: List[float] = []
+        self.exact_total_matches = 0
+        self.failed = 0
+        self.per_image: List[Dict] = []
+
+    def add(self, row: Dict, record: Dict) -> None:
+        if record.get("status") != "ok":
+            self.failed += 1
+            self.per_image.append({"image_path": row["image_path"], "status": "erro", "erro": record.get("erro")})
+            return
+
+        total_gt = int(row["total_gt"])
+        total_pred = int(record["total_pred"])
+        gt_line_counts = parse_line_counts(row.get("line_counts_gt", ""))
 
         ae = abs(total_pred - total_gt)
-        abs_errors.append(ae)
-        pct_errors.append((ae / total_gt) * 100.0 if total_gt > 0 else 0.0)
+        self.abs_errors.append(ae)
+        self.pct_errors.append((ae / total_gt) * 100.0 if total_gt > 0 else 0.0)
         if total_pred == total_gt:
-            exact_total_matches += 1
+            self.exact_total_matches += 1
 
-        lm = line_mae(gt_line_counts, pred_line_counts) if gt_line_counts else None
+        lm = line_mae(gt_line_counts, record["line_counts_pred"]) if gt_line_counts else None
         if lm is not None:
-            line_maes.append(lm)
+            self.line_maes.append(lm)
 
-        per_image.append(
+        self.per_image.append(
             {
-                "image_path": image_path,
+                "image_path": row["image_path"],
+                "status": "ok",
                 "total_gt": total_gt,
                 "total_pred": total_pred,
                 "abs_error_total": ae,
                 "pct_error_total": round((ae / total_gt) * 100.0, 4) if total_gt > 0 else 0.0,
                 "line_mae": round(lm, 4) if lm is not None else None,
-                "metrics_pred": result.metrics,
-                "line_counts_pred": pred_line_counts,
+                "line_counts_pred": record["line_counts_pred"],
             }
         )
 
-    summary = {
-        "num_images": len(rows),
-        "mae_total": round(float(mean(abs_errors)), 4),
-        "mape_total_percent": round(float(mean(pct_errors)), 4),
-        "exact_match_total_percent": round((exact_total_matches / len(rows)) * 100.0, 4),
-        "line_mae": round(float(mean(line_maes)), 4) if line_maes else None,
-    }
+    def summary(self) -> Dict:
+        n = len(self.abs_errors)
+        return {
+            "num_images": n + self.failed,
+            "num_validated": n,
+            "num_failed": self.failed,
+            "mae_total": round(float(mean(self.abs_errors)), 4) if n else None,
+            "mape_total_percent": round(float(mean(self.pct_errors)), 4) if n else None,
+            "exact_match_total_percent": round((self.exact_total_matches / n) * 100.0, 4) if n else None,
+            "line_mae": round(float(mean(self.line_maes)), 4) if self.line_maes else None,
+        }
+
+
+def run_validation(
+    rows: List[Dict],
+    records_path: str,
+    roi_frac=None,
+    binarize_method: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    stage_cache_dir: Optional[str] = None,
+    workers: Optional[int] = None,
+    resume: bool = True,
+    align_mode: str = "page",
+) -> Dict:
+    """
+    Valida as linhas do gabarito num pool de processos.
+
+    Cada imagem vira uma linha no JSONL (append + flush) assim que termina.
+    Com resume, imagens ja validadas com o mesmo config_hash sao lidas do
+    JSONL em vez de reprocessadas; registros com erro sao refeitos.
+    """
+    config_hash = validation_config_hash(roi_frac, binarize_method, align_mode)
+    by_key = {_row_key(i, row): row for i, row in enumerate(rows)}
 
-    report = {
-        "summary": summary,
-        "per_image": per_image,
+    agg = ValidationSummary()
+    done: Set[str] = set()
+    if resume:
+        for record in iter_records(records_path):
+            key = record.get("key")
+            if record.get("config_hash") != config_hash or record.get("status") != "ok":
+                continue
+            if key in by_key and key not in done:
+                done.add(key)
+                agg.add(by_key[key], record)
+    resumed = len(done)
+
+    pending = [(key, row) for key, row in by_key.items() if key not in done]
+    options = {
+        "config_hash": config_hash,
+        "roi_frac": roi_frac,
+        "binarize_method": binarize_method,
+        "align_mode": align_mode,
+        "cache_dir": cache_dir,
+        "stage_cache_dir": stage_cache_dir,
     }
+    workers = max(1, int(workers or os.cpu_count() or 1))
+
+    Path(records_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(records_path, "a" if resume else "w", encoding="utf-8") as out:
+        if out.tell() > 0:
+            # Fecha uma linha truncada para o proximo registro nao se colar a ela.
+            with open(records_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+
+        def _write(row: Dict, record: Dict) -> None:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            agg.add(row, record)
+
+        if workers == 1:
+            for key, row in pending:
+                _write(row, _validate_image(key, row, options))
+        elif pending:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = {pool.submit(_validate_image, key, row, options): row for key, row in pending}
+                for fut in as_completed(futures):
+                    _write(futures[fut], fut.result())
+
+    summary = agg.summary()
+    summary.update(
+        {
+            "binarize_method": binarize_method or BINARIZE_METHOD,
+            "align_mode": align_mode,
+            "config_hash": config_hash,
+            "resumed": resumed,
+            "processed": len(pending),
+            "workers": workers,
+            "records": str(records_path),
+        }
+    )
+    return {"summary": summary, "per_image": agg.per_image}
+
+
+def main():
+    args = parse_args()
+    roi_frac = parse_roi_frac(args.roi_frac)
+
+    rows = []
+    with open(args.ground_truth, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            rows.append(row)
+
+    if not rows:
+        raise RuntimeError("CSV de gabarito vazio")
 
     out_path = Path(args.output)
+    records_path = args.records or str(out_path.with_suffix(".jsonl"))
+    report = run_validation(
+        rows,
+        records_path,
+        roi_frac=roi_frac,
+        binarize_method=args.binarize or None,
+        cache_dir=args.cache_dir or None,
+        stage_cache_dir=args.stage_cache_dir or None,
+        workers=args.workers or None,
+        resume=not args.no_resume,
+        align_mode=args.align_mode,
+    )
+
     out_path.parent.mkdir(parents=True, exist_ok=True)
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(report, f, ensure_ascii=False, indent=2)
 
     print("Validacao concluida")
-    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(json.dumps(report["summary"], ensure_ascii=False, indent=2))
 
 
 if __name__ == "__main__":
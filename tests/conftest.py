@@ -0,0 +1,12 @@
+import cv2
+import pytest
+
+from src.benchmark_detector import make_binary_sheet
+
+
+@pytest.fixture
+def sheet_image_path(tmp_path):
+    ink = make_binary_sheet(lines=6, palos_per_line=50, width=1240, height=1754, seed=3)
+    path = tmp_path / "folha.png"
+    cv2.imwrite(str(path), cv2.cvtColor(255 - ink, cv2.COLOR_GRAY2BGR))
+    return str(path)
@@ -0,0 +1,65 @@
+import json
+import threading
+
+import pytest
+
+from src.artifacts import ARTIFACTS, ArtifactWriter, resolve_artifacts
+from src.pipeline import process_image
+
+
+def test_resolve_artifacts():
+    assert resolve_artifacts(None) == ARTIFACTS
+    assert resolve_artifacts("roi, resultado") == ("roi", "resultado")
+    with pytest.raises(ValueError):
+        resolve_artifacts(["roi", "foto"])
+
+
+def test_writer_bounds_queue_and_reraises_on_flush():
+    gate = threading.Event()
+    writer = ArtifactWriter(max_workers=1, max_pending=2)
+    writer.submit(gate.wait)
+    writer.submit(lambda: None)
+
+    blocked = threading.Thread(target=writer.submit, args=(lambda: 1 / 0,))
+    blocked.start()
+    blocked.join(timeout=0.2)
+    assert blocked.is_alive()  # fila cheia: submit espera uma vaga
+
+    gate.set()
+    blocked.join(timeout=5)
+    with pytest.raises(ZeroDivisionError):
+        writer.flush()
+    writer.close()
+
+
+def test_writer_exit_keeps_the_original_exception():
+    with pytest.raises(KeyError):
+        with ArtifactWriter() as writer:
+            writer.submit(lambda: 1 / 0)
+            raise KeyError("process_image")
+
+    with pytest.raises(ZeroDivisionError):
+        with ArtifactWriter() as writer:
+            writer.submit(lambda: 1 / 0)
+
+
+def test_async_outputs_match_selection(sheet_image_path, tmp_path):
+    out_all = tmp_path / "todos"
+    with ArtifactWriter() as writer:
+        result = process_image(sheet_image_path, output_dir=str(out_all), artifact_writer=writer)
+        result.metrics["alterado_depois"] = True
+    names = sorted(p.name for p in out_all.iterdir())
+    assert names == ["aligned.jpg", "binary.jpg", "contagem_por_linha.csv", "overlay.jpg", "resultado.json", "roi.jpg"]
+    saved = json.loads((out_all / "resultado.json").read_text(encoding="utf-8"))
+    assert saved["metrics"]["total"] == result.metrics["total"]
+    assert "alterado_depois" not in saved["metrics"]
+
+    out_few = tmp_path / "poucos"
+    headless = process_image(sheet_image_path, output_dir=str(out_few), artifacts=["roi", "resultado"])
+    assert sorted(p.name for p in out_few.iterdir()) == ["resultado.json", "roi.jpg"]
+    assert headless.overlay is None and headless.metrics["total"] == result.metrics["total"]
+
+    out_data = tmp_path / "dados"
+    data_only = process_image(sheet_image_path, output_dir=str(out_data), artifacts=["line_counts"])
+    assert [p.name for p in out_data.iterdir()] == ["contagem_por_linha.csv"]
+    assert data_only.overlay is None
@@ -0,0 +1,72 @@
+from src.batch import _sheet_output_dirs, collect_batch_inputs
+
+
+def test_collect_batch_inputs_from_directory_and_glob(tmp_path):
+    for name in ("b.jpg", "a.png", "notes.txt"):
+        (tmp_path / name).write_bytes(b"")
+
+    from_dir = collect_batch_inputs(str(tmp_path))
+    from_glob = collect_batch_inputs(str(tmp_path / "*.jpg"))
+
+    assert [item["image_path"] for item in from_dir] == [str(tmp_path / "a.png"), str(tmp_path / "b.jpg")]
+    assert [item["image_path"] for item in from_glob] == [str(tmp_path / "b.jpg")]
+
+
+def test_collect_batch_inputs_from_manifest_csv(tmp_path):
+    manifest = tmp_path / "lote.csv"
+    manifest.write_text("image_path,errors\nfolha1.jpg,2\n,0\nfolha2.jpg,\n", encoding="utf-8")
+
+    items = collect_batch_inputs(str(manifest))
+
+    assert items == [{"image_path": "folha1.jpg", "errors": 2}, {"image_path": "folha2.jpg", "errors": 0}]
+
+
+def test_sheet_output_dirs_are_unique():
+    items = [{"image_path": "x/folha.jpg"}, {"image_path": "y/folha.png"}, {"image_path": "z/outra.jpg"}]
+    dirs = _sheet_output_dirs(items, "out")
+
+    assert len(set(dirs)) == 3
+
+    for order in (["a/folha.jpg", "b/folha.jpg", "c/folha_2.jpg"], ["c/folha_2.jpg", "a/folha.jpg", "b/folha.jpg"]):
+        dirs = _sheet_output_dirs([{"image_path": p} for p in order], "out")
+        assert len(set(dirs)) == 3
+
+
+def test_process_sheet_charges_write_errors_to_its_own_sheet(tmp_path, monkeypatch, sheet_image_path):
+    import src.batch as batch
+    import src.pipeline as pipeline
+    from src.artifacts import ArtifactWriter
+
+    writer = ArtifactWriter()
+    monkeypatch.setitem(batch._WORKER_STATE, "writer", writer)
+    monkeypatch.setitem(batch._WORKER_STATE, "ml_payload", None)
+    options = {"artifacts": ["roi", "line_counts"]}
+
+    real_imwrite = pipeline.cv2.imwrite
+    disk_full = {"on": True}
+    monkeypatch.setattr(pipeline.cv2, "imwrite", lambda path, image: not disk_full["on"] and real_imwrite(path, image))
+
+    failed = batch._process_sheet({"image_path": sheet_image_path}, str(tmp_path / "a"), options)
+    disk_full["on"] = False
+    ok = batch._process_sheet({"image_path": sheet_image_path}, str(tmp_path / "b"), options)
+    writer.close()
+
+    assert failed["status"] == "erro" and "OSError" in failed["erro"]
+    assert ok["status"] == "ok"
+    assert sorted(p.name for p in (tmp_path / "b").iterdir()) == ["contagem_por_linha.csv", "roi.jpg"]
+
+
+def test_batch_roi_align_mode_is_headless_only(tmp_path, monkeypatch, sheet_image_path):
+    import pytest
+
+    import src.batch as batch
+
+    with pytest.raises(ValueError):
+        batch.run_batch([{"image_path": sheet_image_path}], str(tmp_path / "lote"), align_mode="roi")
+
+    monkeypatch.setitem(batch._WORKER_STATE, "writer", None)
+    monkeypatch.setitem(batch._WORKER_STATE, "ml_payload", None)
+    options = {"artifacts": ["line_counts", "resultado"], "align_mode": "roi"}
+    row = batch._process_sheet({"image_path": sheet_image_path}, str(tmp_path / "roi"), options)
+
+    assert row["status"] == "ok" and row["total"] > 0
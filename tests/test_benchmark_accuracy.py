@@ -0,0 +1,30 @@
+import pytest
+
+from src.benchmark_accuracy import _acc, hybrid_threshold_sweep, parse_thresholds
+from src.ml_models import fused_labels
+
+
+def test_parse_thresholds():
+    assert parse_thresholds("0.5:0.7:0.1") == [0.5, 0.6, 0.7]
+    assert parse_thresholds("0.6, 0.9") == [0.6, 0.9]
+    assert parse_thresholds("") == []
+    with pytest.raises(ValueError):
+        parse_thresholds("0.5:0.9:0")
+
+
+def test_sweep_matches_hybrid_fusion_per_threshold():
+    truths = ["Alta", "Baixa", "Media", "", "Alta", "Baixa"]
+    rules = ["Media", "Baixa", "Media", "Alta", None, "Alta"]
+    ml = ["Alta", "Alta", "Baixa", "Alta", "Alta", None]
+    confs = [0.9, 0.55, 0.7, 0.99, None, 0.8]
+    thresholds = [0.0, 0.5, 0.6, 0.75, 0.95]
+
+    got = hybrid_threshold_sweep(truths, rules, ml, confs, thresholds)
+
+    for i, thr in enumerate(thresholds):
+        preds = []
+        for rule, label, conf in zip(rules, ml, confs):
+            metrics = {"classificacoes": {"produtividade": {"nivel": rule}}}
+            ml_preds = {"target_produtividade": {"pred": label, "confidence": conf}}
+            preds.append(fused_labels(metrics, ml_preds, thresholds=[thr])["hybrid"][0]["target_produtividade"])
+        assert got[i] == _acc(truths, preds)
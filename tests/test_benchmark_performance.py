@@ -0,0 +1,39 @@
+import copy
+import json
+from pathlib import Path
+
+from src.benchmark_performance import compare_to_baseline, format_comparison
+
+
+def _case(name, total_ms, stages, total_pred=300):
+    return {
+        "name": name,
+        "total": {"median_ms": total_ms},
+        "stages": {k: {"median_ms": v} for k, v in stages.items()},
+        "total_pred": total_pred,
+        "line_counts_pred": [50] * (total_pred // 50),
+        "classificacoes": {"produtividade": "Media"},
+    }
+
+
+def test_compare_flags_slow_stages_and_changed_results():
+    baseline = {"cases": [_case("a", 100.0, {"binarize": 40.0, "score": 0.2}), _case("b", 50.0, {"binarize": 20.0})]}
+
+    same = copy.deepcopy(baseline)
+    same["cases"][0]["stages"]["score"]["median_ms"] = 0.5  # +150%, mas abaixo de min_delta_ms
+    assert compare_to_baseline(same, baseline, max_slowdown=20, min_delta_ms=2.0)["ok"]
+
+    slower = copy.deepcopy(baseline)
+    slower["cases"][0]["stages"]["binarize"]["median_ms"] = 52.0
+    slower["cases"][1]["total_pred"] = 250
+    out = compare_to_baseline(slower, baseline, max_slowdown=20, min_delta_ms=2.0)
+    assert not out["ok"]
+    assert any(f.startswith("a/binarize") for f in out["failures"])
+    assert any(f.startswith("b: total_pred mudou") for f in out["failures"])
+    assert "REGRESSAO" in format_comparison(out)
+
+
+def test_committed_baseline_is_well_formed():
+    baseline = json.loads((Path(__file__).parent / "data" / "perf_baseline.json").read_text(encoding="utf-8"))
+    assert baseline["cases"] and all(c["abs_error_total"] == 0 for c in baseline["cases"])
+    assert {"scales", "densities", "seed", "align_mode", "metrics_only"} <= set(baseline["suite"])
@@ -0,0 +1,47 @@
+import csv
+
+from src.build_ml_dataset import build_dataset
+from src.ml_models import FEATURE_NAMES
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_incremental_build_only_processes_new_images(sheet_image_path, tmp_path, monkeypatch):
+    import src.build_ml_dataset as bmd
+
+    out = tmp_path / "dataset.csv"
+    rows = [{"image_path": sheet_image_path, "errors": "0", "target_ritmo": "Alta"}]
+
+    first = build_dataset(rows, str(out), workers=2)
+    assert first["written"] == 1 and not first["failures"]
+    data = _read(out)
+    assert list(data[0]) == ["image_path", *FEATURE_NAMES, "target_ritmo"]
+    assert data[0]["target_ritmo"] == "Alta"
+
+    calls = []
+    orig = bmd._feature_row
+    monkeypatch.setattr(bmd, "_feature_row", lambda row, *a: calls.append(row["image_path"]) or orig(row, *a))
+    missing = str(tmp_path / "nova.png")
+    rows.append({"image_path": missing, "errors": "0", "target_ritmo": "Baixa"})
+
+    second = build_dataset(rows, str(out), workers=1, incremental=True)
+    assert calls == [missing]
+    assert second["skipped_existing"] == 1 and second["written"] == 0
+    assert [f["image_path"] for f in second["failures"]] == [missing]
+    assert len(_read(out)) == 1
+
+
+def test_build_keeps_repeated_images_in_input_order(sheet_image_path, tmp_path):
+    out = tmp_path / "dataset.csv"
+    rows = [
+        {"image_path": sheet_image_path, "errors": str(e), "target_ritmo": target}
+        for e, target in ((0, "Alta"), (3, "Media"), (0, "Baixa"), (5, "Alta"))
+    ]
+
+    result = build_dataset(rows, str(out), workers=3)
+
+    assert result["written"] == 4
+    assert [r["target_ritmo"] for r in _read(out)] == ["Alta", "Media", "Baixa", "Alta"]
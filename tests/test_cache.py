@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+
+from src.cache import ResultCache, make_cache_key
+from src.pipeline import PIPELINE_VERSION, process_image
+from src.strokes import StrokeTable
+
+
+def test_process_image_cache_hit_skips_cv_and_rescores(tmp_path, sheet_image_path):
+    image_path = sheet_image_path
+    cache_dir = str(tmp_path / "cache")
+
+    first = process_image(image_path, output_dir=None, save_artifacts=False, cache_dir=cache_dir)
+    second = process_image(image_path, output_dir=None, save_artifacts=False, cache_dir=cache_dir)
+    with_errors = process_image(image_path, errors=5, output_dir=None, save_artifacts=False, cache_dir=cache_dir)
+
+    assert not first.cache_hit and second.cache_hit and with_errors.cache_hit
+    assert second.aligned is None
+    assert second.metrics == first.metrics
+    assert second.local_lines == first.local_lines
+    assert with_errors.metrics["erros"] == 5
+    assert with_errors.metrics["score_final"] < first.metrics["score_final"]
+
+
+def test_result_cache_separates_align_modes(tmp_path, sheet_image_path):
+    cache_dir = str(tmp_path / "cache")
+
+    page = process_image(sheet_image_path, save_artifacts=False, cache_dir=cache_dir)
+    roi = process_image(sheet_image_path, save_artifacts=False, cache_dir=cache_dir, align_mode="roi")
+    page_again = process_image(sheet_image_path, save_artifacts=False, cache_dir=cache_dir)
+
+    assert not page.cache_hit and not roi.cache_hit
+    assert page_again.cache_hit and page_again.metrics == page.metrics
+
+
+def test_cache_key_depends_on_roi_and_version():
+    data = b"imagem"
+    base = make_cache_key(data, None, PIPELINE_VERSION)
+
+    assert base == make_cache_key(data, None, PIPELINE_VERSION)
+    assert base != make_cache_key(data, (0.0, 0.1, 1.0, 0.9), PIPELINE_VERSION)
+    assert base != make_cache_key(data, None, PIPELINE_VERSION + "-dev")
+    assert base != make_cache_key(b"outra", None, PIPELINE_VERSION)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10**9)
+    strokes = StrokeTable.from_columns(np.arange(500), np.zeros(500), np.ones(500), np.ones(500), np.ones(500), np.zeros(500))
+    for i, key in enumerate(("b", "c", "a")):
+        cache.put(key, {"k": key}, strokes)
+        os.utime(tmp_path / f"{key}.npz", (1000 + i, 1000 + i))
+
+    cache.max_bytes = (tmp_path / "a.npz").stat().st_size * 2
+    cache.evict()
+
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == {"k": "a"}
+    assert len(cache.get("c")[1]) == 500
+
+
+def test_cache_put_scans_directory_only_when_over_limit(tmp_path, monkeypatch):
+    from src import cache as cache_mod
+
+    cache = ResultCache(str(tmp_path), max_bytes=10**9)
+    strokes = StrokeTable.from_columns(np.arange(50), np.zeros(50), np.ones(50), np.ones(50), np.ones(50), np.zeros(50))
+    cache.put("primeira", {}, strokes)
+    scans = {"n": 0}
+    orig_evict = cache_mod._DiskLru.evict
+
+    def counting_evict(self):
+        scans["n"] += 1
+        orig_evict(self)
+
+    monkeypatch.setattr(cache_mod._DiskLru, "evict", counting_evict)
+    for i in range(20):
+        ResultCache(str(tmp_path), max_bytes=10**9).put(f"k{i}", {"i": i}, strokes)
+    assert scans["n"] == 0
+
+    small = ResultCache(str(tmp_path), max_bytes=(tmp_path / "k0.npz").stat().st_size * 3)
+    small.put("ultima", {}, strokes)
+    assert scans["n"] == 1
+    assert len(list(tmp_path.glob("*.npz"))) <= 3
+    assert small.get("ultima") is not None
+
+
+def test_stage_cache_reuses_aligned_and_binary(tmp_path, monkeypatch, sheet_image_path):
+    import config
+    from src.preprocessor import DocumentAligner
+
+    image_path = sheet_image_path
+    stage_dir = str(tmp_path / "stages")
+    calls = {"align": 0, "binarize": 0}
+    orig_align = DocumentAligner.get_aligned_image
+    orig_binarize = DocumentAligner.binarize
+
+    def counting_align(self, image):
+        calls["align"] += 1
+        return orig_align(self, image)
+
+    def counting_binarize(self, image):
+        calls["binarize"] += 1
+        return orig_binarize(self, image)
+
+    monkeypatch.setattr(DocumentAligner, "get_aligned_image", counting_align)
+    monkeypatch.setattr(DocumentAligner, "binarize", counting_binarize)
+
+    def run(roi_frac=None):
+        return process_image(image_path, roi_frac=roi_frac, save_artifacts=False, stage_cache_dir=stage_dir)
+
+    first = run()
+    again = run()
+    assert calls == {"align": 1, "binarize": 1}
+    assert again.metrics == first.metrics
+
+    run(roi_frac=(0.05, 0.10, 0.95, 0.80))
+    assert calls == {"align": 1, "binarize": 2}
+
+    monkeypatch.setattr(config, "ADAPTIVE_C", config.ADAPTIVE_C + 1)
+    run()
+    assert calls == {"align": 1, "binarize": 3}
+
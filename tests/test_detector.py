@@ -0,0 +1,96 @@
+import csv
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from config import LINE_TOLERANCE_Y, MIN_PALOS_PER_LINE
+from src.benchmark_detector import legacy_central_moments, make_binary_sheet
+from src.detector import PaloDetector, component_central_moments
+from src.strokes import StrokeTable
+
+
+def _labels(binary):
+    processed = PaloDetector()._filter_vertical_strokes(binary)
+    num_labels, labels, _, _ = cv2.connectedComponentsWithStats(processed, connectivity=8)
+    return num_labels, labels
+
+
+def test_component_central_moments_bit_for_bit_with_cv2():
+    num_labels, labels = _labels(make_binary_sheet(lines=3, palos_per_line=40, seed=7))
+    assert num_labels > 100
+
+    fast = component_central_moments(labels, num_labels)
+    legacy = legacy_central_moments(labels, num_labels)
+    for a, b in zip(fast, legacy):
+        assert np.array_equal(a, b)
+
+
+def test_find_palos_detects_synthetic_strokes():
+    detector = PaloDetector()
+    palos = detector.find_palos(make_binary_sheet(lines=3, palos_per_line=40, seed=7))
+
+    assert len(palos) == 120
+    assert ((palos["angle_deg"] >= 0.0) & (palos["angle_deg"] < 180.0)).all()
+
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+
+
+def _reference_group_lines(palos):
+    # Agrupamento quadratico original, mantido como oraculo de paridade.
+    sorted_palos = sorted(palos, key=lambda p: p["cy"])
+    median_h = float(np.median([p["h"] for p in sorted_palos]))
+    threshold = max(float(LINE_TOLERANCE_Y), median_h * 0.75)
+
+    bands = []
+    for palo in sorted_palos:
+        placed = False
+        for band in bands:
+            if abs(palo["cy"] - band["center_y"]) <= threshold:
+                band["items"].append(palo)
+                band["center_y"] = float(np.mean([p["cy"] for p in band["items"]]))
+                placed = True
+                break
+        if not placed:
+            bands.append({"center_y": palo["cy"], "items": [palo]})
+
+    bands.sort(key=lambda b: b["center_y"])
+    lines = [sorted(b["items"], key=lambda p: p["x"]) for b in bands]
+    return [line for line in lines if len(line) >= MIN_PALOS_PER_LINE]
+
+
+def _load_strokes(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    cols = {k: [float(r[k]) if k == "angle_deg" else int(r[k]) for r in rows] for k in rows[0]}
+    table = StrokeTable.from_columns(cols["x"], cols["y"], cols["w"], cols["h"], cols["area"], cols["angle_deg"])
+    return StrokeTable(table.data[np.lexsort((table["cx"], table["cy"]))])
+
+
+def _random_strokes(seed):
+    rng = np.random.default_rng(seed)
+    n = 600
+    h = rng.integers(10, 60, n)
+    w = rng.integers(1, 8, n)
+    y = (rng.integers(0, 25, n) * rng.integers(20, 45)) + rng.integers(-15, 16, n)
+    table = StrokeTable.from_columns(rng.integers(0, 1100, n), y, w, h, w * h, rng.uniform(60, 120, n))
+    return StrokeTable(table.data[np.lexsort((table["cx"], table["cy"]))])
+
+
+def _assert_grouping_parity(palos):
+    detector = PaloDetector()
+    detector.palos = palos
+    lines = detector.group_lines().to_lines()
+    assert lines == _reference_group_lines(palos.to_records())
+    assert detector.get_line_counts() == [len(line) for line in lines]
+
+
+def test_group_lines_parity_on_recorded_sheets():
+    for path in sorted(DATA_DIR.glob("strokes_sheet_*.csv")):
+        _assert_grouping_parity(_load_strokes(path))
+
+
+def test_group_lines_parity_on_random_stroke_sets():
+    for seed in range(20):
+        _assert_grouping_parity(_random_strokes(seed))
@@ -0,0 +1,204 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from src.ml_models import FEATURE_NAMES, predict_ml_classes, predict_ml_classes_batch
+
+
+def _payload(seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 100, size=(120, len(FEATURE_NAMES)))
+    models = {}
+    for k, target in enumerate(("target_produtividade", "target_ritmo")):
+        y = np.where(x[:, k] > 50, "Alta", np.where(x[:, k + 2] > 30, "Media", "Baixa"))
+        models[target] = RandomForestClassifier(n_estimators=25, random_state=seed).fit(x, y)
+    return {"feature_names": FEATURE_NAMES, "models": models}
+
+
+def test_batch_prediction_matches_predict_and_proba():
+    payload = _payload()
+    rng = np.random.default_rng(1)
+    metrics_list = [dict(zip(FEATURE_NAMES, row.tolist())) for row in rng.uniform(0, 100, size=(40, len(FEATURE_NAMES)))]
+    metrics_list[0]["total"] = None
+
+    batch = predict_ml_classes_batch(metrics_list, payload)
+    assert len(batch) == len(metrics_list)
+    for metrics, got in zip(metrics_list, batch):
+        feats = [[float(metrics.get(k) or 0.0) for k in FEATURE_NAMES]]
+        for target, clf in payload["models"].items():
+            assert got[target]["pred"] == str(clf.predict(feats)[0])
+            assert got[target]["confidence"] == round(float(clf.predict_proba(feats)[0].max()), 4)
+        assert predict_ml_classes(metrics, payload) == got
+
+    assert predict_ml_classes_batch([], payload) == []
+
+
+def test_registry_loads_once_and_reloads_on_change(tmp_path, monkeypatch):
+    import os
+
+    import joblib
+
+    import src.ml_models as ml
+
+    path = tmp_path / "modelo.pkl"
+    joblib.dump(_payload(seed=0), path)
+    loads = {"n": 0}
+    orig_load = ml.load_ml_model
+
+    def counting_load(*args, **kwargs):
+        loads["n"] += 1
+        return orig_load(*args, **kwargs)
+
+    monkeypatch.setattr(ml, "load_ml_model", counting_load)
+    registry = ml.ModelRegistry()
+
+    first = registry.get(str(path))
+    assert registry.get(str(path)) is first
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert registry.get(str(path)) is first
+    assert loads["n"] == 1
+
+    joblib.dump(_payload(seed=1), path)
+    assert registry.get(str(path)) is not first
+    assert loads["n"] == 2
+
+
+def test_export_replaces_file_without_touching_mapped_model(tmp_path):
+    from src.forest import CompiledForests
+    from src.ml_models import export_inference_model, load_ml_model
+
+    def compiled(seed):
+        payload = _payload(seed)
+        payload["compiled"] = CompiledForests.from_models(payload["models"]).to_dict()
+        return payload
+
+    path = tmp_path / "inferencia.pkl"
+    export_inference_model(compiled(0), str(path))
+    mapped = load_ml_model(str(path), mmap_mode="r")
+    expected = predict_ml_classes({k: 10.0 for k in FEATURE_NAMES}, mapped)
+    inode = path.stat().st_ino
+
+    export_inference_model(compiled(1), str(path))
+
+    assert path.stat().st_ino != inode
+    assert [p.name for p in tmp_path.iterdir()] == ["inferencia.pkl"]
+    assert predict_ml_classes({k: 10.0 for k in FEATURE_NAMES}, mapped) == expected
+
+
+def test_compiled_forests_match_sklearn_proba(tmp_path):
+    from src.forest import CompiledForests
+    from src.ml_models import export_inference_model, load_ml_model
+
+    payload = _payload(seed=2)
+    forests = CompiledForests.from_models(payload["models"])
+    x = np.random.default_rng(3).uniform(0, 100, size=(50, len(FEATURE_NAMES)))
+    x[:, 0] = np.linspace(-10, 110, 50)
+
+    got = forests.predict_proba(x)
+    for target, clf in payload["models"].items():
+        assert np.array_equal(got[target], clf.predict_proba(x))
+
+    payload["compiled"] = forests.to_dict()
+    metrics_list = [dict(zip(FEATURE_NAMES, row.tolist())) for row in x]
+    expected = predict_ml_classes_batch(metrics_list, {"feature_names": FEATURE_NAMES, "models": payload["models"]})
+
+    path = export_inference_model(payload, str(tmp_path / "inferencia.pkl"))
+    light = load_ml_model(path, mmap_mode="r")
+    assert light["models"] == {}
+    assert predict_ml_classes_batch(metrics_list, light) == expected
+
+
+def test_parallel_training_matches_sequential(tmp_path):
+    import csv
+
+    from src.ml_models import TARGET_MAP, load_ml_model, train_ml_models
+
+    rng = np.random.default_rng(4)
+    x = rng.uniform(0, 100, size=(60, len(FEATURE_NAMES)))
+    targets = list(TARGET_MAP)[:3]
+    dataset = tmp_path / "dataset.csv"
+    with open(dataset, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FEATURE_NAMES + targets)
+        for row in x:
+            labels = ["Alta" if row[k] > 50 else "Baixa" for k in range(len(targets))]
+            writer.writerow(row.tolist() + labels)
+
+    seq = train_ml_models(str(dataset), str(tmp_path / "seq.pkl"), workers=1, jobs_per_target=1)
+    par = train_ml_models(str(dataset), str(tmp_path / "par.pkl"), workers=3, jobs_per_target=1)
+
+    assert list(par.report) == list(seq.report) == list(TARGET_MAP)
+    assert par.timing["workers"] == 3 and seq.timing["workers"] == 1
+    assert set(par.timing["fit_seconds"]) == set(targets)
+    for target in targets:
+        a, b = seq.report[target], par.report[target]
+        assert a["accuracy"] == b["accuracy"] and a["f1_macro"] == b["f1_macro"]
+
+    probe = rng.uniform(0, 100, size=(20, len(FEATURE_NAMES)))
+    seq_models = load_ml_model(seq.model_path)["models"]
+    par_models = load_ml_model(par.model_path)["models"]
+    for target in targets:
+        assert np.array_equal(seq_models[target].predict_proba(probe), par_models[target].predict_proba(probe))
+
+
+def test_search_recommends_smallest_forest_within_tolerance(tmp_path):
+    import csv
+
+    from src.ml_models import search_forest_params, train_ml_models
+
+    rng = np.random.default_rng(5)
+    x = rng.uniform(0, 100, size=(60, len(FEATURE_NAMES)))
+    dataset = tmp_path / "dataset.csv"
+    with open(dataset, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FEATURE_NAMES + ["target_ritmo"])
+        for row in x:
+            writer.writerow(row.tolist() + ["Alta" if row[0] > 50 else "Baixa"])
+
+    grid = {"n_estimators": [5, 40], "max_depth": [None, 3], "min_samples_leaf": [1]}
+    search = search_forest_params(str(dataset), grid=grid, folds=3, workers=2, accuracy_tolerance=1.0)
+
+    info = search["targets"]["target_ritmo"]
+    assert info["folds"] == 3 and len(info["configs"]) == 4
+    assert all({"accuracy", "n_nodes", "size_kb", "latency_ms"} <= set(c) for c in info["configs"])
+    assert info["recommended"]["n_nodes"] == min(c["n_nodes"] for c in info["configs"])
+    assert search["targets"]["target_pressao"]["trained"] is False
+
+    out = train_ml_models(str(dataset), str(tmp_path / "m.pkl"), workers=1, forest_params=search["recommended_params"])
+    assert out.report["target_ritmo"]["forest_params"]["n_estimators"] == info["recommended"]["params"]["n_estimators"]
+
+
+def test_fused_labels_match_fuse_ml_with_rules_without_copying():
+    import copy
+
+    from src.ml_models import TARGET_MAP, fuse_ml_with_rules, fused_labels, rule_label
+
+    metrics = {
+        "classificacoes": {
+            "produtividade": {"nivel": "Media", "regra_id": "R1"},
+            "ritmo": {"nivel": "Baixa"},
+            "qualidade_rendimento": "Boa",
+        }
+    }
+    ml_preds = {
+        "target_produtividade": {"pred": "Alta", "confidence": 0.9},
+        "target_ritmo": {"pred": "Alta", "confidence": 0.6},
+        "target_qualidade_rendimento": {"pred": "Ruim", "confidence": None},
+        "target_pressao": {"pred": "Forte", "confidence": 0.8},
+    }
+    snapshot = copy.deepcopy(metrics)
+    thresholds = [0.5, 0.75, 0.95]
+
+    fused = fused_labels(metrics, ml_preds, thresholds=thresholds)
+    assert metrics == snapshot
+
+    def labels(m):
+        return {t: rule_label(m, t) for t in TARGET_MAP}
+
+    assert fused["rules"] == labels(metrics)
+    for mode in ("assist", "override"):
+        ref = fuse_ml_with_rules(copy.deepcopy(metrics), ml_preds, mode=mode)
+        assert fused[mode] == labels(ref)
+    for thr, got in zip(thresholds, fused["hybrid"]):
+        ref = fuse_ml_with_rules(copy.deepcopy(metrics), ml_preds, mode="hybrid", confidence_threshold=thr)
+        assert got == labels(ref)
@@ -1,4 +1,4 @@
-from src.pipeline import parse_roi_frac
+from src.pipeline import parse_roi_frac, process_image
 
 
 def test_parse_roi_frac_ok():
@@ -12,3 +12,54 @@ def test_parse_roi_frac_invalid_count():
         assert False, "Expected ValueError for invalid roi count"
     except ValueError:
         assert True
+
+
+def test_roi_align_mode_warps_only_the_roi(sheet_image_path):
+    image_path = sheet_image_path
+
+    page = process_image(image_path, save_artifacts=False)
+    roi = process_image(image_path, save_artifacts=False, align_mode="roi")
+
+    assert roi.aligned is None and roi.overlay is None
+    assert page.aligned is not None and page.overlay is not None
+    assert roi.roi_img.shape == page.roi_img.shape
+    assert roi.line_counts == page.line_counts
+
+
+def test_in_memory_sources_match_path(tmp_path, sheet_image_path):
+    from pathlib import Path
+
+    import cv2
+
+    from_path = process_image(sheet_image_path, output_dir=None, save_artifacts=False)
+    encoded = Path(sheet_image_path).read_bytes()
+    from_bytes = process_image(encoded, output_dir=None, save_artifacts=False)
+    from_array = process_image(cv2.imread(sheet_image_path), output_dir=None, save_artifacts=False)
+
+    assert from_bytes.metrics == from_path.metrics
+    assert from_array.metrics == from_path.metrics
+    assert from_array.line_counts == from_path.line_counts
+
+    cache_dir = str(tmp_path / "cache")
+    gray = cv2.imread(sheet_image_path, cv2.IMREAD_GRAYSCALE)
+    process_image(gray, output_dir=None, save_artifacts=False, cache_dir=cache_dir)
+    assert process_image(gray.copy(), output_dir=None, save_artifacts=False, cache_dir=cache_dir).cache_hit
+
+
+def test_metrics_only_result_holds_no_images(sheet_image_path, tmp_path, monkeypatch):
+    import src.pipeline as pipeline
+
+    calls = []
+    orig = pipeline.draw_detection_overlay
+    monkeypatch.setattr(pipeline, "draw_detection_overlay", lambda *a, **k: calls.append(1) or orig(*a, **k))
+
+    full = process_image(sheet_image_path, save_artifacts=False, align_mode="page")
+    lean = process_image(sheet_image_path, save_artifacts=False, align_mode="page", metrics_only=True)
+    assert len(calls) == 1
+    assert full.aligned is not None and full.binary is not None
+    assert (lean.aligned, lean.roi_img, lean.binary, lean.overlay) == (None, None, None, None)
+    assert lean.metrics["total"] == full.metrics["total"]
+    assert lean.line_counts == full.line_counts
+
+    saved = process_image(sheet_image_path, output_dir=str(tmp_path), metrics_only=True)
+    assert (tmp_path / "overlay.jpg").exists() and saved.overlay is None and saved.binary is None
@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+import pytest
+
+from config import CONTOUR_MAX_SIDE
+from src.preprocessor import BINARIZE_METHODS, DocumentAligner
+
+
+def _photo_with_known_corners(width=2400, height=3200, seed=0):
+    rng = np.random.default_rng(seed)
+    page = np.full((1754, 1240, 3), 235, dtype=np.uint8)
+    for r in range(10):
+        for k in range(70):
+            x, y = 90 + 14 * k, 300 + 90 * r
+            cv2.line(page, (x, y), (x + int(rng.integers(-3, 4)), y + 32), (40, 40, 40), 2)
+
+    jitter = rng.uniform(-60, 60, size=(4, 2))
+    dst = np.float32(
+        [[0.12 * width, 0.08 * height], [0.88 * width, 0.08 * height], [0.88 * width, 0.93 * height], [0.12 * width, 0.93 * height]]
+    ) + jitter.astype(np.float32)
+    src = np.float32([[0, 0], [1239, 0], [1239, 1753], [0, 1753]])
+    photo = np.full((height, width, 3), (70, 80, 90), dtype=np.uint8)
+    cv2.warpPerspective(page, cv2.getPerspectiveTransform(src, dst), (width, height), dst=photo, borderMode=cv2.BORDER_TRANSPARENT)
+    noisy = photo.astype(np.float32) + rng.normal(0, 5, photo.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8), dst
+
+
+def test_reduced_resolution_contour_matches_true_corners():
+    aligner = DocumentAligner()
+    for seed in range(3):
+        photo, true_corners = _photo_with_known_corners(seed=seed)
+        assert max(photo.shape[:2]) > CONTOUR_MAX_SIDE
+
+        corners = aligner._order_points(aligner._find_document_contour(photo))
+
+        assert np.abs(corners - true_corners).max() < 1.5
+
+
+def test_small_image_uses_full_resolution_search():
+    photo, true_corners = _photo_with_known_corners(width=720, height=960)
+    corners = DocumentAligner()._find_document_contour(photo)
+
+    assert corners is not None
+    assert np.abs(DocumentAligner._order_points(corners.astype(np.float32)) - true_corners).max() < 2.0
+
+
+def test_aligned_roi_matches_cropped_page():
+    photo, _ = _photo_with_known_corners(width=900, height=1200, seed=4)
+    aligner = DocumentAligner()
+
+    page_roi, page_rect = aligner.crop_roi(aligner.get_aligned_image(photo))
+    roi, rect = aligner.get_aligned_roi(photo)
+
+    assert rect == page_rect
+    assert roi.shape == page_roi.shape
+    assert np.abs(roi.astype(np.int16) - page_roi.astype(np.int16)).max() <= 1
+
+
+def test_binarize_methods_return_binary_mask():
+    photo, _ = _photo_with_known_corners(width=1200, height=1600)
+    roi_img, _ = DocumentAligner().get_aligned_roi(photo)
+    for method in BINARIZE_METHODS:
+        binary = DocumentAligner(binarize_method=method).binarize(roi_img)
+        assert binary.dtype == np.uint8
+        assert binary.shape == roi_img.shape[:2]
+        assert set(np.unique(binary).tolist()) <= {0, 255}
+        # Tinta escura vira primeiro plano: fracao pequena, mas nao vazia.
+        assert 0.0 < float(np.count_nonzero(binary)) / binary.size < 0.5
+
+
+def test_binarize_rejects_unknown_method():
+    aligner = DocumentAligner(binarize_method="otsu-magico")
+    with pytest.raises(ValueError):
+        aligner.binarize(np.zeros((32, 32, 3), dtype=np.uint8))
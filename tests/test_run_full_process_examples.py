@@ -0,0 +1,19 @@
+from pathlib import Path
+
+from src.run_full_process_examples import TARGET_COLUMNS, extract_examples, label_examples
+
+
+def test_extract_examples_once_per_variant_in_base_order(sheet_image_path, tmp_path):
+    bases = [Path(sheet_image_path), tmp_path / "nao_existe.jpg", Path(sheet_image_path)]
+
+    samples = extract_examples(bases, tmp_path, save_images=False, workers=2)
+
+    assert [s["image_path"] for s in samples] == [
+        str(tmp_path / "augmented_images" / f"real_{b:02d}_v{v}.jpg") for b in (1, 3) for v in range(7)
+    ]
+    assert all(s["metrics"]["total"] > 0 for s in samples)
+
+    label_rows, summary_rows = label_examples(samples)
+    assert [r["image_path"] for r in label_rows] == [s["image_path"] for s in samples]
+    assert set(TARGET_COLUMNS) <= set(label_rows[0])
+    assert summary_rows[0].total == samples[0]["metrics"]["total"]
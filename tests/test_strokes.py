@@ -0,0 +1,44 @@
+import numpy as np
+
+from src.pipeline import estimate_order_pattern, estimate_spacing_mm, to_global_lines
+from src.strokes import StrokeTable
+
+
+def _palo(x, y, w=3, h=30, angle=90.0):
+    return {"x": x, "y": y, "w": w, "h": h, "area": w * h, "cx": x + w / 2.0, "cy": y + h / 2.0, "angle_deg": angle}
+
+
+def test_stroke_table_round_trip_keeps_dict_view():
+    lines = [[_palo(10, 5), _palo(20, 6)], [_palo(12, 60), _palo(25, 61), _palo(40, 59)]]
+    table = StrokeTable.from_lines(lines)
+
+    assert len(table) == 5
+    assert table.line_counts() == [2, 3]
+    assert table.to_lines() == lines
+
+
+def test_grouped_orders_by_line_then_x():
+    table = StrokeTable.from_records([_palo(30, 0), _palo(10, 50), _palo(5, 2), _palo(1, 49)])
+    grouped = table.grouped(np.array([0, 1, 0, -1], dtype=np.int32))
+
+    assert grouped.line_counts() == [2, 1]
+    assert grouped["x"].tolist() == [5, 30, 10]
+
+
+def test_estimators_accept_table_and_legacy_lines():
+    lines = [[_palo(10 + 12 * i, 5) for i in range(8)], [_palo(10 + 13 * i, 60) for i in range(8)]]
+    table = StrokeTable.from_lines(lines)
+
+    assert estimate_spacing_mm(table, 1.0) == estimate_spacing_mm(lines, 1.0) == 9.5
+    assert estimate_order_pattern(table) == "ordenados"
+    assert to_global_lines(table, 100, 200).to_lines()[0][0]["cy"] == 220.0
+
+
+def test_stroke_table_is_not_iterable_by_line():
+    import pytest
+
+    table = StrokeTable.from_lines([[{"x": 1, "y": 2, "w": 3, "h": 9, "area": 20}]] * 2)
+
+    assert len(table) == 2 and table.num_lines == 2
+    with pytest.raises(TypeError):
+        list(table)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from src.benchmark_performance import benchmark_sheet
+from src.pipeline import process_image
+from src.synthetic import SheetSpec, render_sheet
+
+
+def test_render_sheet_is_reproducible_and_counted_by_pipeline():
+    img, truth = render_sheet(lines=8, palos_per_line=40, slant_deg=5, seed=7)
+    again, _ = render_sheet(lines=8, palos_per_line=40, slant_deg=5, seed=7)
+    assert np.array_equal(img, again)
+    assert truth["total"] == 320 and truth["line_counts"] == [40] * 8
+
+    result = process_image(img, output_dir=None, save_artifacts=False)
+    assert result.metrics["total"] == truth["total"]
+    assert result.line_counts == truth["line_counts"]
+
+
+def test_render_sheet_rejects_overlapping_layout():
+    with pytest.raises(ValueError):
+        render_sheet(lines=40)
+
+
+def test_benchmark_sheet_reports_stage_latencies():
+    case = benchmark_sheet(SheetSpec(lines=6, palos_per_line=30, scale=0.6), repeat=2, warmup=0)
+
+    assert case["abs_error_total"] == 0
+    assert {"decode", "find_document_contour", "binarize", "find_palos", "group_lines"} <= set(case["stages"])
+    assert case["total"]["median_ms"] > 0 and case["sheets_per_second"] > 0
@@ -0,0 +1,74 @@
+import json
+
+from src.pipeline import process_image
+from src.tracing import NULL_TRACER, StageTracer, append_trace_jsonl, make_tracer, write_chrome_trace
+
+
+def test_trace_disabled_by_default(sheet_image_path):
+    result = process_image(sheet_image_path, output_dir=None, save_artifacts=False)
+    assert result.trace is None and "trace" not in result.metrics
+    assert make_tracer(False) is NULL_TRACER
+    assert NULL_TRACER.span("a") is NULL_TRACER.span("b")
+
+
+def test_trace_records_each_stage(sheet_image_path, tmp_path):
+    result = process_image(
+        sheet_image_path, output_dir=str(tmp_path / "out"), save_artifacts=True, trace=StageTracer(memory=True)
+    )
+
+    stages = [s["stage"] for s in result.trace["stages"]]
+    assert stages == [
+        "decode",
+        "find_document_contour",
+        "warp",
+        "binarize",
+        "find_palos",
+        "group_lines",
+        "overlay",
+        "measure",
+        "score",
+        "save_outputs",
+    ]
+    assert result.metrics["trace"] is result.trace
+    assert result.trace["wall_ms"] >= sum(s["wall_ms"] for s in result.trace["stages"]) * 0.99
+    assert all(s["peak_alloc_kb"] >= 0 for s in result.trace["stages"])
+    assert result.trace["peak_alloc_kb"] > 0
+
+    untimed = process_image(sheet_image_path, output_dir=None, save_artifacts=False, trace=True)
+    assert "peak_alloc_kb" not in untimed.trace["stages"][0]
+    assert [s["stage"] for s in untimed.trace["stages"]][:3] == ["decode", "find_document_contour", "warp"]
+
+
+def test_concurrent_tracers_share_tracemalloc():
+    import tracemalloc
+
+    assert not tracemalloc.is_tracing()
+    first, second = StageTracer(memory=True), StageTracer(memory=True)
+    first.start()
+    second.start()
+    first.stop()
+    assert tracemalloc.is_tracing()
+    second.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_trace_exports(tmp_path):
+    tracer = StageTracer(memory=False)
+    tracer.start()
+    with tracer.span("binarize"):
+        pass
+    tracer.stop()
+    trace = tracer.to_dict()
+
+    jsonl = tmp_path / "trace.jsonl"
+    append_trace_jsonl(str(jsonl), trace, image_path="a.jpg")
+    append_trace_jsonl(str(jsonl), trace, image_path="b.jpg")
+    lines = [json.loads(line) for line in jsonl.read_text(encoding="utf-8").splitlines()]
+    assert [(r["image_path"], r["stage"]) for r in lines] == [("a.jpg", "binarize"), ("b.jpg", "binarize")]
+
+    chrome = tmp_path / "trace.json"
+    write_chrome_trace(str(chrome), [trace, trace], names=["a.jpg", "b.jpg"])
+    events = json.loads(chrome.read_text(encoding="utf-8"))["traceEvents"]
+    spans = [e for e in events if e["ph"] == "X"]
+    assert [e["tid"] for e in spans] == [0, 1]
+    assert spans[0]["name"] == "binarize" and spans[0]["dur"] >= 0
@@ -0,0 +1,49 @@
+import json
+
+from src.validator import iter_records, run_validation
+
+
+def test_validation_appends_records_and_resumes(sheet_image_path, tmp_path):
+    records = tmp_path / "validacao.jsonl"
+    rows = [
+        {"image_path": sheet_image_path, "total_gt": "300", "errors": "0", "line_counts_gt": "50;50;50;50;50;50"},
+        {"image_path": str(tmp_path / "faltando.png"), "total_gt": "10", "errors": "0"},
+    ]
+
+    first = run_validation(rows, str(records), workers=2)
+    assert first["summary"]["processed"] == 2 and first["summary"]["resumed"] == 0
+    assert first["summary"]["num_validated"] == 1 and first["summary"]["num_failed"] == 1
+    saved = list(iter_records(str(records)))
+    assert {r["status"] for r in saved} == {"ok", "erro"}
+    assert "metrics_pred" in next(r for r in saved if r["status"] == "ok")
+
+    # Linha truncada no fim (queda durante a escrita) nao quebra a retomada.
+    with open(records, "a", encoding="utf-8") as f:
+        f.write('{"key": "trunc')
+
+    second = run_validation(rows, str(records), workers=1)
+    assert second["summary"]["resumed"] == 1 and second["summary"]["processed"] == 1
+    for field in ("mae_total", "line_mae", "config_hash"):
+        assert second["summary"][field] == first["summary"][field]
+
+    third = run_validation(rows[:1], str(records), workers=1, binarize_method="box")
+    assert third["summary"]["resumed"] == 0 and third["summary"]["processed"] == 1
+    assert third["summary"]["config_hash"] != first["summary"]["config_hash"]
+    assert len(list(iter_records(str(records)))) == len(saved) + 2
+    json.dumps(third)
+
+
+def test_validation_scores_duplicate_ground_truth_rows(sheet_image_path, tmp_path):
+    records = tmp_path / "avaliadores.jsonl"
+    rows = [
+        {"image_path": sheet_image_path, "total_gt": "300", "errors": "0"},
+        {"image_path": sheet_image_path, "total_gt": "290", "errors": "0"},
+    ]
+
+    first = run_validation(rows, str(records), workers=1)
+    assert first["summary"]["num_images"] == 2 and first["summary"]["processed"] == 2
+    assert sorted(r["total_gt"] for r in first["per_image"]) == [290, 300]
+
+    again = run_validation(rows, str(records), workers=1)
+    assert again["summary"]["resumed"] == 2 and again["summary"]["processed"] == 0
+    assert again["summary"]["mae_total"] == first["summary"]["mae_total"]